@@ -0,0 +1,138 @@
+"""
+后台批量操作：一次请求提交多条用户修改，在同一个事务里按操作类型各执行一条集合 SQL。
+
+每一项的格式：
+    {"op": "block" | "unblock" | "set_points" | "adjust_points" | "reset_plays" | "delete",
+     "user_id": 123, "points": 100, "delta": -50}
+
+同一批里的操作按 封禁/解封 → 设置积分 → 加减积分 → 重置次数 → 删除 的顺序执行；
+同一用户多次设置积分以最后一项为准，多次加减积分累加。
+"""
+import queries
+import referrals
+
+MAX_ITEMS = 1000
+
+OPS = ("block", "unblock", "set_points", "adjust_points", "reset_plays", "delete")
+
+
+class BulkResult:
+    def __init__(self, items):
+        self.items = [{"index": i, "op": None, "user_id": None, "ok": False, "error": None}
+                      for i in range(len(items))]
+        self.points = {}  # 积分有变化的用户 -> 最新积分，提交后同步到排行榜
+        self.touched = set()  # 需要失效缓存的用户
+        self.deleted = []
+        self.deleted_phones = []
+
+    def fail(self, index, error):
+        self.items[index]["error"] = error
+
+    def succeed(self, index, user_id):
+        self.items[index]["ok"] = True
+        self.touched.add(user_id)
+
+    def summary(self):
+        ok = sum(1 for item in self.items if item["ok"])
+        return {"ok": ok, "failed": len(self.items) - ok, "results": self.items}
+
+
+def parse_int(value, bits=64):
+    """bool 不算整数；超出 bits 位有符号整数范围的也拒绝，免得写库时才报错"""
+    if isinstance(value, bool):
+        raise ValueError
+    value = int(value)
+    if not -2 ** (bits - 1) <= value < 2 ** (bits - 1):
+        raise ValueError
+    return value
+
+
+def parse(items, result):
+    """校验每一项，返回 {op: [(index, user_id, 参数)]}；不合法的项直接记为失败"""
+    grouped = {op: [] for op in OPS}
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            result.fail(index, "格式错误")
+            continue
+        op = item.get("op")
+        result.items[index]["op"] = op
+        if op not in OPS:
+            result.fail(index, "不支持的操作")
+            continue
+        try:
+            user_id = parse_int(item.get("user_id"))
+        except (TypeError, ValueError):
+            result.fail(index, "缺少 user_id")
+            continue
+        result.items[index]["user_id"] = user_id
+
+        value = None
+        if op in ("set_points", "adjust_points"):
+            key = "points" if op == "set_points" else "delta"
+            try:
+                value = parse_int(item.get(key))
+            except (TypeError, ValueError):
+                result.fail(index, f"{key} 必须是整数")
+                continue
+        grouped[op].append((index, user_id, value))
+    return grouped
+
+
+def _apply(c, sql, params, entries, result):
+    """执行一条集合 SQL，按 RETURNING 回来的 user_id 标记每一项成功或失败"""
+    c.execute(sql, params)
+    rows = {row[0]: row for row in c.fetchall()}
+    for index, user_id, _ in entries:
+        if user_id in rows:
+            result.succeed(index, user_id)
+        else:
+            result.fail(index, "用户不存在")
+    return rows
+
+
+def apply_bulk(conn, items, today):
+    """在 conn 的事务里执行全部操作（由调用方提交），返回 BulkResult"""
+    result = BulkResult(items)
+    grouped = parse(items, result)
+
+    with conn.cursor() as c:
+        blocked = grouped["block"] + grouped["unblock"]
+        if blocked:
+            flags = {index: items[index]["op"] == "block" for index, _, _ in blocked}
+            # 同一用户多次出现时以最后一项为准
+            latest = {user_id: flags[index] for index, user_id, _ in sorted(blocked)}
+            _apply(c, queries.BULK_SET_BLOCKED_SQL,
+                   {"user_ids": list(latest), "blocked": list(latest.values())}, blocked, result)
+
+        if grouped["set_points"]:
+            latest = {user_id: points for _, user_id, points in grouped["set_points"]}
+            rows = _apply(c, queries.BULK_SET_POINTS_SQL,
+                          {"user_ids": list(latest), "points": list(latest.values())},
+                          grouped["set_points"], result)
+            result.points.update({user_id: points for user_id, points in rows.values()})
+
+        if grouped["adjust_points"]:
+            entries = grouped["adjust_points"]
+            rows = _apply(c, queries.BULK_ADJUST_POINTS_SQL,
+                          {"user_ids": [user_id for _, user_id, _ in entries],
+                           "deltas": [delta for _, _, delta in entries]},
+                          entries, result)
+            result.points.update({user_id: points for user_id, points in rows.values()})
+
+        if grouped["reset_plays"]:
+            entries = grouped["reset_plays"]
+            _apply(c, queries.BULK_RESET_PLAYS_SQL,
+                   {"user_ids": list({user_id for _, user_id, _ in entries}), "today": today},
+                   entries, result)
+
+        if grouped["delete"]:
+            entries = grouped["delete"]
+            rows = _apply(c, queries.BULK_DELETE_SQL,
+                          {"user_ids": list({user_id for _, user_id, _ in entries})}, entries, result)
+            result.deleted = list(rows)
+            referrals.remove_users(c, result.deleted)
+            result.deleted_phones = [phone for _, phone in rows.values() if phone]
+            for user_id in rows:
+                result.points.pop(user_id, None)
+
+    return result
@@ -0,0 +1,98 @@
+"""
+静态资源和页面的 HTTP 缓存。
+
+- /assets/<文件名>：tools/build_assets.py 生成的带哈希文件，Cache-Control 一年 + immutable；
+  浏览器支持时直接返回预压缩的 .br / .gz
+- 模板里用 asset_url("dice 1.png") 取地址，找不到构建结果时退回 /static 下的源文件
+  （asset_url 返回 None 表示没有这个格式，例如未构建时的 .webp）
+- 渲染出来的 HTML 页面加 ETag 和 Cache-Control: private, no-cache，内容没变时返回 304
+"""
+import os
+import json
+import logging
+import mimetypes
+
+from flask import request, url_for, send_from_directory, abort
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+DIST_DIR = os.path.join(STATIC_DIR, "dist")
+
+# 按优先级
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+_manifest = None
+_dist_files = frozenset()
+
+
+def load_manifest():
+    """读取 static/dist/manifest.json；只在启动时调用一次，构建结果随部署更新"""
+    global _manifest, _dist_files
+    try:
+        with open(os.path.join(DIST_DIR, "manifest.json"), encoding="utf-8") as f:
+            _manifest = json.load(f)
+        _dist_files = frozenset(os.listdir(DIST_DIR))
+    except FileNotFoundError:
+        logger.warning("没有找到 static/dist/manifest.json，静态资源不带哈希，请运行 tools/build_assets.py")
+        _manifest = {}
+        _dist_files = frozenset()
+    return _manifest
+
+
+def asset_url(name):
+    if _manifest is None:
+        load_manifest()
+    hashed = _manifest.get(name)
+    if hashed:
+        return url_for("asset", filename=hashed)
+    if os.path.isfile(os.path.join(STATIC_DIR, name)):
+        return url_for("static", filename=name)
+    return None
+
+
+def serve_asset(filename):
+    if _manifest is None:
+        load_manifest()
+    if filename not in _dist_files or filename == "manifest.json":
+        abort(404)
+
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    variants = [(name, filename + suffix) for name, suffix in ENCODINGS if filename + suffix in _dist_files]
+    encoding = None
+    for name, variant in variants:
+        if request.accept_encodings[name]:
+            encoding, filename = name, variant
+            break
+
+    response = send_from_directory(DIST_DIR, filename, mimetype=mimetype, max_age=config.ASSET_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    if variants:
+        response.vary.add("Accept-Encoding")
+    return response
+
+
+def _page_etag(response):
+    """GET 渲染的页面加 ETag，内容没变时返回 304（body 仍会渲染，省的是传输）"""
+    if (request.method not in ("GET", "HEAD") or response.status_code != 200
+            or response.mimetype != "text/html" or response.is_streamed
+            or response.direct_passthrough or "ETag" in response.headers):
+        return response
+    response.add_etag()
+    if not response.headers.get("Cache-Control"):
+        # 页面里有用户数据，不能让共享缓存保存；每次都要带 ETag 回来验证
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def install(app):
+    load_manifest()
+    app.add_url_rule("/assets/<path:filename>", "asset", serve_asset)
+    app.jinja_env.globals["asset_url"] = asset_url
+    app.after_request(_page_etag)
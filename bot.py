@@ -1,31 +1,67 @@
-import os
-import random
-import psycopg2
 import asyncio
 import logging
-import nest_asyncio
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 
-nest_asyncio.apply()
-
-from dotenv import load_dotenv
+from config import config
+from db import get_conn, pool_stats
+import metrics
+import cache
+import referrals
+from leaderboard import get_leaderboard, top_users
 from telegram import (
     Update, KeyboardButton, ReplyKeyboardMarkup,
     InlineKeyboardMarkup, InlineKeyboardButton
 )
 from telegram.ext import (
     ApplicationBuilder, CommandHandler, MessageHandler,
-    CallbackQueryHandler, ContextTypes, filters
+    CallbackQueryHandler, ContextTypes, BaseUpdateProcessor, filters
 )
 
-load_dotenv()
-logging.basicConfig(level=logging.INFO)
-
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-DATABASE_URL = os.getenv("DATABASE_URL")
+logging.basicConfig(level=config.LOG_LEVEL)
 
 # --- DB Helper ---
-def get_conn():
-    return psycopg2.connect(DATABASE_URL)
+# psycopg2 是阻塞的，所有查询放到有上限的线程池里执行，不占用事件循环。
+# 线程数与连接池上限一致，线程拿连接时不会排队。
+DB_EXECUTOR = ThreadPoolExecutor(max_workers=config.DB_POOL_MAX, thread_name_prefix="bot-db")
+
+# /invitees 消息里最多列出的好友数（Telegram 单条消息长度有限）
+INVITEES_SHOWN = 30
+
+async def run_db(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    # 带上当前 context，SQL 统计才能记到对应的 handler 上
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(DB_EXECUTOR, functools.partial(ctx.run, fn, *args, **kwargs))
+
+def db_set_inviter(user_id, inviter_id):
+    with get_conn() as conn, conn.cursor() as cur:
+        referrals.link(cur, user_id, inviter_id)
+
+def db_save_contact(user_id, username, phone):
+    with get_conn() as conn, conn.cursor() as cur:
+        # old 在语句开始时的快照里读取，拿到的是修改前的手机号
+        cur.execute("""
+            WITH old AS (SELECT phone FROM users WHERE user_id = %(user_id)s)
+            INSERT INTO users (user_id, username, phone)
+            VALUES (%(user_id)s, %(username)s, %(phone)s)
+            ON CONFLICT (user_id) DO UPDATE
+            SET phone = EXCLUDED.phone
+            RETURNING (SELECT phone FROM old)
+        """, {"user_id": user_id, "username": username, "phone": phone})
+        old_phone = cur.fetchone()[0]
+    # 未配置 REDIS_URL 时 web 进程的本地缓存不受影响，等 CACHE_TTL 过期
+    cache.invalidate_user(user_id, phones=(phone, old_phone))
+
+def db_fetch_rank(user_id):
+    rows = [(u["username"], u["score"]) for u in top_users(10)]
+    my_rank = get_leaderboard().rank(user_id) if user_id else None
+    return rows, my_rank
+
+def db_fetch_invitees(user_id):
+    rows, _ = referrals.downline(user_id, max_depth=1, limit=INVITEES_SHOWN)
+    return referrals.get_counts(user_id), rows
 
 # --- Utilities ---
 def get_user_id(update: Update):
@@ -49,9 +85,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
 
         # 存储 inviter_id -> 可保存到数据库或 session 映射（例如 Redis/session/临时表）
-        with get_conn() as conn, conn.cursor() as cur:
-            cur.execute("UPDATE users SET invited_by = %s WHERE user_id = %s AND invited_by IS NULL", (inviter_id, user_id))
-            conn.commit()
+        await run_db(db_set_inviter, user_id, inviter_id)
 
     keyboard = [
         [InlineKeyboardButton("📱 绑定手机号", callback_data="bind")],
@@ -77,14 +111,7 @@ async def contact_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     phone = contact.phone_number
 
     try:
-        with get_conn() as conn, conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO users (user_id, username, phone)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (user_id) DO UPDATE
-                SET phone = EXCLUDED.phone
-            """, (user_id, update.message.from_user.username, phone))
-            conn.commit()
+        await run_db(db_save_contact, user_id, update.message.from_user.username, phone)
     except Exception as e:
         logging.exception("数据库保存手机号失败")
         await update.message.reply_text("❌ 绑定失败，请稍后重试。")
@@ -99,10 +126,9 @@ async def contact_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # --- Command: /rank ---
 async def show_rank(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = get_chat_id(update)
+    user_id = get_user_id(update)
     try:
-        with get_conn() as conn, conn.cursor() as c:
-            c.execute("SELECT username, points FROM users WHERE points IS NOT NULL ORDER BY points DESC LIMIT 10")
-            rows = c.fetchall()
+        rows, my_rank = await run_db(db_fetch_rank, user_id)
     except Exception as e:
         logging.exception("查询排行榜失败")
         await context.bot.send_message(chat_id=chat_id, text="⚠️ 查询失败，请稍后重试。")
@@ -115,6 +141,8 @@ async def show_rank(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = "🏆 当前积分排行榜：\n"
     for i, (name, pts) in enumerate(rows, 1):
         msg += f"{i}. {name or '匿名'} - {pts} 分\n"
+    if my_rank:
+        msg += f"\n你当前排名第 {my_rank[0]} 名（{my_rank[1]} 分）"
     await context.bot.send_message(chat_id=chat_id, text=msg)
 
 # --- Command: share ---
@@ -130,13 +158,7 @@ async def invitees(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = get_user_id(update)
 
     try:
-        with get_conn() as conn, conn.cursor() as c:
-            c.execute("""
-                SELECT username, phone, points
-                FROM users
-                WHERE invited_by = %s
-            """, (user_id,))
-            rows = c.fetchall()
+        counts, rows = await run_db(db_fetch_invitees, user_id)
     except Exception as e:
         logging.exception("查询邀请失败")
         await context.bot.send_message(chat_id=chat_id, text="⚠️ 查询失败，请稍后重试。")
@@ -146,10 +168,12 @@ async def invitees(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await context.bot.send_message(chat_id=chat_id, text="你还没有邀请任何好友。")
         return
 
-    msg = f"📋 你已邀请 {len(rows)} 位好友：\n"
-    for i, (username, phone, points) in enumerate(rows, 1):
-        name = username or phone or "匿名"
-        msg += f"{i}. {name} - {points or 0} 分\n"
+    msg = f"📋 你已邀请 {counts['direct']} 位好友，团队共 {counts['total']} 人：\n"
+    for i, row in enumerate(rows, 1):
+        name = row["username"] or row["phone"] or "匿名"
+        msg += f"{i}. {name} - {row['points'] or 0} 分\n"
+    if counts["direct"] > len(rows):
+        msg += f"……（只显示前 {len(rows)} 位）\n"
 
     await context.bot.send_message(chat_id=chat_id, text=msg)
 
@@ -184,22 +208,116 @@ async def handle_menu_button(update: Update, context: ContextTypes.DEFAULT_TYPE)
     elif command == "help":
         await help_command(update, context)
 
+# --- Update Processor ---
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    不同聊天的更新并发处理，同一聊天内按到达顺序串行。
+    单个聊天积压超过 max_pending_per_chat 条时丢弃新的更新，避免刷屏占满并发额度。
+    shutdown 时等待正在处理的更新完成（最多 shutdown_timeout 秒）。
+
+    基类在调用 do_process_update 之前就占用信号量，排队等聊天锁的更新也会占着名额，
+    一个聊天刷屏就能把名额用光。所以基类的信号量只限制收下的更新总数，
+    真正的并发数由 _slots 控制，拿到聊天锁之后才占用。
+    """
+
+    def __init__(self, max_concurrent_updates, max_pending_per_chat=20, shutdown_timeout=10.0):
+        super().__init__(max_concurrent_updates * max_pending_per_chat)
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self.max_pending_per_chat = max_pending_per_chat
+        self.shutdown_timeout = shutdown_timeout
+        self._chats = {}  # chat_id -> [asyncio.Lock, 排队中的更新数]
+        self._in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def do_process_update(self, update, coroutine):
+        chat = update.effective_chat if isinstance(update, Update) else None
+        self._in_flight += 1
+        self._idle.clear()
+        try:
+            if chat is None:
+                async with self._slots:
+                    await coroutine
+                return
+
+            entry = self._chats.setdefault(chat.id, [asyncio.Lock(), 0])
+            if entry[1] >= self.max_pending_per_chat:
+                logging.warning("聊天 %s 积压过多，丢弃更新 %s", chat.id, update.update_id)
+                coroutine.close()
+                return
+            entry[1] += 1
+            try:
+                async with entry[0], self._slots:
+                    await coroutine
+            finally:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    self._chats.pop(chat.id, None)
+        finally:
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self._idle.set()
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        try:
+            await asyncio.wait_for(self._idle.wait(), self.shutdown_timeout)
+        except asyncio.TimeoutError:
+            logging.warning("等待 %s 个更新处理完成超时", self._in_flight)
+
 # --- Entry Point ---
-async def main():
-    application = ApplicationBuilder().token(BOT_TOKEN).build()
-    await application.bot.delete_webhook(drop_pending_updates=True)
+async def post_shutdown(application):
+    DB_EXECUTOR.shutdown(wait=True)
+
+def build_application():
+    application = (
+        ApplicationBuilder()
+        .token(config.BOT_TOKEN)
+        .base_url(f"{config.TELEGRAM_API_BASE.rstrip('/')}/bot")
+        .concurrent_updates(PerChatUpdateProcessor(
+            config.BOT_CONCURRENT_UPDATES,
+            max_pending_per_chat=config.BOT_MAX_PENDING_PER_CHAT,
+            shutdown_timeout=config.BOT_SHUTDOWN_TIMEOUT,
+        ))
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("bind", bind))
-    application.add_handler(CommandHandler("share", share))
-    application.add_handler(CommandHandler("rank", show_rank))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("invitees", invitees))
+    timed = metrics.instrument_handler
+    application.add_handler(CommandHandler("start", timed(start)))
+    application.add_handler(CommandHandler("bind", timed(bind)))
+    application.add_handler(CommandHandler("share", timed(share)))
+    application.add_handler(CommandHandler("rank", timed(show_rank)))
+    application.add_handler(CommandHandler("help", timed(help_command)))
+    application.add_handler(CommandHandler("invitees", timed(invitees)))
 
-    application.add_handler(CallbackQueryHandler(handle_menu_button))
-    application.add_handler(MessageHandler(filters.CONTACT, contact_handler))
+    application.add_handler(CallbackQueryHandler(timed(handle_menu_button)))
+    application.add_handler(MessageHandler(filters.CONTACT, timed(contact_handler)))
+    return application
 
-    await application.run_polling()
+def main():
+    if config.BOT_MODE == "webhook" and not config.BOT_WEBHOOK_URL:
+        # 不配置的话 PTB 会用监听地址拼出 http://0.0.0.0:<port>/... 注册给 Telegram
+        raise SystemExit("BOT_MODE=webhook 时必须配置 BOT_WEBHOOK_URL（对外的 https 地址）")
+    application = build_application()
+    if config.BOT_METRICS_PORT:
+        metrics.start_http_server(config.BOT_METRICS_PORT, gauges=lambda: {"db_pool": pool_stats()})
+    # 收到 SIGINT/SIGTERM 后停止接收新更新，等已接收的更新处理完再退出
+    if config.BOT_MODE == "webhook":
+        webhook_url = f"{config.BOT_WEBHOOK_URL.rstrip('/')}/{config.BOT_WEBHOOK_PATH}"
+        application.run_webhook(
+            listen=config.BOT_WEBHOOK_LISTEN,
+            port=config.BOT_WEBHOOK_PORT,
+            url_path=config.BOT_WEBHOOK_PATH,
+            webhook_url=webhook_url,
+            secret_token=config.BOT_WEBHOOK_SECRET,
+            max_connections=config.BOT_CONCURRENT_UPDATES,
+            drop_pending_updates=True,
+        )
+    else:
+        application.run_polling(drop_pending_updates=True)
 
 if __name__ == "__main__":
-    asyncio.get_event_loop().run_until_complete(main())
+    main()
@@ -0,0 +1,210 @@
+"""
+用户资料的读缓存：/dice 的剩余次数和登录时的手机号 → user_id。
+
+页面加载远多于游戏次数，命中缓存时不访问数据库。修改用户的路由在提交后
+负责失效（或直接写入新值）：play_dice、save_user、delete_user、/user/bulk、绑定相关路由和 bot。
+
+后端二选一（与 leaderboard 相同）：
+- 配置 REDIS_URL 时使用 Redis，多个进程共享，失效对所有进程生效；
+- 否则使用进程内带 TTL 的 LRU。多个 gunicorn worker 各有一份，别的 worker 的修改
+  最多 CACHE_TTL 秒后才能看到。剩余次数只用于展示，真正的次数限制在
+  play_round 的 SQL 里判断，所以短暂不一致不影响正确性。
+"""
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from config import config
+from db import get_conn
+import metrics
+import queries
+
+try:
+    import redis
+except ImportError:  # 可选依赖
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+
+CACHE_REQUESTS = metrics.Counter("cache_requests_total", "用户缓存命中 / 未命中次数", ("kind", "result"))
+
+
+class LocalCache:
+    """进程内 LRU，每个条目带过期时间"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (过期时间, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return MISSING
+            if item[0] <= now:
+                del self._data[key]
+                return MISSING
+            self._data.move_to_end(key)
+            return item[1]
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def add(self, key, value, ttl=None):
+        """key 不存在（或已过期）时写入并返回 True，否则返回 False"""
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[0] > now:
+                return False
+            self._data[key] = (now + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedisCache:
+    def __init__(self, url, ttl):
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        raw = self.client.get(key)
+        if raw is None:
+            return MISSING
+        return json.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, json.dumps(value), ex=max(1, int(self.ttl if ttl is None else ttl)))
+
+    def add(self, key, value, ttl=None):
+        return bool(self.client.set(key, json.dumps(value), nx=True,
+                                    ex=max(1, int(self.ttl if ttl is None else ttl))))
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*keys)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if config.REDIS_URL and redis is not None:
+                    _backend = RedisCache(config.REDIS_URL, config.CACHE_TTL)
+                else:
+                    if config.REDIS_URL:
+                        logger.warning("已配置 config.REDIS_URL 但未安装 redis 包，用户缓存使用进程内存储")
+                    _backend = LocalCache(config.CACHE_MAX_ENTRIES, config.CACHE_TTL)
+    return _backend
+
+
+def _quota_key(user_id):
+    return f"{config.CACHE_KEY_PREFIX}quota:{int(user_id)}"
+
+
+def _phone_key(phone):
+    return f"{config.CACHE_KEY_PREFIX}phone:{phone}"
+
+
+def _cached(kind, key, loader, negative_ttl=None):
+    """读缓存，未命中时调 loader 并写回；缓存出错时直接读数据库"""
+    backend = get_backend()
+    try:
+        value = backend.get(key)
+    except Exception:
+        logger.exception("读取缓存失败")
+        return loader()
+    if value is not MISSING:
+        CACHE_REQUESTS.inc(kind, "hit")
+        return value
+
+    CACHE_REQUESTS.inc(kind, "miss")
+    value = loader()
+    try:
+        backend.set(key, value, negative_ttl if value is None else None)
+    except Exception:
+        logger.exception("写入缓存失败")
+    return value
+
+
+def _delete(*keys):
+    try:
+        get_backend().delete(*keys)
+    except Exception:
+        logger.exception("删除缓存失败")
+
+
+# --- 剩余次数 ---
+def get_user_quota(user_id):
+    """{"plays": 今日已玩次数, "daily_reset": "YYYY-MM-DD" 或 None}，用户不存在返回 None"""
+    def load():
+        with get_conn() as conn, conn.cursor() as c:
+            c.execute(queries.USER_QUOTA_SQL, {"user_id": user_id})
+            row = c.fetchone()
+        if row is None:
+            return None
+        plays, daily_reset = row
+        return {"plays": plays or 0, "daily_reset": daily_reset.isoformat() if daily_reset else None}
+
+    return _cached("quota", _quota_key(user_id), load, config.CACHE_NEGATIVE_TTL)
+
+
+def set_user_quota(user_id, plays, day):
+    """play_dice 提交后直接写入最新次数，下次加载 /dice 不必再查"""
+    try:
+        get_backend().set(_quota_key(user_id), {"plays": plays, "daily_reset": day.isoformat()})
+    except Exception:
+        logger.exception("写入缓存失败")
+
+
+# --- 手机号登录 ---
+def get_user_id_by_phone(phone):
+    """未绑定的手机号也缓存（CACHE_NEGATIVE_TTL 秒），绑定后由绑定路由失效"""
+    def load():
+        with get_conn() as conn, conn.cursor() as c:
+            c.execute(queries.LOGIN_SQL, {"phone": phone})
+            row = c.fetchone()
+        return row[0] if row else None
+
+    return _cached("phone", _phone_key(phone), load, config.CACHE_NEGATIVE_TTL)
+
+
+# --- 失效 ---
+def invalidate_user(user_id, phones=()):
+    """用户行被修改或删除后调用；phones 为受影响的手机号（修改前后的都要传）"""
+    invalidate_users([user_id] if user_id is not None else [], phones)
+
+
+def invalidate_users(user_ids, phones=()):
+    """批量失效，一次删除所有 key"""
+    keys = [_phone_key(phone) for phone in phones if phone]
+    keys.extend(_quota_key(user_id) for user_id in user_ids)
+    if keys:
+        _delete(*keys)
@@ -0,0 +1,150 @@
+"""
+集中管理所有配置项，值来自环境变量（本地开发可写在 .env）。
+
+其他模块统一 `from config import config` 读取，不再各自调用 os.getenv。
+"""
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def _str(name, default=None):
+    return os.getenv(name, default)
+
+
+def _int(name, default):
+    return int(os.getenv(name, default))
+
+
+def _float(name, default):
+    return float(os.getenv(name, default))
+
+
+def _bool(name, default):
+    return os.getenv(name, default).lower() in ("1", "true", "yes", "on")
+
+
+class Config:
+    def __init__(self):
+        # --- Web ---
+        self.SECRET_KEY = _str("SECRET_KEY", "devsecret")
+        self.DEBUG = _bool("FLASK_DEBUG", "0")
+        self.PORT = _int("PORT", "5000")
+        self.WEB_CONCURRENCY = _int("WEB_CONCURRENCY", str(min(8, 2 * (os.cpu_count() or 1) + 1)))
+        self.WEB_THREADS = _int("WEB_THREADS", "4")
+        self.WEB_TIMEOUT = _int("WEB_TIMEOUT", "30")  # 单个请求超过这个秒数 worker 会被重启
+        self.WEB_GRACEFUL_TIMEOUT = _int("WEB_GRACEFUL_TIMEOUT", "30")
+        self.WEB_MAX_REQUESTS = _int("WEB_MAX_REQUESTS", "0")  # >0 时每个 worker 处理这么多请求后自动重启
+        self.WEB_PRELOAD = _bool("WEB_PRELOAD", "1")
+        self.ADMIN_PAGE_SIZE = _int("ADMIN_PAGE_SIZE", "50")
+        self.ASSET_MAX_AGE = _int("ASSET_MAX_AGE", str(365 * 86400))  # /assets 下带哈希的文件
+        # 前面有几层反向代理，用于从 X-Forwarded-For 取真实 IP；Heroku（有 DYNO 环境变量）默认 1，否则 0。
+        # 设错了的话按 IP 的限流会把所有人当成同一个 IP（路由器的地址）
+        self.PROXY_COUNT = _int("PROXY_COUNT", "1" if os.getenv("DYNO") else "0")
+
+        # --- 限流（ratelimit.py），速率单位为 次/秒 ---
+        self.RATE_LIMIT_ENABLED = _bool("RATE_LIMIT_ENABLED", "1")
+        self.RATE_LIMIT_MAX_KEYS = _int("RATE_LIMIT_MAX_KEYS", "100000")
+        self.RATE_LIMIT_PLAY_USER_RATE = _float("RATE_LIMIT_PLAY_USER_RATE", "1")
+        self.RATE_LIMIT_PLAY_USER_BURST = _float("RATE_LIMIT_PLAY_USER_BURST", "5")
+        self.RATE_LIMIT_PLAY_SESSION_RATE = _float("RATE_LIMIT_PLAY_SESSION_RATE", "1")
+        self.RATE_LIMIT_PLAY_SESSION_BURST = _float("RATE_LIMIT_PLAY_SESSION_BURST", "5")
+        self.RATE_LIMIT_PLAY_IP_RATE = _float("RATE_LIMIT_PLAY_IP_RATE", "10")
+        self.RATE_LIMIT_PLAY_IP_BURST = _float("RATE_LIMIT_PLAY_IP_BURST", "30")
+        # 单个会话比整个 IP 先被限住，同一出口 IP（NAT、公司网络）后面的其他人还能登录
+        self.RATE_LIMIT_LOGIN_SESSION_RATE = _float("RATE_LIMIT_LOGIN_SESSION_RATE", "0.05")
+        self.RATE_LIMIT_LOGIN_SESSION_BURST = _float("RATE_LIMIT_LOGIN_SESSION_BURST", "5")
+        self.RATE_LIMIT_LOGIN_IP_RATE = _float("RATE_LIMIT_LOGIN_IP_RATE", "0.2")
+        self.RATE_LIMIT_LOGIN_IP_BURST = _float("RATE_LIMIT_LOGIN_IP_BURST", "10")
+
+        # --- 日志 / 指标 ---
+        self.LOG_LEVEL = _str("LOG_LEVEL", "INFO").upper()
+        self.SLOW_QUERY_MS = _float("SLOW_QUERY_MS", "200")  # 单条 SQL 超过这个毫秒数记慢查询日志
+        self.SLOW_REQUEST_MS = _float("SLOW_REQUEST_MS", "1000")
+        self.BOT_METRICS_PORT = _int("BOT_METRICS_PORT", "0")  # >0 时 bot 在该端口提供 /metrics
+
+        # --- 数据库 ---
+        self.DATABASE_URL = _str("DATABASE_URL")
+        self.DB_POOL_MIN = _int("DB_POOL_MIN", "1")
+        self.DB_POOL_MAX = _int("DB_POOL_MAX", "10")
+        self.DB_POOL_IDLE_TIMEOUT = _float("DB_POOL_IDLE_TIMEOUT", "300")
+        self.DB_POOL_CHECKOUT_TIMEOUT = _float("DB_POOL_CHECKOUT_TIMEOUT", "5")
+        self.DB_POOL_HEALTH_CHECK_INTERVAL = _float("DB_POOL_HEALTH_CHECK_INTERVAL", "30")
+        self.DB_STATEMENT_TIMEOUT_MS = _int("DB_STATEMENT_TIMEOUT_MS", "0")  # 0 表示不限制
+
+        # --- game_logs 写入 ---
+        self.GAME_LOG_MODE = _str("GAME_LOG_MODE", "sync")  # sync | async
+        self.GAME_LOG_BATCH_SIZE = _int("GAME_LOG_BATCH_SIZE", "200")
+        self.GAME_LOG_FLUSH_INTERVAL = _float("GAME_LOG_FLUSH_INTERVAL", "1.0")
+        self.GAME_LOG_QUEUE_SIZE = _int("GAME_LOG_QUEUE_SIZE", "10000")
+        self.GAME_LOG_SPOOL_PATH = _str("GAME_LOG_SPOOL_PATH", "game_logs.spool")
+        self.GAME_LOG_PARTITIONS_AHEAD = _int("GAME_LOG_PARTITIONS_AHEAD", "3")  # 提前建好的月分区数
+        self.GAME_LOG_RETENTION_MONTHS = _int("GAME_LOG_RETENTION_MONTHS", "0")  # 原始日志保留月数，0 表示不删除
+
+        # --- 骰子（dice_engine.py）---
+        self.DICE_ENGINE = _str("DICE_ENGINE", "secrets")  # secrets | seeded | fair
+        self.DICE_SEED = _int("DICE_SEED", "0")  # 只用于 seeded
+        self.DICE_FAIR_SECRET = _str("DICE_FAIR_SECRET")  # fair 模式生成每日服务端种子的密钥，不能泄露也不要更换
+        self.DICE_BUFFER_SIZE = _int("DICE_BUFFER_SIZE", "4096")  # secrets 模式每次取的随机字节数
+
+        # --- 排行榜 / Redis ---
+        self.REDIS_URL = _str("REDIS_URL")
+        self.LEADERBOARD_REFRESH_SECONDS = _float("LEADERBOARD_REFRESH_SECONDS", "60")
+        self.LEADERBOARD_KEY_PREFIX = _str("LEADERBOARD_KEY_PREFIX", "dice:lb:")
+
+        # --- 实时推送（live.py，/live/stream）---
+        self.LIVE_TICK = _float("LIVE_TICK", "1.0")  # 秒；这段时间内的多次变化合并成一次推送
+        self.LIVE_REFRESH = _float("LIVE_REFRESH", "30")  # 秒；没有本进程的对局时也至少这么久刷新一次榜单
+        # 观看者由独立的异步进程 live_server.py 服务，连接不占线程；这是它单进程的连接上限
+        self.LIVE_MAX_CONNECTIONS = _int("LIVE_MAX_CONNECTIONS", "10000")
+        self.LIVE_HOST = _str("LIVE_HOST", "0.0.0.0")
+        self.LIVE_PORT = _int("LIVE_PORT", "8001")
+        # 页面里 EventSource 连接的地址。反向代理把 /live/stream 转给 live_server.py 时保持默认；
+        # 单独的域名 / 端口时填完整地址（例如 https://live.example.com/live/stream），web 进程的 /live/stream 会重定向过去
+        self.LIVE_STREAM_URL = _str("LIVE_STREAM_URL", "")
+        self.LIVE_ALLOW_ORIGIN = _str("LIVE_ALLOW_ORIGIN", "*")  # live_server.py 跨域时返回的 Access-Control-Allow-Origin
+        # 没有部署 live_server.py 时 web 进程自己推送，每个观看者占一个 gthread 线程，
+        # 所以每个 worker 只给这么几个，并且至少留一个线程给普通请求
+        self.LIVE_INLINE_CONNECTIONS = _int("LIVE_INLINE_CONNECTIONS", "1")
+        self.LIVE_CLIENT_QUEUE = _int("LIVE_CLIENT_QUEUE", "16")  # 每个连接最多积压的事件数，超过就断开
+        self.LIVE_HEARTBEAT = _float("LIVE_HEARTBEAT", "15")  # 秒
+        self.LIVE_RECENT_WINS = _int("LIVE_RECENT_WINS", "5")
+        self.LIVE_BIG_WIN_POINTS = _int("LIVE_BIG_WIN_POINTS", "10")  # 一局赢到这么多积分才进入赢局播报
+
+        # --- 统计报表（tools/analytics.py，/admin/analytics）---
+        self.ANALYTICS_DATABASE_URL = _str("ANALYTICS_DATABASE_URL")  # 只读副本；未配置时读 DATABASE_URL
+        self.ANALYTICS_DIR = _str("ANALYTICS_DIR", "analytics")
+
+        # --- 用户缓存（cache.py）---
+        self.CACHE_TTL = _float("CACHE_TTL", "30")  # 秒；未配置 REDIS_URL 时也是各 worker 之间最长的不一致时间
+        self.CACHE_NEGATIVE_TTL = _float("CACHE_NEGATIVE_TTL", "5")  # 未绑定手机号 / 不存在的用户
+        self.CACHE_MAX_ENTRIES = _int("CACHE_MAX_ENTRIES", "100000")
+        self.CACHE_KEY_PREFIX = _str("CACHE_KEY_PREFIX", "dice:cache:")
+
+        # --- Telegram ---
+        self.BOT_TOKEN = _str("BOT_TOKEN")
+        self.AUTH_MAX_AGE = _int("AUTH_MAX_AGE", "86400")  # Telegram 登录数据 auth_date 的有效期（秒）
+        self.AUTH_REPLAY_CACHE_SIZE = _int("AUTH_REPLAY_CACHE_SIZE", "100000")
+        self.TELEGRAM_API_BASE = _str("TELEGRAM_API_BASE", "https://api.telegram.org")
+        self.NOTIFY_WORKERS = _int("NOTIFY_WORKERS", "2")
+        self.NOTIFY_QUEUE_SIZE = _int("NOTIFY_QUEUE_SIZE", "10000")
+        self.NOTIFY_GLOBAL_RATE = _float("NOTIFY_GLOBAL_RATE", "25")  # 条/秒
+        self.NOTIFY_PER_CHAT_INTERVAL = _float("NOTIFY_PER_CHAT_INTERVAL", "1.0")  # 秒
+        self.NOTIFY_MAX_RETRIES = _int("NOTIFY_MAX_RETRIES", "5")
+        self.NOTIFY_TIMEOUT = _float("NOTIFY_TIMEOUT", "10")
+
+        # --- Bot ---
+        self.BOT_MODE = _str("BOT_MODE", "polling")  # polling | webhook
+        self.BOT_WEBHOOK_LISTEN = _str("BOT_WEBHOOK_LISTEN", "0.0.0.0")
+        self.BOT_WEBHOOK_PORT = _int("BOT_WEBHOOK_PORT", _str("PORT", "8443"))
+        self.BOT_WEBHOOK_PATH = _str("BOT_WEBHOOK_PATH", "telegram")
+        self.BOT_WEBHOOK_URL = _str("BOT_WEBHOOK_URL")  # 对外的 https 地址（不含 path），由 setWebhook 注册给 Telegram
+        self.BOT_WEBHOOK_SECRET = _str("BOT_WEBHOOK_SECRET")
+        self.BOT_CONCURRENT_UPDATES = _int("BOT_CONCURRENT_UPDATES", "64")
+        self.BOT_MAX_PENDING_PER_CHAT = _int("BOT_MAX_PENDING_PER_CHAT", "20")
+        self.BOT_SHUTDOWN_TIMEOUT = _float("BOT_SHUTDOWN_TIMEOUT", "10")
+
+
+config = Config()
@@ -0,0 +1,297 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+
+from config import config
+import metrics
+
+
+class PoolTimeout(Exception):
+    """在 checkout_timeout 内没有拿到空闲连接"""
+
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """对每条 SQL 计时并计入当前请求的统计（见 metrics.py）"""
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            metrics.record_query(query, time.perf_counter() - start)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            metrics.record_query(query, time.perf_counter() - start)
+
+
+class ConnectionPool:
+    """
+    有上限的 psycopg2 连接池，web 和 bot 两个进程共用。
+
+    - 空闲超过 idle_timeout 的连接会被关闭（保留 minconn 个）
+    - 空闲超过 health_check_interval 的连接在借出前先 SELECT 1 检查
+    - 归还时连接已断开或处于未知状态则直接丢弃，下次借出时重连
+    """
+
+    def __init__(self, dsn, minconn=1, maxconn=10, idle_timeout=300.0,
+                 checkout_timeout=5.0, health_check_interval=30.0, statement_timeout_ms=0):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("连接池大小配置错误")
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+        self.statement_timeout_ms = statement_timeout_ms
+
+        self._idle = []  # [(conn, 归还时间)]，末尾是最近归还的
+        self._in_use = set()
+        self._opening = 0
+        self._lock = threading.Condition()
+        self._closed = False
+
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+            "timeouts": 0,
+            "connects": 0,
+            "discarded": 0,
+            "health_check_failures": 0,
+        }
+
+    def _connect(self):
+        if self.statement_timeout_ms:
+            conn = psycopg2.connect(self.dsn, cursor_factory=TimedCursor,
+                                    options=f"-c statement_timeout={self.statement_timeout_ms}")
+        else:
+            conn = psycopg2.connect(self.dsn, cursor_factory=TimedCursor)
+        with self._lock:
+            self._stats["connects"] += 1
+        return conn
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn, idle_for):
+        if conn.closed:
+            return False
+        if idle_for < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as c:
+                c.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _prune_idle(self, now):
+        # 调用方持有锁；最旧的在最前面
+        expired = []
+        while len(self._idle) + len(self._in_use) > self.minconn and self._idle:
+            conn, returned_at = self._idle[0]
+            if now - returned_at < self.idle_timeout:
+                break
+            self._idle.pop(0)
+            expired.append(conn)
+        return expired
+
+    def getconn(self):
+        start = time.monotonic()
+        deadline = start + self.checkout_timeout
+        waited = False
+
+        while True:
+            with self._lock:
+                if self._closed:
+                    raise PoolTimeout("连接池已关闭")
+                now = time.monotonic()
+                expired = self._prune_idle(now)
+                conn = None
+                idle_for = 0.0
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    idle_for = now - returned_at
+                    self._in_use.add(conn)
+                elif len(self._in_use) + self._opening < self.maxconn:
+                    self._opening += 1
+                else:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(f"等待数据库连接超时（{self.checkout_timeout}s）")
+                    waited = True
+                    self._lock.wait(remaining)
+                    continue
+
+            for old in expired:
+                self._discard(old)
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._opening -= 1
+                        self._lock.notify()
+                    raise
+                with self._lock:
+                    self._opening -= 1
+                    self._in_use.add(conn)
+            elif not self._is_healthy(conn, idle_for):
+                # 断开的连接换一条新的，不占用等待时间
+                with self._lock:
+                    self._stats["health_check_failures"] += 1
+                    self._stats["discarded"] += 1
+                    self._in_use.discard(conn)
+                    self._opening += 1
+                self._discard(conn)
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._opening -= 1
+                        self._lock.notify()
+                    raise
+                with self._lock:
+                    self._opening -= 1
+                    self._in_use.add(conn)
+
+            wait_time = time.monotonic() - start
+            with self._lock:
+                self._stats["checkouts"] += 1
+                if waited:
+                    self._stats["waits"] += 1
+                self._stats["wait_time_total"] += wait_time
+                self._stats["wait_time_max"] = max(self._stats["wait_time_max"], wait_time)
+            return conn
+
+    def putconn(self, conn, broken=False):
+        if not broken and not conn.closed:
+            status = conn.get_transaction_status()
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                broken = True
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+
+        with self._lock:
+            self._in_use.discard(conn)
+            if broken or conn.closed or self._closed:
+                self._stats["discarded"] += 1
+                keep = False
+            else:
+                self._idle.append((conn, time.monotonic()))
+                keep = True
+            self._lock.notify()
+
+        if not keep:
+            self._discard(conn)
+
+    def closeall(self):
+        with self._lock:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._lock.notify_all()
+        for conn in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+            data["in_use"] = len(self._in_use)
+            data["idle"] = len(self._idle)
+            data["size"] = len(self._in_use) + len(self._idle)
+            data["min"] = self.minconn
+            data["max"] = self.maxconn
+        checkouts = data["checkouts"]
+        data["wait_time_avg"] = data["wait_time_total"] / checkouts if checkouts else 0.0
+        return data
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+# fork 前父进程留下的连接池：子进程里不能关闭这些连接（会断开父进程的连接），
+# 只保留引用避免被回收
+_inherited_pools = []
+
+
+def get_pool():
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is not None and _pool_pid != os.getpid():
+                _inherited_pools.append(_pool)
+                _pool = None
+            if _pool is None:
+                _pool_pid = os.getpid()
+                _pool = ConnectionPool(
+                    config.DATABASE_URL,
+                    minconn=config.DB_POOL_MIN,
+                    maxconn=config.DB_POOL_MAX,
+                    idle_timeout=config.DB_POOL_IDLE_TIMEOUT,
+                    checkout_timeout=config.DB_POOL_CHECKOUT_TIMEOUT,
+                    health_check_interval=config.DB_POOL_HEALTH_CHECK_INTERVAL,
+                    statement_timeout_ms=config.DB_STATEMENT_TIMEOUT_MS,
+                )
+    return _pool
+
+
+def reset_pool():
+    """fork 出的 worker 启动时调用，确保每个进程使用自己的连接池"""
+    get_pool()
+
+
+@contextmanager
+def get_conn():
+    """
+    从连接池借一条连接，用法与原来的 psycopg2.connect 相同：
+
+        with get_conn() as conn, conn.cursor() as c:
+            ...
+
+    正常退出时提交，异常时回滚，最后归还连接池（不关闭）。
+    """
+    pool = get_pool()
+    start = time.perf_counter()
+    conn = pool.getconn()
+    metrics.record_db_phase("checkout", time.perf_counter() - start)
+    broken = False
+    try:
+        yield conn
+        start = time.perf_counter()
+        conn.commit()
+        metrics.record_db_phase("commit", time.perf_counter() - start)
+    except BaseException:
+        # 连接已断开时 rollback 也会失败，此时直接丢弃
+        start = time.perf_counter()
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            broken = True
+        metrics.record_db_phase("rollback", time.perf_counter() - start)
+        raise
+    finally:
+        pool.putconn(conn, broken=broken)
+
+
+def pool_stats():
+    return get_pool().stats()
@@ -0,0 +1,134 @@
+"""
+骰子点数的生成，由 DICE_ENGINE 选择：
+
+- secrets（默认）：操作系统 CSPRNG。一次取 DICE_BUFFER_SIZE 字节换算成点数放进缓冲区，
+  每局只是从缓冲区取两个数，不必每次都调 os.urandom
+- seeded：固定种子 DICE_SEED 的伪随机序列，用于测试和压测时复现结果（不要用在线上）
+- fair：可验证公平（commit–reveal）。每个用户每天一个服务端种子
+      server_seed = HMAC_SHA256(DICE_FAIR_SECRET, "<user_id>:<YYYY-MM-DD>")
+  当天只公开它的 SHA256（commitment），第二天起公开种子本身；
+  第 n 局（当天第几次，从 1 开始）的点数 = fair_roll(server_seed, n)，用户可以自己重算核对。
+  需要知道是当天第几局，所以 play_round 会先锁住用户行读出次数，再执行游戏语句
+
+点数由随机字节拒绝采样得到（只用 0–251，252 = 6 × 42），没有取模偏差。
+"""
+import hmac
+import random
+import secrets
+import hashlib
+import logging
+import threading
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# 字节 b（< 252）对应的点数 b % 6 + 1；252–255 丢弃
+_FACES = bytes(b % 6 + 1 for b in range(252)) + bytes(4)
+_REJECTED = bytes(range(252, 256))
+
+
+def bytes_to_faces(data):
+    """随机字节 -> 点数序列（bytes，每个元素 1–6）"""
+    return data.translate(_FACES, _REJECTED)
+
+
+class SecretsEngine:
+    needs_nonce = False
+
+    def __init__(self, buffer_size=4096):
+        self.buffer_size = buffer_size
+        self._buffer = b""
+        self._pos = 0
+        self._lock = threading.Lock()
+
+    def roll(self, user_id=None, day=None, nonce=None):
+        with self._lock:
+            if self._pos + 2 > len(self._buffer):
+                self._buffer = bytes_to_faces(secrets.token_bytes(self.buffer_size))
+                self._pos = 0
+            user_roll, bot_roll = self._buffer[self._pos], self._buffer[self._pos + 1]
+            self._pos += 2
+        return user_roll, bot_roll
+
+
+class SeededEngine:
+    """同一个种子、同样的调用顺序得到同样的点数"""
+    needs_nonce = False
+
+    def __init__(self, seed):
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def roll(self, user_id=None, day=None, nonce=None):
+        with self._lock:
+            return self._random.randint(1, 6), self._random.randint(1, 6)
+
+
+def fair_roll(server_seed, nonce):
+    """由服务端种子和局数算出 (玩家点数, 机器人点数)，公开给用户核对的算法"""
+    faces = b""
+    message = str(nonce).encode()
+    key = server_seed.encode()
+    while len(faces) < 2:
+        digest = hmac.new(key, message, hashlib.sha256).digest()
+        faces += bytes_to_faces(digest)
+        # 32 字节里凑不出两个点数的概率可以忽略，真发生了就对结果再哈希一次
+        message = digest
+    return faces[0], faces[1]
+
+
+def commitment_of(server_seed):
+    return hashlib.sha256(server_seed.encode()).hexdigest()
+
+
+class FairEngine:
+    needs_nonce = True
+
+    def __init__(self, secret):
+        self.secret = secret.encode()
+
+    def server_seed(self, user_id, day):
+        return hmac.new(self.secret, f"{int(user_id)}:{day.isoformat()}".encode(), hashlib.sha256).hexdigest()
+
+    def commitment(self, user_id, day):
+        return commitment_of(self.server_seed(user_id, day))
+
+    def roll(self, user_id=None, day=None, nonce=None):
+        return fair_roll(self.server_seed(user_id, day), nonce)
+
+
+def verify(server_seed, commitment, nonce, user_roll, bot_roll):
+    """用公开的种子核对某一局；种子与当天的 commitment 不符或点数不符都返回 False"""
+    if not hmac.compare_digest(commitment_of(server_seed), commitment):
+        return False
+    return fair_roll(server_seed, nonce) == (user_roll, bot_roll)
+
+
+def create_engine(name, seed=None, secret=None, buffer_size=4096):
+    if name == "secrets":
+        return SecretsEngine(buffer_size)
+    if name == "seeded":
+        return SeededEngine(seed)
+    if name == "fair":
+        return FairEngine(secret)
+    raise ValueError(f"未知的 DICE_ENGINE：{name}")
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                secret = config.DICE_FAIR_SECRET
+                if config.DICE_ENGINE == "fair" and not secret:
+                    # 换了 SECRET_KEY 之后已公开的 commitment 就对不上了，线上应单独配置
+                    logger.warning("未配置 DICE_FAIR_SECRET，使用 SECRET_KEY 生成服务端种子")
+                    secret = config.SECRET_KEY
+                _engine = create_engine(config.DICE_ENGINE, seed=config.DICE_SEED, secret=secret,
+                                        buffer_size=config.DICE_BUFFER_SIZE)
+    return _engine
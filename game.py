@@ -0,0 +1,212 @@
+from dice_engine import get_engine
+
+DAILY_PLAY_LIMIT = 10
+
+# 一条语句完成：跨天重置、每日上限检查、加减积分、写入 game_logs 和每日统计。
+# UPDATE 会锁住该用户这一行，并发的请求在锁上排队后按最新行重新判断 WHERE，
+# 所以同一用户连点也不会超过每日上限。
+# {logged} 处放写 game_logs 的 CTE；异步写日志时留空，game_logs 由 gamelog_writer 批量写入
+_PLAY_ROUND_TEMPLATE = """
+    WITH target AS (
+        SELECT EXISTS (SELECT 1 FROM users WHERE user_id = %(user_id)s) AS user_exists
+    ), updated AS (
+        UPDATE users
+        SET plays = CASE WHEN daily_reset = %(today)s THEN COALESCE(plays, 0) + 1 ELSE 1 END,
+            daily_reset = %(today)s,
+            points = COALESCE(points, 0) + %(delta)s,
+            last_game_time = CURRENT_TIMESTAMP
+        WHERE user_id = %(user_id)s
+          AND (daily_reset IS DISTINCT FROM %(today)s OR COALESCE(plays, 0) < %(limit)s)
+        RETURNING user_id, plays, last_game_time
+    ){logged}, daily AS (
+        INSERT INTO user_daily_stats (day, user_id, plays, points, wins, losses, draws, nonce)
+        SELECT %(today)s, user_id, 1, %(delta)s,
+               (%(delta)s > 0)::int, (%(delta)s < 0)::int, (%(delta)s = 0)::int, 1
+        FROM updated
+        ON CONFLICT (day, user_id) DO UPDATE
+        SET plays = user_daily_stats.plays + 1,
+            nonce = user_daily_stats.nonce + 1,
+            points = user_daily_stats.points + EXCLUDED.points,
+            wins = user_daily_stats.wins + EXCLUDED.wins,
+            losses = user_daily_stats.losses + EXCLUDED.losses,
+            draws = user_daily_stats.draws + EXCLUDED.draws
+    )
+    SELECT target.user_exists, updated.plays, updated.last_game_time
+    FROM target LEFT JOIN updated ON TRUE
+"""
+
+_LOG_ROUND_CTE = """, logged AS (
+        INSERT INTO game_logs (user_id, user_roll, bot_roll, result)
+        SELECT user_id, %(user_roll)s, %(bot_roll)s, %(result)s FROM updated
+        RETURNING id
+    )"""
+
+PLAY_ROUND_SQL = _PLAY_ROUND_TEMPLATE.format(logged=_LOG_ROUND_CTE)
+PLAY_ROUND_NO_LOG_SQL = _PLAY_ROUND_TEMPLATE.format(logged="")
+
+
+# 可验证公平模式需要先知道下一局的 nonce：锁住用户行，读出今天已玩次数和今天已用到的 nonce，
+# 同一事务里再执行 PLAY_ROUND_SQL，锁保证并发请求拿到的 nonce 不重复。
+# nonce 记在 user_daily_stats 里只增不减，后台重置次数（users.plays）不会让同一个种子下的 nonce 重用。
+# 分成两条语句（一次往返）：FOR UPDATE 等到锁之后只会重读被锁的 users 行，同一条语句里 JOIN 的
+# user_daily_stats 仍是等锁之前的快照；第二条语句取新快照，能看到前一个事务提交的 nonce
+LOCK_USER_PLAYS_SQL = """
+    SELECT 1 FROM users WHERE user_id = %(user_id)s FOR UPDATE;
+    SELECT CASE WHEN u.daily_reset = %(today)s THEN COALESCE(u.plays, 0) ELSE 0 END,
+           COALESCE(d.nonce, 0)
+    FROM users u
+    LEFT JOIN user_daily_stats d ON d.user_id = u.user_id AND d.day = %(today)s
+    WHERE u.user_id = %(user_id)s
+"""
+
+
+# 一次玩多局：用户行已由 LOCK_USER_PLAYS_SQL 锁住、局数已按剩余次数截断，
+# 这里一条语句写入所有局的 game_logs（{logged}，异步写日志时留空），积分和每日统计按合计值更新一次
+_PLAY_BATCH_TEMPLATE = """
+    WITH updated AS (
+        UPDATE users
+        SET plays = CASE WHEN daily_reset = %(today)s THEN COALESCE(plays, 0) ELSE 0 END + %(count)s,
+            daily_reset = %(today)s,
+            points = COALESCE(points, 0) + %(delta)s,
+            last_game_time = CURRENT_TIMESTAMP
+        WHERE user_id = %(user_id)s
+        RETURNING user_id, plays, last_game_time
+    ){logged}, daily AS (
+        INSERT INTO user_daily_stats (day, user_id, plays, points, wins, losses, draws, nonce)
+        SELECT %(today)s, user_id, %(count)s, %(delta)s, %(wins)s, %(losses)s, %(draws)s, %(count)s
+        FROM updated
+        ON CONFLICT (day, user_id) DO UPDATE
+        SET plays = user_daily_stats.plays + EXCLUDED.plays,
+            nonce = user_daily_stats.nonce + EXCLUDED.nonce,
+            points = user_daily_stats.points + EXCLUDED.points,
+            wins = user_daily_stats.wins + EXCLUDED.wins,
+            losses = user_daily_stats.losses + EXCLUDED.losses,
+            draws = user_daily_stats.draws + EXCLUDED.draws
+    )
+    SELECT plays, last_game_time FROM updated
+"""
+
+_LOG_BATCH_CTE = """, logged AS (
+        INSERT INTO game_logs (user_id, user_roll, bot_roll, result)
+        SELECT updated.user_id, r.user_roll, r.bot_roll, r.result
+        FROM updated,
+             unnest(%(user_rolls)s::int[], %(bot_rolls)s::int[], %(results)s::text[]) AS r(user_roll, bot_roll, result)
+        RETURNING id
+    )"""
+
+PLAY_BATCH_SQL = _PLAY_BATCH_TEMPLATE.format(logged=_LOG_BATCH_CTE)
+PLAY_BATCH_NO_LOG_SQL = _PLAY_BATCH_TEMPLATE.format(logged="")
+
+
+class UserNotFound(Exception):
+    pass
+
+
+class DailyLimitReached(Exception):
+    pass
+
+
+def judge(user_roll, bot_roll):
+    """返回 (积分变化, 结果文案)"""
+    if user_roll > bot_roll:
+        return 10, "你赢了！+10"
+    if user_roll < bot_roll:
+        return -5, "你输了！-5"
+    return 0, "平局"
+
+
+def lock_plays(c, user_id, today):
+    """
+    锁住用户行，返回 (今天已玩次数, 今天最后一局的 nonce)；
+    用户不存在抛 UserNotFound，次数用完抛 DailyLimitReached
+    """
+    c.execute(LOCK_USER_PLAYS_SQL, {"user_id": user_id, "today": today})
+    row = c.fetchone()
+    if row is None:
+        raise UserNotFound(user_id)
+    if row[0] >= DAILY_PLAY_LIMIT:
+        raise DailyLimitReached(user_id)
+    return row[0], row[1]
+
+
+def play_round(conn, user_id, today, log_inline=True):
+    """
+    完成一局游戏，只需要一次数据库往返（可验证公平模式下两次，见 LOCK_USER_PLAYS_SQL）。
+    log_inline=False 时不写 game_logs，由调用方在提交后交给 gamelog_writer。
+    返回 {"user", "bot", "message", "delta", "remaining", "played_at", "nonce"}（nonce 只在可验证公平模式下有值）；
+    用户不存在抛 UserNotFound，今日次数用完抛 DailyLimitReached。
+    """
+    engine = get_engine()
+    with conn.cursor() as c:
+        nonce = None
+        if engine.needs_nonce:
+            nonce = lock_plays(c, user_id, today)[1] + 1
+
+        user_roll, bot_roll = engine.roll(user_id, today, nonce)
+        delta, result = judge(user_roll, bot_roll)
+        c.execute(PLAY_ROUND_SQL if log_inline else PLAY_ROUND_NO_LOG_SQL, {
+            "user_id": user_id,
+            "today": today,
+            "limit": DAILY_PLAY_LIMIT,
+            "delta": delta,
+            "user_roll": user_roll,
+            "bot_roll": bot_roll,
+            "result": result,
+        })
+        user_exists, plays, played_at = c.fetchone()
+
+    if not user_exists:
+        raise UserNotFound(user_id)
+    if plays is None:
+        raise DailyLimitReached(user_id)
+
+    return {
+        "user": user_roll,
+        "bot": bot_roll,
+        "message": result,
+        "delta": delta,
+        "remaining": max(0, DAILY_PLAY_LIMIT - plays),
+        "played_at": played_at,
+        "nonce": nonce,
+    }
+
+
+def play_rounds(conn, user_id, today, count, log_inline=True):
+    """
+    一次玩 count 局（超过今天剩余次数时只玩剩余的），两次数据库往返：锁行读次数、写入全部结果。
+    返回 {"rounds": [{"user", "bot", "message", "delta", "nonce"}], "delta", "remaining", "played_at"}；
+    异常与 play_round 相同。
+    """
+    engine = get_engine()
+    with conn.cursor() as c:
+        played, last_nonce = lock_plays(c, user_id, today)
+        count = min(count, DAILY_PLAY_LIMIT - played)
+
+        rounds = []
+        for nonce in range(last_nonce + 1, last_nonce + count + 1):
+            user_roll, bot_roll = engine.roll(user_id, today, nonce)
+            delta, result = judge(user_roll, bot_roll)
+            rounds.append({"user": user_roll, "bot": bot_roll, "message": result, "delta": delta,
+                           "nonce": nonce if engine.needs_nonce else None})
+
+        deltas = [r["delta"] for r in rounds]
+        c.execute(PLAY_BATCH_SQL if log_inline else PLAY_BATCH_NO_LOG_SQL, {
+            "user_id": user_id,
+            "today": today,
+            "count": count,
+            "delta": sum(deltas),
+            "wins": sum(1 for d in deltas if d > 0),
+            "losses": sum(1 for d in deltas if d < 0),
+            "draws": sum(1 for d in deltas if d == 0),
+            "user_rolls": [r["user"] for r in rounds],
+            "bot_rolls": [r["bot"] for r in rounds],
+            "results": [r["message"] for r in rounds],
+        })
+        plays, played_at = c.fetchone()
+
+    return {
+        "rounds": rounds,
+        "delta": sum(deltas),
+        "remaining": max(0, DAILY_PLAY_LIMIT - plays),
+        "played_at": played_at,
+    }
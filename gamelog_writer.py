@@ -0,0 +1,230 @@
+import os
+import json
+import time
+import fcntl
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+
+from psycopg2.extras import execute_values
+
+from config import config
+from db import get_conn
+
+INSERT_SQL = "INSERT INTO game_logs (user_id, user_roll, bot_roll, result, timestamp) VALUES %s"
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def file_lock(path, blocking=True):
+    """
+    跨进程的文件锁（flock），gunicorn 的各个 worker 共用同一个 spool 文件。
+    blocking=False 时拿不到锁返回 False，不等待。
+    """
+    with open(path, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class GameLogWriter:
+    """
+    game_logs 异步批量写入（write-behind）。
+
+    play 请求只把记录放进内存队列，后台线程按条数或时间阈值合并成一条多行
+    INSERT 写入。数据库不可用时整批追加到本地 spool 文件（每行一条 JSON），
+    下次启动或数据库恢复后重放。进程被强杀时队列里尚未写出的记录会丢失，
+    这是换取低延迟的代价；需要逐条落库请使用 sync 模式。
+
+    多个 worker 共用一个 spool：追加和改名都持有 <spool>.lock，追加的记录不会写进正在重放的文件；
+    重放持有 <spool>.replay.lock，同一时间只有一个进程在重放，其他进程直接跳过。
+    """
+
+    def __init__(self, batch_size=200, flush_interval=1.0, max_queue=10000, spool_path="game_logs.spool"):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spool_path = spool_path
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._spool_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopping = threading.Event()
+        self.stats = {"submitted": 0, "written": 0, "batches": 0, "spooled": 0, "replayed": 0, "errors": 0}
+
+    # --- 生命周期 ---
+    def start(self):
+        # fork 之后线程不会被继承，按 pid 判断是否需要重新启动
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="game-log-writer", daemon=True)
+            self._thread.start()
+
+    def close(self, timeout=5.0):
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        # 线程没来得及写出的记录落到 spool，下次启动重放
+        leftover = self._drain_nowait()
+        if leftover:
+            self._spool(leftover)
+
+    def _count(self, name, n=1):
+        with self._stats_lock:
+            self.stats[name] += n
+
+    # --- 写入 ---
+    def submit(self, user_id, user_roll, bot_roll, result, timestamp=None):
+        self.start()
+        record = (user_id, user_roll, bot_roll, result, timestamp or datetime.now())
+        self._count("submitted")
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            # 队列满说明数据库已经跟不上，直接落盘，不阻塞请求
+            self._spool([record])
+
+    def _drain_nowait(self):
+        items = []
+        while True:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                return items
+
+    def _run(self):
+        self._replay_spool()
+        while not self._stopping.is_set():
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stopping.is_set():
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+        leftover = self._drain_nowait()
+        for i in range(0, len(leftover), self.batch_size):
+            self._write(leftover[i:i + self.batch_size])
+
+    def _insert(self, records):
+        with get_conn() as conn, conn.cursor() as c:
+            execute_values(c, INSERT_SQL, records, page_size=self.batch_size)
+
+    def _write(self, batch):
+        try:
+            self._insert(batch)
+        except Exception:
+            logger.exception("game_logs 批量写入失败，转存到 %s", self.spool_path)
+            self._count("errors")
+            self._spool(batch)
+            return
+        self._count("written", len(batch))
+        self._count("batches")
+        if os.path.exists(self.spool_path):
+            self._replay_spool()
+
+    # --- spool ---
+    @staticmethod
+    def _dump(f, records):
+        for user_id, user_roll, bot_roll, result, ts in records:
+            f.write(json.dumps({
+                "user_id": user_id,
+                "user_roll": user_roll,
+                "bot_roll": bot_roll,
+                "result": result,
+                "timestamp": ts.isoformat(),
+            }, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+    def _spool(self, records):
+        with self._spool_lock, file_lock(self.spool_path + ".lock"):
+            with open(self.spool_path, "a", encoding="utf-8") as f:
+                self._dump(f, records)
+        self._count("spooled", len(records))
+
+    def _replay_spool(self):
+        with file_lock(self.spool_path + ".replay.lock", blocking=False) as locked:
+            if locked:
+                self._replay_locked()
+
+    def _replay_locked(self):
+        # 先把 spool 改名再重放，重放期间新的失败记录写进新文件
+        replay_path = self.spool_path + ".replay"
+        with self._spool_lock, file_lock(self.spool_path + ".lock"):
+            if not os.path.exists(replay_path):
+                if not os.path.exists(self.spool_path):
+                    return
+                os.replace(self.spool_path, replay_path)
+
+        records = []
+        with open(replay_path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    r = json.loads(line)
+                    records.append((r["user_id"], r["user_roll"], r["bot_roll"], r["result"],
+                                    datetime.fromisoformat(r["timestamp"])))
+                except (ValueError, KeyError):
+                    logger.warning("跳过损坏的 spool 记录: %s", line)
+
+        done = 0
+        try:
+            while done < len(records):
+                self._insert(records[done:done + self.batch_size])
+                done += self.batch_size
+        except Exception:
+            # 已写入的批次不再保留，剩余部分写回 .replay 文件，下次再试
+            with open(replay_path, "w", encoding="utf-8") as f:
+                self._dump(f, records[done:])
+            logger.exception("重放 spool 失败，剩余 %s 条稍后重试", len(records) - done)
+            return
+
+        os.remove(replay_path)
+        self._count("replayed", len(records))
+        if records:
+            logger.info("已重放 %s 条 spool 中的游戏记录", len(records))
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """config.GAME_LOG_MODE=async 时返回全局 writer，否则返回 None（同步写入）"""
+    global _writer
+    if config.GAME_LOG_MODE != "async":
+        return None
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = GameLogWriter(
+                    batch_size=config.GAME_LOG_BATCH_SIZE,
+                    flush_interval=config.GAME_LOG_FLUSH_INTERVAL,
+                    max_queue=config.GAME_LOG_QUEUE_SIZE,
+                    spool_path=config.GAME_LOG_SPOOL_PATH,
+                )
+                atexit.register(_writer.close)
+    return _writer
@@ -0,0 +1,29 @@
+"""
+生产环境 gunicorn 配置：
+
+    gunicorn -c gunicorn.conf.py main:app
+
+worker / 线程数、超时等都来自 config（环境变量 WEB_*）。
+平滑重启：kill -HUP <master pid> 会逐个替换 worker，不中断正在处理的请求；
+上线新代码时用 kill -USR2 启动新 master，确认正常后对旧 master 发送 QUIT。
+"""
+from config import config as app_config  # 变量名不能叫 config，会与 gunicorn 的同名配置项冲突
+
+bind = f"0.0.0.0:{app_config.PORT}"
+workers = app_config.WEB_CONCURRENCY
+threads = app_config.WEB_THREADS
+worker_class = "gthread"
+timeout = app_config.WEB_TIMEOUT
+graceful_timeout = app_config.WEB_GRACEFUL_TIMEOUT
+keepalive = 5
+max_requests = app_config.WEB_MAX_REQUESTS
+max_requests_jitter = app_config.WEB_MAX_REQUESTS // 10
+# 在 master 里导入 main（编译模板、加载代码），worker fork 后共享内存
+preload_app = app_config.WEB_PRELOAD
+accesslog = "-"
+
+
+def post_fork(server, worker):
+    # master 不会建立数据库连接，但后台线程和连接池都必须在 worker 里各自创建
+    import db
+    db.reset_pool()
@@ -0,0 +1,160 @@
+"""
+低优先级的定时清理任务，可由 cron / Heroku Scheduler 每天执行一次：
+
+    python housekeeping.py [--batch-size 500] [--pause 0.2]
+    python housekeeping.py --partitions-only
+
+每日次数已经改为惰性重置（daily_reset 不是今天时 plays 视为 0），
+这里只是把过期的 plays 清零，让原始数据保持整洁，不影响游戏逻辑。
+每批只处理少量行，跳过正在被 /dice/play 锁住的用户，批次之间暂停，
+避免与在线请求争抢行锁。
+
+game_logs 按月分区：提前建好后 GAME_LOG_PARTITIONS_AHEAD 个月的分区，
+并删除超过 GAME_LOG_RETENTION_MONTHS 个月的分区（每日汇总 user_daily_stats 保留）。
+"""
+import re
+import sys
+import time
+import argparse
+import logging
+from datetime import date
+
+from psycopg2 import sql
+
+from config import config
+from db import get_conn
+
+logger = logging.getLogger(__name__)
+
+# 按主键 keyset 分批：每批从上一批的最后一个 user_id 往后扫，整个任务只把 users 扫一遍
+RESET_STALE_PLAYS_SQL = """
+    WITH batch AS (
+        SELECT user_id
+        FROM users
+        WHERE user_id > %(after)s
+          AND (daily_reset < %(today)s OR daily_reset IS NULL)
+          AND plays <> 0
+        ORDER BY user_id
+        LIMIT %(batch_size)s
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE users u
+    SET plays = 0
+    FROM batch
+    WHERE u.user_id = batch.user_id
+    RETURNING u.user_id
+"""
+
+GAME_LOG_PARTITIONS_SQL = """
+    SELECT c.relname
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'game_logs'::regclass
+"""
+
+PARTITION_NAME = re.compile(r"^game_logs_p(\d{4})(\d{2})$")
+
+
+def reset_stale_plays(batch_size=500, pause=0.2, lock_timeout_ms=200):
+    """
+    分批把 daily_reset 早于今天（或为空）的 plays 清零，返回处理的行数。
+    正被 /dice/play 锁住的行直接跳过，这些用户的 plays 由游戏本身重置。
+    """
+    today = date.today()
+    total = 0
+    after = -2 ** 63
+    while True:
+        with get_conn() as conn, conn.cursor() as c:
+            c.execute("SET LOCAL lock_timeout = %s", (f"{lock_timeout_ms}ms",))
+            c.execute(RESET_STALE_PLAYS_SQL, {"today": today, "after": after, "batch_size": batch_size})
+            user_ids = [row[0] for row in c.fetchall()]
+        if not user_ids:
+            return total
+        total += len(user_ids)
+        after = max(user_ids)
+        time.sleep(pause)
+
+
+def vacuum(table):
+    with get_conn() as conn:
+        # VACUUM 不能在事务里执行；连接还回池之前恢复成事务模式
+        conn.autocommit = True
+        try:
+            with conn.cursor() as c:
+                c.execute(sql.SQL("VACUUM ANALYZE {}").format(sql.Identifier(table)))
+        finally:
+            conn.autocommit = False
+
+
+def add_months(day, months):
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def maintain_game_log_partitions(ahead=3, retention_months=0, lock_timeout_ms=5000):
+    """
+    建立本月到之后 ahead 个月的分区，默认分区里有数据的月份也补建（数据随之搬入）；
+    retention_months > 0 时删除更早的分区。返回 (新建的分区, 删除的分区)。
+    每个分区单独一个事务，ATTACH / DETACH 拿不到锁时超时放弃，下次再试。
+    """
+    this_month = date.today().replace(day=1)
+    with get_conn() as conn, conn.cursor() as c:
+        c.execute("SELECT DISTINCT date_trunc('month', timestamp)::date FROM game_logs_default")
+        months = {row[0] for row in c.fetchall()}
+    months.update(add_months(this_month, i) for i in range(ahead + 1))
+
+    created = []
+    for month in sorted(months):
+        with get_conn() as conn, conn.cursor() as c:
+            c.execute("SET LOCAL lock_timeout = %s", (f"{lock_timeout_ms}ms",))
+            c.execute("SELECT game_logs_ensure_partition(%s)", (month,))
+            name = c.fetchone()[0]
+        if name:
+            created.append(name)
+    if created:
+        # 搬走的行在默认分区留下死元组，不清理的话按时间倒序扫默认分区会很慢
+        vacuum("game_logs_default")
+
+    dropped = []
+    if retention_months > 0:
+        cutoff = add_months(this_month, -retention_months)
+        with get_conn() as conn, conn.cursor() as c:
+            c.execute(GAME_LOG_PARTITIONS_SQL)
+            names = sorted(row[0] for row in c.fetchall())
+        for name in names:
+            match = PARTITION_NAME.match(name)
+            if not match or date(int(match.group(1)), int(match.group(2)), 1) >= cutoff:
+                continue
+            with get_conn() as conn, conn.cursor() as c:
+                c.execute("SET LOCAL lock_timeout = %s", (f"{lock_timeout_ms}ms",))
+                c.execute(sql.SQL("ALTER TABLE game_logs DETACH PARTITION {}").format(sql.Identifier(name)))
+                c.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(name)))
+            dropped.append(name)
+        with get_conn() as conn, conn.cursor() as c:
+            c.execute("DELETE FROM game_logs_default WHERE timestamp < %s", (cutoff,))
+
+    return created, dropped
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="每日数据清理")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pause", type=float, default=0.2, help="批次之间暂停的秒数")
+    parser.add_argument("--partitions-only", action="store_true", help="只维护 game_logs 分区")
+    args = parser.parse_args(argv[1:])
+
+    logging.basicConfig(level=logging.INFO)
+    if not args.partitions_only:
+        count = reset_stale_plays(batch_size=args.batch_size, pause=args.pause)
+        logger.info("已清零 %s 个用户的过期每日次数", count)
+
+    created, dropped = maintain_game_log_partitions(
+        ahead=config.GAME_LOG_PARTITIONS_AHEAD,
+        retention_months=config.GAME_LOG_RETENTION_MONTHS,
+    )
+    logger.info("game_logs 分区：新建 %s，删除 %s", created or "无", dropped or "无")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -1,3 +1,4 @@
+-- 表结构已改由 migrations.py 维护（python migrations.py migrate），此文件仅保留最初的建表语句
 CREATE TABLE IF NOT EXISTS users (
     user_id BIGINT PRIMARY KEY,
     username TEXT,
@@ -0,0 +1,471 @@
+"""
+排行榜：总积分榜和每日积分榜。
+
+play_dice 提交后调用 record_play 增量更新，排行查询不再扫 users / game_logs。
+后端二选一：
+- 配置 REDIS_URL 时使用 Redis sorted set，多个进程共享同一份数据；
+- 否则使用进程内的 SortedSet（与 Redis sorted set 同样的语义），后台线程每隔
+  LEADERBOARD_REFRESH_SECONDS 从数据库重新加载一次，以便看到其他进程的更新。
+  提交一局和调用 record_play 要放在 recording() 里，重新加载时据此判断这一局是否已包含在加载的数据里。
+"""
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager, nullcontext
+from datetime import date, timedelta
+
+from sortedcontainers import SortedList
+
+from config import config
+from db import get_conn
+import queries
+
+try:
+    import redis
+except ImportError:  # 可选依赖
+    redis = None
+
+DAILY_KEY_TTL = 2 * 24 * 3600
+
+logger = logging.getLogger(__name__)
+
+
+class SortedSet:
+    """
+    进程内的 sorted set：分数高的排前面，分数相同按 member 升序。
+    有序部分用 sortedcontainers.SortedList，插入、删除和取名次都是 O(log n)。
+    """
+
+    def __init__(self, items=()):
+        self._scores = dict(items)
+        self._index = SortedList((-score, member) for member, score in self._scores.items())
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._scores)
+
+    def _remove(self, member):
+        old = self._scores.pop(member, None)
+        if old is not None:
+            self._index.remove((-old, member))
+        return old
+
+    def incr(self, member, delta):
+        with self._lock:
+            score = (self._remove(member) or 0) + delta
+            self._scores[member] = score
+            self._index.add((-score, member))
+            return score
+
+    def set(self, member, score):
+        with self._lock:
+            self._remove(member)
+            self._scores[member] = score
+            self._index.add((-score, member))
+
+    def remove(self, member):
+        with self._lock:
+            self._remove(member)
+
+    def score(self, member):
+        return self._scores.get(member)
+
+    def rank(self, member):
+        """从 0 开始的名次，不存在返回 None"""
+        with self._lock:
+            score = self._scores.get(member)
+            if score is None:
+                return None
+            return self._index.bisect_left((-score, member))
+
+    def top(self, n):
+        with self._lock:
+            return [(member, -neg) for neg, member in self._index.islice(0, n)]
+
+
+class SharedLock:
+    """
+    共享 / 独占锁。独占方排队后新的共享请求先等待，加载不会一直等不到。
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._shared = 0
+        self._exclusive = False
+
+    @contextmanager
+    def shared(self):
+        with self._cond:
+            while self._exclusive:
+                self._cond.wait()
+            self._shared += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._shared -= 1
+                if not self._shared:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self._cond:
+            while self._exclusive:
+                self._cond.wait()
+            self._exclusive = True
+            while self._shared:
+                self._cond.wait()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._exclusive = False
+                self._cond.notify_all()
+
+
+class LocalBackend:
+    """
+    每个 key 第一次被读取时在请求里同步加载一次，之后由后台线程每隔 refresh_interval
+    重新加载（请求里不会再有全表扫描）。
+
+    加载在 REPEATABLE READ 事务里进行，快照确定的同时开始把变化记进 _pending，
+    加载完成后按顺序应用到新数据上再替换旧数据。这两步持有 _gate 的独占锁，
+    而本进程"提交一局 + incr"整体持有共享锁（recording()），所以每一局要么在快照之前提交、
+    incr 也在之前完成（包含在加载的数据里，不进 _pending），要么两者都在之后（不在数据里，进 _pending），
+    既不会丢也不会算两次。set / remove 是幂等的，不需要这个保证。
+    其他进程的变化只能通过重新加载看到。
+    """
+
+    def __init__(self, refresh_interval):
+        self.refresh_interval = refresh_interval
+        self._sets = {}
+        self._loaders = {}  # key -> loader，后台刷新用
+        self._pending = {}  # key -> [(操作, member, 值)]，正在加载的 key 收到的变化
+        self._gate = SharedLock()
+        self._lock = threading.Lock()
+        self._load_locks = {}  # key -> Lock，同一个 key 同时只有一次加载
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _start_refresher(self):
+        # fork 之后线程不会被继承，按 pid 判断是否需要重新启动
+        if self.refresh_interval <= 0:
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run_refresher, name="leaderboard-refresh", daemon=True)
+            self._thread.start()
+
+    def _run_refresher(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            for key, loader in list(self._loaders.items()):
+                try:
+                    with self._load_lock(key):
+                        self._load(key, loader)
+                except Exception:
+                    logger.exception("刷新排行榜 %s 失败", key)
+
+    def _load_lock(self, key):
+        with self._lock:
+            return self._load_locks.setdefault(key, threading.Lock())
+
+    def recording(self):
+        return self._gate.shared()
+
+    def _load(self, key, loader):
+        """调用方持有 _load_lock(key)"""
+        try:
+            with get_conn() as conn, conn.cursor() as c:
+                c.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+                with self._gate.exclusive():
+                    # REPEATABLE READ 的快照在第一条查询时确定
+                    c.execute("SELECT 1")
+                    with self._lock:
+                        self._pending[key] = []
+                zset = SortedSet(loader(conn))
+        except Exception:
+            with self._lock:
+                self._pending.pop(key, None)
+            raise
+        with self._lock:
+            for op, member, value in self._pending.pop(key):
+                getattr(zset, op)(member, *value)
+            # 加载期间被 drop_except 删掉的 key 不再放回去
+            if key in self._loaders:
+                self._sets[key] = zset
+        return zset
+
+    def _get(self, key, loader):
+        zset = self._sets.get(key)
+        if zset is None:
+            self._start_refresher()
+            with self._load_lock(key):
+                zset = self._sets.get(key)
+                if zset is None:
+                    self._loaders[key] = loader
+                    zset = self._load(key, loader)
+        return zset
+
+    def _apply(self, key, op, member, *value):
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is not None:
+                pending.append((op, member, value))
+            zset = self._sets.get(key)
+            if zset is not None:
+                getattr(zset, op)(member, *value)
+        # 还没加载过的 key 不用处理：变化已经提交，第一次读取时加载的数据里就有
+
+    def incr(self, key, member, delta, loader):
+        self._apply(key, "incr", member, delta)
+
+    def set(self, key, member, score, loader):
+        self._apply(key, "set", member, score)
+
+    def remove(self, key, member):
+        self._apply(key, "remove", member)
+
+    def top(self, key, n, loader):
+        return self._get(key, loader).top(n)
+
+    def rank(self, key, member, loader):
+        zset = self._get(key, loader)
+        rank = zset.rank(member)
+        if rank is None:
+            return None
+        return rank, zset.score(member)
+
+    def drop_except(self, keys):
+        with self._lock:
+            for key in list(self._sets):
+                if key not in keys:
+                    self._sets.pop(key, None)
+                    self._loaders.pop(key, None)
+                    self._load_locks.pop(key, None)
+
+
+class RedisBackend:
+    """
+    第一次用到某个 key 时从数据库加载（SET NX :loading 保证只有一个进程加载）。
+    加载期间 incr 除了加到 key 上，还加到 :journal 里；加载好的数据先写进 :snapshot，
+    最后一步在 Lua 里原子地 ZUNIONSTORE key = snapshot + journal，加载期间的增量不会丢。
+    """
+
+    INCR_SCRIPT = """
+        redis.call('ZINCRBY', KEYS[1], ARGV[1], ARGV[2])
+        if redis.call('EXISTS', KEYS[2]) == 1 then
+            redis.call('ZINCRBY', KEYS[3], ARGV[1], ARGV[2])
+            redis.call('EXPIRE', KEYS[3], ARGV[4])
+        end
+        if tonumber(ARGV[3]) > 0 then
+            redis.call('EXPIRE', KEYS[1], ARGV[3])
+        end
+    """
+
+    # KEYS: key, snapshot, journal, loaded, loading；ARGV: TTL（0 表示不过期）
+    FINISH_LOAD_SCRIPT = """
+        redis.call('ZUNIONSTORE', KEYS[1], 2, KEYS[2], KEYS[3])
+        redis.call('DEL', KEYS[2], KEYS[3], KEYS[5])
+        redis.call('SET', KEYS[4], 1)
+        if tonumber(ARGV[1]) > 0 then
+            redis.call('EXPIRE', KEYS[1], ARGV[1])
+            redis.call('EXPIRE', KEYS[4], ARGV[1])
+        end
+    """
+
+    LOADING_TTL = 60
+
+    def __init__(self, url):
+        self.client = redis.Redis.from_url(url)
+        self._incr = self.client.register_script(self.INCR_SCRIPT)
+        self._finish_load = self.client.register_script(self.FINISH_LOAD_SCRIPT)
+
+    def recording(self):
+        return nullcontext()
+
+    @staticmethod
+    def _ttl(key):
+        return DAILY_KEY_TTL if ":daily:" in key else 0
+
+    def _ensure(self, key, loader):
+        """第一次用到某个 key 时从数据库加载；返回是否由本次加载"""
+        if self.client.exists(key + ":loaded"):
+            return False
+        if not self.client.set(key + ":loading", 1, nx=True, ex=self.LOADING_TTL):
+            return False
+        try:
+            with get_conn() as conn:
+                items = loader(conn)
+            pipe = self.client.pipeline()
+            pipe.delete(key + ":snapshot")
+            for i in range(0, len(items), 5000):
+                pipe.zadd(key + ":snapshot", {str(member): score for member, score in items[i:i + 5000]})
+            pipe.execute()
+            self._finish_load(keys=[key, key + ":snapshot", key + ":journal", key + ":loaded", key + ":loading"],
+                              args=[self._ttl(key)])
+        except Exception:
+            self.client.delete(key + ":loading", key + ":snapshot", key + ":journal")
+            raise
+        return True
+
+    def incr(self, key, member, delta, loader):
+        # 加载的数据已包含这次已提交的变化
+        if self._ensure(key, loader):
+            return
+        self._incr(keys=[key, key + ":loading", key + ":journal"],
+                   args=[delta, str(member), self._ttl(key), self.LOADING_TTL])
+
+    def set(self, key, member, score, loader):
+        self._ensure(key, loader)
+        self.client.zadd(key, {str(member): score})
+
+    def remove(self, key, member):
+        self.client.zrem(key, str(member))
+
+    def top(self, key, n, loader):
+        self._ensure(key, loader)
+        return [(int(member), int(score)) for member, score in self.client.zrevrange(key, 0, n - 1, withscores=True)]
+
+    def rank(self, key, member, loader):
+        self._ensure(key, loader)
+        pipe = self.client.pipeline()
+        pipe.zrevrank(key, str(member))
+        pipe.zscore(key, str(member))
+        rank, score = pipe.execute()
+        if rank is None:
+            return None
+        return rank, int(score)
+
+    def drop_except(self, keys):
+        pass  # 每日榜靠 EXPIRE 过期
+
+
+def load_all_time(conn):
+    with conn.cursor(name="leaderboard_load") as c:
+        c.itersize = 10000
+        c.execute(queries.LEADERBOARD_LOAD_ALL_SQL)
+        return [(user_id, points) for user_id, points in c]
+
+
+def load_daily(conn, day):
+    with conn.cursor() as c:
+        c.execute(queries.LEADERBOARD_LOAD_DAILY_SQL, {"day": day})
+        return c.fetchall()
+
+
+class Leaderboard:
+    def __init__(self, backend):
+        self.backend = backend
+
+    @staticmethod
+    def _key(day=None):
+        if day is None:
+            return config.LEADERBOARD_KEY_PREFIX + "all"
+        return config.LEADERBOARD_KEY_PREFIX + "daily:" + day.isoformat()
+
+    @staticmethod
+    def _loader(day=None):
+        if day is None:
+            return load_all_time
+        return lambda conn: load_daily(conn, day)
+
+    def recording(self):
+        """
+        提交一局和 record_play 都放在里面。先拿连接再进 recording()，持有共享锁时不再等连接池：
+
+            with get_conn() as conn, board.recording():
+                ...
+                conn.commit()
+                board.record_play(user_id, delta, today)
+        """
+        return self.backend.recording()
+
+    def record_play(self, user_id, delta, day):
+        """一局结束（已提交）后更新总榜和当天的榜，在 recording() 里调用"""
+        user_id = int(user_id)
+        try:
+            self.backend.incr(self._key(), user_id, delta, self._loader())
+            self.backend.incr(self._key(day), user_id, delta, self._loader(day))
+            self.backend.drop_except({self._key(), self._key(day), self._key(day - timedelta(days=1))})
+        except Exception:
+            # 排行榜只是读模型，更新失败不影响游戏本身，下次刷新时会从数据库纠正
+            logger.exception("更新排行榜失败")
+
+    def set_points(self, user_id, points):
+        user_id = int(user_id)
+        try:
+            self.backend.set(self._key(), user_id, points or 0, self._loader())
+        except Exception:
+            logger.exception("更新排行榜失败")
+
+    def remove_user(self, user_id):
+        user_id = int(user_id)
+        try:
+            self.backend.remove(self._key(), user_id)
+            self.backend.remove(self._key(date.today()), user_id)
+        except Exception:
+            logger.exception("更新排行榜失败")
+
+    def top(self, n=10, day=None):
+        """[(user_id, score)]，day 为 None 时是总积分榜"""
+        return self.backend.top(self._key(day), n, self._loader(day))
+
+    def rank(self, user_id, day=None):
+        """(名次（从 1 开始）, 分数)，不在榜上返回 None"""
+        result = self.backend.rank(self._key(day), int(user_id), self._loader(day))
+        if result is None:
+            return None
+        rank, score = result
+        return rank + 1, score
+
+
+_leaderboard = None
+_leaderboard_lock = threading.Lock()
+
+
+def get_leaderboard():
+    global _leaderboard
+    if _leaderboard is None:
+        with _leaderboard_lock:
+            if _leaderboard is None:
+                if config.REDIS_URL and redis is not None:
+                    backend = RedisBackend(config.REDIS_URL)
+                else:
+                    if config.REDIS_URL:
+                        logger.warning("已配置 config.REDIS_URL 但未安装 redis 包，排行榜使用进程内存储")
+                    backend = LocalBackend(config.LEADERBOARD_REFRESH_SECONDS)
+                _leaderboard = Leaderboard(backend)
+    return _leaderboard
+
+
+def top_users(n=10, day=None):
+    """排行榜前 n 名，附带用户名和当日数据，按名次排序"""
+    board = get_leaderboard().top(n, day)
+    if not board:
+        return []
+    user_ids = [user_id for user_id, _ in board]
+    with get_conn() as conn, conn.cursor() as c:
+        c.execute(queries.LEADERBOARD_USERS_SQL, {"user_ids": user_ids, "day": day or date.today()})
+        columns = [desc[0] for desc in c.description]
+        users = {row[0]: dict(zip(columns, row)) for row in c.fetchall()}
+    result = []
+    for user_id, score in board:
+        user = users.get(user_id)
+        if user is None:
+            continue
+        user["score"] = score
+        result.append(user)
+    return result
+
+
+def top_today(n=10, day=None):
+    """今天玩过的用户按总积分排前 n 名（今日排行页面的口径），附带当日数据"""
+    with get_conn() as conn, conn.cursor() as c:
+        c.execute(queries.TODAY_RANK_SQL, {"day": day or date.today(), "limit": n})
+        columns = [desc[0] for desc in c.description]
+        return [dict(zip(columns, row)) for row in c.fetchall()]
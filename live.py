@@ -0,0 +1,285 @@
+"""
+今日排行榜和最近赢局的实时推送（Server-Sent Events，/live/stream）。
+
+play_dice 提交后调用 get_hub().record_play()，只是记下"榜单有变化"和赢局，不做任何查询；
+后台线程每 LIVE_TICK 秒检查一次：有变化且有人在看时查询一次榜单，序列化一次，
+再放进每个连接的队列。所以不管多少人在看，每个 tick 最多一次查询。
+
+- 合并：一个 tick 内的多次变化只推送一次；内容与上次相同时不推送；赢局每次最多推 LIVE_RECENT_WINS 条
+- 背压：每个连接的队列最多 LIVE_CLIENT_QUEUE 条，满了说明客户端读得太慢，直接断开；
+  EventSource 会自动重连，重连后先收到当前榜单
+- 观看者由独立的异步进程 live_server.py 服务：一个事件循环处理所有连接，连接不占线程，
+  单进程最多 LIVE_MAX_CONNECTIONS 个（默认 10000），超过返回 503。
+  反向代理把 /live/stream 转给它，或者配置 LIVE_STREAM_URL 让页面直接连过去
+- 没有部署 live_server.py 时 web 进程自己推送（Flask 的 /live/stream），gthread 下每个观看者占一个线程，
+  每个 worker 最多 LIVE_INLINE_CONNECTIONS 个，只适合开发和很少人看的情况
+- 多进程：配置 REDIS_URL 时事件经 Redis pub/sub 发给所有进程（包括 live_server.py），否则只有本进程的对局
+  会立刻触发推送，其他进程的对局最迟 LIVE_REFRESH 秒后随榜单刷新出现
+"""
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from datetime import date
+
+from config import config
+from db import get_conn
+from leaderboard import top_today
+import metrics
+import queries
+
+try:
+    import redis
+except ImportError:  # 可选依赖
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+LIVE_EVENTS = metrics.Counter("live_events_total", "推送的 SSE 事件数（按连接计）", ("event",))
+LIVE_DROPPED = metrics.Counter("live_dropped_clients_total", "因读得太慢被断开的连接数")
+
+CLOSE = object()
+
+
+class Client:
+    def __init__(self, max_queue):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.closed = False
+
+    def send(self, message):
+        """放不进队列时返回 False"""
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except queue.Full:
+            return False
+
+    def close(self):
+        self.closed = True
+        # 让阻塞在 get 上的 stream() 立刻退出；队列满时 stream 下次超时也会看到 closed
+        try:
+            self.queue.put_nowait(CLOSE)
+        except queue.Full:
+            pass
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n".encode()
+
+
+class LiveHub:
+    def __init__(self, tick=1.0, refresh=30.0, max_connections=100, client_queue=16,
+                 recent_wins=5, heartbeat=15.0, rank_size=10, redis_url=None):
+        self.tick = tick
+        self.refresh = refresh
+        self.max_connections = max_connections
+        self.client_queue = client_queue
+        self.recent_wins = recent_wins
+        self.heartbeat = heartbeat
+        self.rank_size = rank_size
+        self.channel = config.LEADERBOARD_KEY_PREFIX + "live"
+        self._redis = redis.Redis.from_url(redis_url) if redis_url and redis is not None else None
+
+        self._clients = set()
+        self._lock = threading.Lock()
+        self._dirty = True
+        self._wins = []  # [(user_id, delta, user_roll, bot_roll)]
+        self._snapshot = None  # 最近一次推送的榜单（已序列化），新连接先收到它
+        self._last_rank = None
+        self._last_refresh = 0.0
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._threads = []
+        self._stopping = threading.Event()
+
+    # --- 生命周期（fork 后线程不会被继承，按 pid 判断） ---
+    def start(self):
+        with self._start_lock:
+            if self._pid == os.getpid() and all(t.is_alive() for t in self._threads):
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._threads = [threading.Thread(target=self._run_ticker, name="live-ticker", daemon=True)]
+            if self._redis is not None:
+                self._threads.append(threading.Thread(target=self._run_subscriber, name="live-redis", daemon=True))
+            for t in self._threads:
+                t.start()
+
+    def stop(self):
+        self._stopping.set()
+        with self._lock:
+            clients = list(self._clients)
+            self._clients.clear()
+        for client in clients:
+            client.close()
+
+    # --- 输入 ---
+    def record_play(self, user_id, delta, user_roll=None, bot_roll=None):
+        """每一局提交之后调用（批量玩时逐局调用）；不查询数据库，不阻塞"""
+        event = {"user_id": int(user_id), "delta": delta, "user_roll": user_roll, "bot_roll": bot_roll}
+        if self._redis is not None:
+            try:
+                self._redis.publish(self.channel, json.dumps(event))
+                return
+            except Exception:
+                logger.exception("发布实时事件失败，只推送给本进程")
+        self._ingest(event)
+
+    def _ingest(self, event):
+        with self._lock:
+            self._dirty = True
+            if event["delta"] >= config.LIVE_BIG_WIN_POINTS:
+                self._wins.append((event["user_id"], event["delta"], event["user_roll"], event["bot_roll"]))
+                del self._wins[:-self.recent_wins]
+
+    def _run_subscriber(self):
+        while not self._stopping.is_set():
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    if self._stopping.is_set():
+                        return
+                    self._ingest(json.loads(message["data"]))
+            except Exception:
+                logger.exception("实时事件订阅断开，5 秒后重连")
+                # 断开期间可能漏掉事件，重连后整体刷新一次
+                self._dirty = True
+                self._stopping.wait(5)
+
+    # --- 订阅 ---
+    def subscribe(self, client=None):
+        """返回 Client（可以传入自己的实现，见 live_server.py）；连接数已满时返回 None"""
+        self.start()
+        client = client or Client(self.client_queue)
+        with self._lock:
+            if len(self._clients) >= self.max_connections:
+                return None
+            self._clients.add(client)
+            snapshot = self._snapshot
+        if snapshot is not None:
+            client.send(snapshot)
+        return client
+
+    def unsubscribe(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+    def stream(self, client):
+        """SSE 响应体；客户端断开时 gunicorn 关闭生成器，finally 里退订"""
+        try:
+            yield self.preamble()
+            while not client.closed:
+                try:
+                    message = client.queue.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    # 注释行，保持代理不断开，也让写失败尽早暴露
+                    yield b": ping\n\n"
+                    continue
+                if message is CLOSE:
+                    break
+                yield message
+        finally:
+            self.unsubscribe(client)
+
+    def preamble(self):
+        """每个连接最先发送的内容：断线后 EventSource 等多久重连"""
+        return f"retry: {int(self.tick * 3000)}\n\n".encode()
+
+    def stats(self):
+        with self._lock:
+            return {"connections": len(self._clients), "max_connections": self.max_connections}
+
+    # --- 推送 ---
+    def _broadcast(self, event, message):
+        with self._lock:
+            clients = list(self._clients)
+        slow = [client for client in clients if not client.send(message)]
+        LIVE_EVENTS.inc(event, amount=len(clients) - len(slow))
+        for client in slow:
+            self.unsubscribe(client)
+            client.close()
+            LIVE_DROPPED.inc()
+
+    def _load_names(self, user_ids):
+        with get_conn() as conn, conn.cursor() as c:
+            c.execute(queries.LIVE_USERNAMES_SQL, {"user_ids": list(user_ids)})
+            return dict(c.fetchall())
+
+    def tick_once(self):
+        with self._lock:
+            watching = bool(self._clients)
+            refresh_due = time.monotonic() - self._last_refresh >= self.refresh
+            dirty = self._dirty or refresh_due
+            wins, self._wins = self._wins, []
+            if watching:
+                self._dirty = False
+        if not watching:
+            # 没人在看时不查询，保留 dirty，下一个连接进来后再算
+            return
+
+        try:
+            if wins:
+                names = self._load_names({user_id for user_id, _, _, _ in wins})
+                data = [{"username": names.get(user_id) or "匿名", "delta": delta,
+                         "user_roll": user_roll, "bot_roll": bot_roll}
+                        for user_id, delta, user_roll, bot_roll in wins]
+                self._broadcast("wins", format_event("wins", data))
+                wins = []
+            if dirty:
+                self._broadcast_rank()
+        except Exception:
+            # 查询失败时把没推送出去的赢局和 dirty 放回去，下一个 tick 重试，不用等到下次定时刷新
+            with self._lock:
+                self._wins[:0] = wins
+                del self._wins[:-self.recent_wins]
+                self._dirty = self._dirty or dirty
+            raise
+
+    def _broadcast_rank(self):
+        rank = [{"username": u["username"] or "匿名", "points_today": u["points_today"],
+                 "points": u["points"], "plays_today": u["plays_today"], "wins_today": u["wins_today"],
+                 "losses_today": u["losses_today"], "draws_today": u["draws_today"]}
+                for u in top_today(self.rank_size, day=date.today())]
+        self._last_refresh = time.monotonic()
+        if rank != self._last_rank:
+            self._last_rank = rank
+            message = format_event("rank", rank)
+            with self._lock:
+                self._snapshot = message
+            self._broadcast("rank", message)
+
+    def _run_ticker(self):
+        while not self._stopping.wait(self.tick):
+            try:
+                self.tick_once()
+            except Exception:
+                logger.exception("实时推送失败")
+
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+def new_hub(max_connections, hub_class=LiveHub):
+    return hub_class(
+        tick=config.LIVE_TICK,
+        refresh=config.LIVE_REFRESH,
+        max_connections=max_connections,
+        client_queue=config.LIVE_CLIENT_QUEUE,
+        recent_wins=config.LIVE_RECENT_WINS,
+        heartbeat=config.LIVE_HEARTBEAT,
+        redis_url=config.REDIS_URL,
+    )
+
+
+def get_hub():
+    """web 进程里的 hub：负责发布对局事件，以及没有 live_server.py 时的少量观看者"""
+    global _hub
+    if _hub is None:
+        with _hub_lock:
+            if _hub is None:
+                _hub = new_hub(max(0, min(config.LIVE_INLINE_CONNECTIONS, config.WEB_THREADS - 1)))
+    return _hub
@@ -0,0 +1,162 @@
+"""
+/live/stream 的独立异步进程：一个事件循环服务所有 SSE 连接，观看者不占线程，单进程几千个连接没问题。
+
+    python live_server.py            # 监听 LIVE_HOST:LIVE_PORT
+
+榜单查询、Redis 订阅沿用 live.LiveHub 的两个后台线程（每个 tick 最多一次查询，与观看人数无关），
+推送时把广播交给事件循环，在循环里放进各连接的 asyncio.Queue，写 socket 全部在循环里完成。
+web 进程的对局经 Redis pub/sub 过来，所以多进程部署需要 REDIS_URL（没有时最迟 LIVE_REFRESH 秒随榜单刷新）。
+
+部署：反向代理按路径把 /live/stream 转到这里（同源，页面不用改）；或者单独的域名 / 端口，
+配置 LIVE_STREAM_URL 为完整地址，跨域时按 LIVE_ALLOW_ORIGIN 返回 CORS 头。
+只实现了 GET /live/stream，其他路径返回 404。
+"""
+import asyncio
+import logging
+
+from config import config
+from live import CLOSE, LiveHub, new_hub
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+STREAM_PATH = "/live/stream"
+MAX_HEADER_LINES = 100
+HEADER_TIMEOUT = 10.0
+
+
+class AsyncClient:
+    """只在事件循环线程里使用"""
+
+    def __init__(self, max_queue):
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.closed = False
+
+    def send(self, message):
+        """放不进队列时返回 False"""
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def close(self):
+        self.closed = True
+        try:
+            self.queue.put_nowait(CLOSE)
+        except asyncio.QueueFull:
+            pass
+
+
+class AsyncLiveHub(LiveHub):
+    """广播从 ticker 线程转到事件循环里执行，连接的队列和 socket 只被循环线程访问"""
+
+    def __init__(self, loop, **kwargs):
+        super().__init__(**kwargs)
+        self.loop = loop
+
+    def _broadcast(self, event, message):
+        self.loop.call_soon_threadsafe(super()._broadcast, event, message)
+
+
+def _response_head(status, headers):
+    lines = [f"HTTP/1.1 {status}"] + [f"{k}: {v}" for k, v in headers.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+class LiveServer:
+    def __init__(self, hub):
+        self.hub = hub
+
+    async def _read_request(self, reader):
+        """返回请求路径；请求不完整或太长时返回 None"""
+        request_line = await asyncio.wait_for(reader.readline(), HEADER_TIMEOUT)
+        for _ in range(MAX_HEADER_LINES):
+            line = await asyncio.wait_for(reader.readline(), HEADER_TIMEOUT)
+            if line in (b"\r\n", b"\n", b""):
+                break
+        else:
+            return None
+        parts = request_line.decode("latin-1").split()
+        if len(parts) != 3 or parts[0] != "GET":
+            return None
+        return parts[1].split("?", 1)[0]
+
+    async def handle(self, reader, writer):
+        client = None
+        try:
+            path = await self._read_request(reader)
+            if path != STREAM_PATH:
+                writer.write(_response_head("404 Not Found", {"Content-Length": "0", "Connection": "close"}))
+                return
+            client = self.hub.subscribe(AsyncClient(self.hub.client_queue))
+            if client is None:
+                body = '{"error": "实时连接已满，请稍后再试"}'.encode()
+                writer.write(_response_head("503 Service Unavailable", {
+                    "Content-Type": "application/json", "Content-Length": str(len(body)),
+                    "Retry-After": "10", "Connection": "close",
+                }) + body)
+                return
+            await self._stream(client, writer)
+        except (asyncio.TimeoutError, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            if client is not None:
+                self.hub.unsubscribe(client)
+            writer.close()
+
+    async def _stream(self, client, writer):
+        # 没有 Content-Length，响应体一直持续到任一方关闭连接
+        writer.write(_response_head("200 OK", {
+            "Content-Type": "text/event-stream; charset=utf-8",
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            "Access-Control-Allow-Origin": config.LIVE_ALLOW_ORIGIN,
+            "Connection": "close",
+        }))
+        writer.write(self.hub.preamble())
+        await writer.drain()
+        while not client.closed:
+            try:
+                message = await asyncio.wait_for(client.queue.get(), self.hub.heartbeat)
+            except asyncio.TimeoutError:
+                # 注释行，保持代理不断开，也让写失败尽早暴露
+                message = b": ping\n\n"
+            if message is CLOSE:
+                break
+            writer.write(message)
+            # 客户端读得慢时卡在这里，队列积满后 hub 会把它断开
+            await writer.drain()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port, backlog=1024)
+        logger.info("live_server 监听 %s:%s，最多 %s 个连接", host, port, self.hub.max_connections)
+        self.hub.start()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.hub.stop()
+
+
+def _raise_nofile_limit():
+    # 每个连接一个文件描述符，很多系统默认软上限只有 1024
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        target = 65536 if hard == resource.RLIM_INFINITY else hard
+        if soft != resource.RLIM_INFINITY and soft < target:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+    except (ImportError, ValueError, OSError):
+        logger.warning("无法调高文件描述符上限，连接数可能受限")
+
+
+async def main():
+    _raise_nofile_limit()
+    hub = new_hub(config.LIVE_MAX_CONNECTIONS,
+                  hub_class=lambda **kwargs: AsyncLiveHub(asyncio.get_running_loop(), **kwargs))
+    await LiveServer(hub).serve(config.LIVE_HOST, config.LIVE_PORT)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
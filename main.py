@@ -1,57 +1,69 @@
+import io
 import os
-import random
-import psycopg2
-import requests
-import hashlib
-import hmac
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, g
-from dotenv import load_dotenv
+import csv
+import json
+import logging
+import secrets
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, g, Response, stream_with_context
 from datetime import datetime
 from datetime import date
-
-load_dotenv()
+from db import get_conn, pool_stats
+from game import play_round, play_rounds, UserNotFound, DailyLimitReached, DAILY_PLAY_LIMIT
+from dice_engine import get_engine
+from gamelog_writer import get_writer
+from migrations import run_migrations
+from leaderboard import get_leaderboard, top_today
+from notifier import get_notifier
+import queries
+import metrics
+import cache
+import admin_bulk
+import user_search
+import referrals
+from telegram_auth import get_auth, AuthError
+import ratelimit
+import assets
+from live import get_hub
+from config import config
+
+logging.basicConfig(level=config.LOG_LEVEL)
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-app.secret_key = os.getenv("SECRET_KEY", "devsecret")
-DATABASE_URL = os.getenv("DATABASE_URL")
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-
-def get_conn():
-    return psycopg2.connect(DATABASE_URL)
-
-from datetime import date
+app.secret_key = config.SECRET_KEY
+if config.PROXY_COUNT:
+    from werkzeug.middleware.proxy_fix import ProxyFix
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=config.PROXY_COUNT, x_proto=config.PROXY_COUNT)
+metrics.install_flask(app)
+assets.install(app)
+ADMIN_PAGE_SIZE_MAX = 500
+ADMIN_EXPORT_BATCH_SIZE = 2000
+
+def auth_owner():
+    """当前浏览器会话的标识：同一会话可以重复提交同一份 Telegram 登录数据，其他会话提交视为重放"""
+    if "auth_owner" not in session:
+        session["auth_owner"] = secrets.token_hex(16)
+    return session["auth_owner"]
 
-def auto_reset_daily_plays():
-    today = date.today()
-    with get_conn() as conn, conn.cursor() as c:
-        c.execute("""
-            UPDATE users
-            SET plays = 0,
-                daily_reset = %s
-            WHERE daily_reset IS NULL OR daily_reset < %s
-        """, (today, today))
-        conn.commit()
-        
-def check_telegram_auth(data):
-    auth_data = dict(data)
-    hash_check = auth_data.pop("hash", "")
-    data_check_str = "\n".join(f"{k}={str(auth_data[k])}" for k in sorted(auth_data))
-    secret_key = hashlib.sha256(BOT_TOKEN.encode()).digest()
-    hmac_hash = hmac.new(secret_key, data_check_str.encode(), hashlib.sha256).hexdigest()
-    return hmac_hash == hash_check
 
 @app.route("/bind/telegram", methods=["POST"])
 def bind_telegram():
-    data = request.get_json()
-    if not data or not check_telegram_auth(data):
+    data = request.get_json(silent=True)
+    if not data:
         return jsonify({"success": False, "error": "Telegram 验证失败"})
+    try:
+        verified = get_auth().verify_login(data, owner=auth_owner())
+    except AuthError as e:
+        return jsonify({"success": False, "error": f"Telegram 验证失败：{e}"})
 
     user_id = data.get("id")
     username = data.get("username")
     phone = session.get("bind_phone")
     invited_by = session.get("invited_by")
 
+    # 手机号缺失 / 已被占用可以改正后重试，释放这份登录数据
     if not phone:
+        verified.release()
         return jsonify({"success": False, "error": "缺少手机号"})
 
     with get_conn() as conn, conn.cursor() as c:
@@ -59,21 +71,23 @@ def bind_telegram():
         c.execute("SELECT user_id FROM users WHERE phone = %s AND user_id != %s", (phone, user_id))
         existing = c.fetchone()
         if existing:
+            verified.release()
             return jsonify({"success": False, "error": "该手机号已被绑定其他账号"})
 
         # 新增或更新用户记录
-        c.execute("SELECT 1 FROM users WHERE user_id = %s", (user_id,))
-        if not c.fetchone():
+        c.execute("SELECT phone FROM users WHERE user_id = %s", (user_id,))
+        row = c.fetchone()
+        if not row:
             c.execute("""
-                INSERT INTO users (user_id, username, phone, created_at, invited_by)
-                VALUES (%s, %s, %s, now(), %s)
-            """, (user_id, username, phone, invited_by))
+                INSERT INTO users (user_id, username, phone, created_at)
+                VALUES (%s, %s, %s, now())
+            """, (user_id, username, phone))
         else:
-            c.execute("""
-                UPDATE users SET username = %s, phone = %s, invited_by = COALESCE(invited_by, %s)
-                WHERE user_id = %s
-            """, (username, phone, invited_by, user_id))
+            c.execute("UPDATE users SET username = %s, phone = %s WHERE user_id = %s", (username, phone, user_id))
+        # 已有邀请人时不会覆盖
+        referrals.link(c, user_id, invited_by)
         conn.commit()
+    cache.invalidate_user(user_id, phones=(phone, row[0] if row else None))
 
     session["user_id"] = user_id
 
@@ -93,12 +107,8 @@ def bind_telegram():
     return jsonify({"success": True})
     
 def send_telegram_message(user_id, text):
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-    payload = {"chat_id": user_id, "text": text}
-    try:
-        requests.post(url, json=payload, timeout=3)
-    except Exception as e:
-        print(f"发送 Telegram 消息失败: {e}")  
+    # 只入队，由 notifier 后台线程发送，不阻塞当前请求
+    get_notifier().send_message(user_id, text)
 
 # 请求结束自动关闭连接
 @app.teardown_appcontext
@@ -112,24 +122,18 @@ def index():
     return render_template("login.html")
 
 @app.route("/login", methods=["POST"])
+@ratelimit.limit("login", json=False)
 def login():
     phone = request.form.get("phone")
-    print("[DEBUG] 用户输入手机号:", phone)
-
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT user_id FROM users WHERE phone = %s", (phone,))
-    result = cur.fetchone()
-    print("[DEBUG] 数据库查询结果:", result)
-    cur.close()
-    conn.close()
-
-    if result:
-        user_id = result[0]
-        print("[DEBUG] 跳转至 /dice?uid=", user_id)
+    logger.debug("登录手机号: %s", phone)
+
+    user_id = cache.get_user_id_by_phone(phone) if phone else None
+    logger.debug("登录查询结果: %s", user_id)
+
+    if user_id:
         return redirect(f"/dice?uid={user_id}")
     else:
-        print("[DEBUG] 该手机号未绑定 Telegram，跳转至 bot")
+        logger.debug("手机号 %s 未绑定 Telegram，跳转至 bot", phone)
         return '''
         <html>
         <head>
@@ -156,8 +160,7 @@ def bind_page():
 def bind_submit():
     phone = request.form.get("phone")
     inviter = request.args.get("inviter")
-    print("[DEBUG] phone:", phone)
-    print("[DEBUG] inviter:", inviter)
+    logger.debug("绑定手机号: %s, inviter: %s", phone, inviter)
 
     if not phone:
         return "请输入手机号", 400
@@ -173,30 +176,51 @@ def auth():
     username = session.get("bind_username", "")
     invited_by = session.get("invited_by")
 
-    print("AUTH DEBUG:", user_id, phone, invited_by)
+    logger.debug("auth: user_id=%s phone=%s invited_by=%s", user_id, phone, invited_by)
 
     if not user_id or not phone:
         return "绑定数据不完整", 400
 
     with get_conn() as conn, conn.cursor() as c:
-        c.execute("SELECT 1 FROM users WHERE user_id = %s", (user_id,))
-        if not c.fetchone():
+        c.execute("SELECT phone FROM users WHERE user_id = %s", (user_id,))
+        row = c.fetchone()
+        if not row:
             c.execute("""
-                INSERT INTO users (user_id, username, phone, created_at, invited_by)
-                VALUES (%s, %s, %s, now(), %s)
-            """, (user_id, username, phone, invited_by))
+                INSERT INTO users (user_id, username, phone, created_at)
+                VALUES (%s, %s, %s, now())
+            """, (user_id, username, phone))
         else:
             c.execute("""
                 UPDATE users
                 SET username = %s,
-                    phone = %s,
-                    invited_by = COALESCE(invited_by, %s)
+                    phone = %s
                 WHERE user_id = %s
-            """, (username, phone, invited_by, user_id))
+            """, (username, phone, user_id))
+        referrals.link(c, user_id, invited_by)
+    cache.invalidate_user(user_id, phones=(phone, row[0] if row else None))
 
     session["user_id"] = user_id
     return redirect(url_for("dice"))
 
+@app.route("/auth/webapp", methods=["POST"])
+def auth_webapp():
+    """从 Telegram Mini App 打开时用 initData 直接登录，不用再输手机号"""
+    init_data = request.form.get("initData") or (request.get_json(silent=True) or {}).get("initData")
+    try:
+        fields = get_auth().verify_webapp(init_data, owner=auth_owner())
+    except AuthError as e:
+        return jsonify({"success": False, "error": f"Telegram 验证失败：{e}"}), 403
+
+    user_id = (fields.get("user") or {}).get("id")
+    if not user_id:
+        return jsonify({"success": False, "error": "缺少用户信息"}), 400
+    if cache.get_user_quota(user_id) is None:
+        # 绑定手机号后同一份 initData 还可以再用
+        fields.release()
+        return jsonify({"success": False, "error": "请先在 Bot 中绑定手机号"}), 404
+    session["user_id"] = str(user_id)
+    return jsonify({"success": True, "redirect": url_for("dice")})
+
 @app.route("/dice")
 def dice():
     uid = request.args.get("uid")
@@ -206,118 +230,161 @@ def dice():
         return redirect(url_for("login"))
 
     user_id = session["user_id"]
-    with get_conn() as conn, conn.cursor() as c:
-        c.execute("SELECT plays, daily_reset FROM users WHERE user_id = %s", (user_id,))
-        row = c.fetchone()
-        plays_today = row[0] or 0
-        daily_reset = row[1]
-        today = date.today()
-        if daily_reset != today:
-            plays_today = 0
-    remaining = max(0, 10 - plays_today)
+    quota = cache.get_user_quota(user_id)
+    plays_today = 0
+    if quota and quota["daily_reset"] == date.today().isoformat():
+        plays_today = quota["plays"]
+    remaining = max(0, DAILY_PLAY_LIMIT - plays_today)
     return render_template("dice.html", remaining=remaining)
 
 @app.route("/dice/play", methods=["POST"])
+@ratelimit.limit("play")
 def play_dice():
     user_id = session.get("user_id")
     if not user_id:
         return jsonify({"error": "未登录"}), 401
 
-    with get_conn() as conn, conn.cursor() as c:
-        c.execute("SELECT plays, daily_reset FROM users WHERE user_id = %s", (user_id,))
-        row = c.fetchone()
-        if not row:
-            return jsonify({"error": "用户不存在"}), 404
-
-        plays_today, daily_reset = row
-        today = date.today()
-
-        if daily_reset != today:
-            plays_today = 0
-            c.execute("UPDATE users SET plays = 0, daily_reset = %s WHERE user_id = %s", (today, user_id))
+    writer = get_writer()
+    board = get_leaderboard()
+    today = date.today()
+    try:
+        # 提交和更新排行榜之间不能插进排行榜的重新加载，见 leaderboard.LocalBackend
+        with get_conn() as conn, board.recording():
+            outcome = play_round(conn, user_id, today, log_inline=writer is None)
             conn.commit()
+            board.record_play(user_id, outcome["delta"], today)
+    except UserNotFound:
+        cache.invalidate_user(user_id)
+        return jsonify({"error": "用户不存在"}), 404
+    except DailyLimitReached:
+        return jsonify({"error": f"你今天已达游戏上限（{DAILY_PLAY_LIMIT}次），请明天再来"}), 403
+
+    # 异步模式：提交成功后再把游戏记录交给后台批量写入
+    if writer:
+        writer.submit(user_id, outcome["user"], outcome["bot"], outcome["message"], outcome["played_at"])
+    get_hub().record_play(user_id, outcome["delta"], outcome["user"], outcome["bot"])
+    cache.set_user_quota(user_id, DAILY_PLAY_LIMIT - outcome["remaining"], today)
+
+    payload = {
+        "user": outcome["user"],
+        "bot": outcome["bot"],
+        "message": outcome["message"],
+        "remaining": outcome["remaining"]
+    }
+    if outcome["nonce"] is not None:
+        payload["nonce"] = outcome["nonce"]
+    return jsonify(payload)
+
+
+@app.route("/dice/play/batch", methods=["POST"])
+@ratelimit.limit("play")
+def play_dice_batch():
+    """一次请求玩多局（最多到今天剩余次数），返回每一局的结果供前端依次播放动画"""
+    user_id = session.get("user_id")
+    if not user_id:
+        return jsonify({"error": "未登录"}), 401
+    count = (request.get_json(silent=True) or {}).get("count", DAILY_PLAY_LIMIT)
+    if not isinstance(count, int) or isinstance(count, bool) or not 1 <= count <= DAILY_PLAY_LIMIT:
+        return jsonify({"error": f"count 必须是 1–{DAILY_PLAY_LIMIT} 的整数"}), 400
 
-        if plays_today >= 10:
-            return jsonify({"error": "你今天已达游戏上限（10次），请明天再来"}), 403
-
-        user_roll = random.randint(1, 6)
-        bot_roll = random.randint(1, 6)
-        delta, result = (10, "你赢了！+10") if user_roll > bot_roll else (-5, "你输了！-5") if user_roll < bot_roll else (0, "平局")
-
-        c.execute("INSERT INTO game_logs (user_id, user_roll, bot_roll, result) VALUES (%s, %s, %s, %s)",
-                  (user_id, user_roll, bot_roll, result))
-        c.execute("""
-            UPDATE users
-            SET points = points + %s,
-                plays = plays + 1,
-                last_game_time = CURRENT_TIMESTAMP
-            WHERE user_id = %s
-        """, (delta, user_id))
-        conn.commit()
-
-        remaining = 9 - plays_today
+    writer = get_writer()
+    board = get_leaderboard()
+    today = date.today()
+    try:
+        # 提交和更新排行榜之间不能插进排行榜的重新加载，见 leaderboard.LocalBackend
+        with get_conn() as conn, board.recording():
+            outcome = play_rounds(conn, user_id, today, count, log_inline=writer is None)
+            conn.commit()
+            board.record_play(user_id, outcome["delta"], today)
+    except UserNotFound:
+        cache.invalidate_user(user_id)
+        return jsonify({"error": "用户不存在"}), 404
+    except DailyLimitReached:
+        return jsonify({"error": f"你今天已达游戏上限（{DAILY_PLAY_LIMIT}次），请明天再来"}), 403
+
+    if writer:
+        for r in outcome["rounds"]:
+            writer.submit(user_id, r["user"], r["bot"], r["message"], outcome["played_at"])
+    for r in outcome["rounds"]:
+        get_hub().record_play(user_id, r["delta"], r["user"], r["bot"])
+    cache.set_user_quota(user_id, DAILY_PLAY_LIMIT - outcome["remaining"], today)
+
+    rounds = []
+    for r in outcome["rounds"]:
+        item = {"user": r["user"], "bot": r["bot"], "message": r["message"]}
+        if r["nonce"] is not None:
+            item["nonce"] = r["nonce"]
+        rounds.append(item)
+    return jsonify({"rounds": rounds, "delta": outcome["delta"], "remaining": outcome["remaining"]})
+
+
+@app.route("/dice/fairness")
+def dice_fairness():
+    """可验证公平模式：当天返回服务端种子的 commitment，之前的日期返回种子本身"""
+    user_id = session.get("user_id")
+    if not user_id:
+        return jsonify({"error": "未登录"}), 401
+    engine = get_engine()
+    if not engine.needs_nonce:
+        return jsonify({"error": "未启用可验证公平模式"}), 404
 
-    return jsonify({
-        "user": user_roll,
-        "bot": bot_roll,
-        "message": result,
-        "remaining": remaining
-    })
+    today = date.today()
+    try:
+        day = date.fromisoformat(request.args["day"]) if request.args.get("day") else today
+    except ValueError:
+        return jsonify({"error": "日期格式错误"}), 400
+    if day > today:
+        return jsonify({"error": "只能查询今天及以前的日期"}), 400
+
+    data = {"day": day.isoformat(), "commitment": engine.commitment(user_id, day)}
+    if day < today:
+        data["server_seed"] = engine.server_seed(user_id, day)
+    return jsonify(data)
     
 from flask import request
 
 @app.route("/admin")
 def admin_dashboard():
-    auto_reset_daily_plays()
     keyword = request.args.get("q", "").strip()
     blocked_filter = request.args.get("filter", "").strip()
     start_date = request.args.get("start_date")
     end_date = request.args.get("end_date")
-    
-    query = """
-    SELECT 
-        u.user_id, u.username, u.phone, u.points, u.plays, u.last_game_time,
-        u.created_at, u.invited_by, u.blocked,
-        inviter.username AS inviter,
-        COALESCE(inv.invited_count, 0) AS invited_count
-    FROM users u
-    LEFT JOIN users inviter ON u.invited_by = inviter.user_id
-    LEFT JOIN (
-        SELECT invited_by, COUNT(*) AS invited_count
-        FROM users
-        WHERE invited_by IS NOT NULL
-        GROUP BY invited_by
-    ) inv ON u.user_id = inv.invited_by
-    WHERE 1=1
-    """
-    params = []
-
-    if keyword:
-        query += " AND (u.username ILIKE %s OR u.phone ILIKE %s)"
-        params += [f"%{keyword}%", f"%{keyword}%"]
-
-    if blocked_filter == "1":
-        query += " AND u.blocked = TRUE"
-    elif blocked_filter == "0":
-        query += " AND (u.blocked = FALSE OR u.blocked IS NULL)"
-        
-    if start_date:
-        query += " AND u.created_at >= %s"
-        params.append(start_date)
-    if end_date:
-        query += " AND u.created_at <= %s"
-        params.append(end_date)    
+    page = max(1, request.args.get("page", 1, type=int))
+    page_size = min(max(1, request.args.get("page_size", config.ADMIN_PAGE_SIZE, type=int)), ADMIN_PAGE_SIZE_MAX)
+    after = request.args.get("after", type=int)
+    before = request.args.get("before", type=int)
+
+    where, params = queries.user_filter_clause(keyword, blocked_filter, start_date, end_date)
+    params["limit"] = page_size
+    params["today"] = date.today()
+    # keyset 分页：下一页取 user_id > after，上一页取 user_id < before 再倒序取回
+    if before is not None:
+        keyset, direction = "AND u.user_id < %(before)s", "DESC"
+        params["before"] = before
+    elif after is not None:
+        keyset, direction = "AND u.user_id > %(after)s", "ASC"
+        params["after"] = after
+    else:
+        keyset, direction = "", "ASC"
+        page = 1
 
     with get_conn() as conn, conn.cursor() as c:
-        c.execute(query, params)
-        users = [dict(zip([desc[0] for desc in c.description], row)) for row in c.fetchall()]
-
-        stats = {
-            "total": len(users),
-            "verified": sum(1 for u in users if u["phone"]),
-            "blocked": sum(1 for u in users if u.get("blocked")),
-            "points": sum(u["points"] or 0 for u in users)
-        }
+        c.execute(queries.ADMIN_PAGE_SQL.format(where=where, keyset=keyset, direction=direction), params)
+        columns = [desc[0] for desc in c.description]
+        rows = [dict(zip(columns, row)) for row in c.fetchall()]
+
+    first = rows[0]
+    stats = {
+        "total": first["stat_total"],
+        "verified": first["stat_verified"],
+        "blocked": first["stat_blocked"],
+        "points": first["stat_points"]
+    }
+    users = []
+    for row in rows:
+        if row["user_id"] is None:
+            continue
+        users.append({k: v for k, v in row.items() if not k.startswith("stat_")})
 
     def format_time(value):
         if isinstance(value, datetime):
@@ -333,101 +400,251 @@ def admin_dashboard():
         u["created_at"] = format_time(u.get("created_at"))
         u["last_game_time"] = format_time(u.get("last_game_time"))
 
-    return render_template("admin.html", users=users, stats=stats, request=request, keyword=keyword, page=1, total_pages=1)
+    total_pages = max(1, -(-stats["total"] // page_size))
+    page = min(page, total_pages)
+    cursors = {
+        "prev": users[0]["user_id"] if users and page > 1 else None,
+        "next": users[-1]["user_id"] if users and page < total_pages else None,
+    }
+
+    return render_template("admin.html", users=users, stats=stats, request=request, keyword=keyword,
+                           page=page, total_pages=total_pages, page_size=page_size, cursors=cursors)
+
+@app.route("/admin/search")
+def admin_search():
+    """后台搜索框的即时提示"""
+    limit = request.args.get("limit", user_search.DEFAULT_LIMIT, type=int)
+    return jsonify({"results": user_search.search_users(request.args.get("q", ""), limit)})
+
+
+@app.route("/admin/export")
+def admin_export():
+    """按当前筛选条件流式导出用户，服务端游标分批读取，不把结果集全部载入内存"""
+    fmt = request.args.get("format", "csv")
+    where, params = queries.user_filter_clause(
+        request.args.get("q", "").strip(),
+        request.args.get("filter", "").strip(),
+        request.args.get("start_date"),
+        request.args.get("end_date"),
+    )
+    params["today"] = date.today()
+    sql = queries.ADMIN_EXPORT_SQL.format(where=where)
+
+    def rows():
+        with get_conn() as conn, conn.cursor(name="admin_export") as c:
+            c.itersize = ADMIN_EXPORT_BATCH_SIZE
+            c.execute(sql, params)
+            columns = None
+            for row in c:
+                if columns is None:
+                    columns = [desc[0] for desc in c.description]
+                yield columns, row
+
+    def generate_csv():
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        header_written = False
+        for columns, row in rows():
+            if not header_written:
+                writer.writerow(columns)
+                header_written = True
+            writer.writerow(row)
+            if buf.tell() > 64 * 1024:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue()
+
+    def generate_json():
+        yield "["
+        sep = ""
+        for columns, row in rows():
+            yield sep + json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str)
+            sep = ",\n"
+        yield "]"
+
+    if fmt == "json":
+        body, mimetype = generate_json(), "application/json"
+    else:
+        fmt, body, mimetype = "csv", generate_csv(), "text/csv"
+    filename = f"users-{date.today().isoformat()}.{fmt}"
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
 
 @app.route("/user/save", methods=["POST"])
 def save_user():
-    data = request.get_json()
-    user_id = data.get("user_id")
+    data = request.get_json(silent=True) or {}
     blocked = data.get("blocked")
-    points = data.get("points")
-    plays = data.get("plays")
+    try:
+        user_id = admin_bulk.parse_int(data.get("user_id"))
+    except (TypeError, ValueError):
+        return jsonify({"error": "缺少 user_id"}), 400
+    # 先校验再写库：否则写库成功后才发现积分不是数字，返回 500 且排行榜没同步
+    try:
+        points = admin_bulk.parse_int(data.get("points"), bits=32)
+        plays = admin_bulk.parse_int(data.get("plays"), bits=32)
+    except (TypeError, ValueError):
+        return jsonify({"error": "积分和次数必须是整数"}), 400
     with get_conn() as conn, conn.cursor() as c:
         c.execute("""
             UPDATE users
             SET blocked = %s,
                 points = %s,
-                plays = %s
+                plays = %s,
+                daily_reset = %s
             WHERE user_id = %s
-        """, (blocked, points, plays, user_id))
+        """, (blocked, points, plays, date.today(), user_id))
         conn.commit()
+    get_leaderboard().set_points(user_id, points)
+    cache.invalidate_user(user_id)
     return jsonify({"status": "ok"})
 
 @app.route("/user/delete", methods=["POST"])
 def delete_user():
-    user_id = request.form.get("user_id")
+    user_id = request.form.get("user_id") or (request.get_json(silent=True) or {}).get("user_id")
+    if not user_id:
+        return jsonify({"error": "缺少 user_id"}), 400
     with get_conn() as conn, conn.cursor() as c:
-        c.execute("DELETE FROM users WHERE user_id = %s", (user_id,))
+        c.execute("DELETE FROM users WHERE user_id = %s RETURNING phone", (user_id,))
+        row = c.fetchone()
+        if row:
+            referrals.remove_users(c, [user_id])
         conn.commit()
+    get_leaderboard().remove_user(user_id)
+    cache.invalidate_user(user_id, phones=(row[0],) if row else ())
     return jsonify({"status": "deleted"})
 
+@app.route("/user/bulk", methods=["POST"])
+def bulk_users():
+    items = (request.get_json(silent=True) or {}).get("items")
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "缺少 items"}), 400
+    if len(items) > admin_bulk.MAX_ITEMS:
+        return jsonify({"error": f"一次最多 {admin_bulk.MAX_ITEMS} 项"}), 400
+
+    with get_conn() as conn:
+        result = admin_bulk.apply_bulk(conn, items, date.today())
+
+    board = get_leaderboard()
+    for user_id, points in result.points.items():
+        board.set_points(user_id, points or 0)
+    for user_id in result.deleted:
+        board.remove_user(user_id)
+    cache.invalidate_users(result.touched, phones=result.deleted_phones)
+    return jsonify(result.summary())
+
 @app.route("/admin/rank/today")
 def today_rank():
-    with get_conn() as conn, conn.cursor() as c:
-        c.execute("""
-            SELECT u.user_id, u.username, u.points, COUNT(g.id) AS plays_today
-            FROM users u
-            JOIN game_logs g ON u.user_id = g.user_id
-            WHERE g.timestamp::date = CURRENT_DATE
-            GROUP BY u.user_id, u.username, u.points
-            ORDER BY u.points DESC
-            LIMIT 10;
-        """)
-        users = [dict(zip([desc[0] for desc in c.description], row)) for row in c.fetchall()]
-    return render_template("rank_today.html", users=users)
+    users = top_today(10, day=date.today())
+    return render_template("rank_today.html", users=users,
+                           live_stream_url=config.LIVE_STREAM_URL or url_for("live_stream"))
+
+
+@app.route("/admin/analytics")
+def admin_analytics():
+    """离线报表（tools/analytics.py）生成的 summary.json，?format=json 时原样返回"""
+    path = os.path.join(config.ANALYTICS_DIR, "summary.json")
+    try:
+        with open(path) as f:
+            summary = json.load(f)
+    except FileNotFoundError:
+        summary = None
+    if request.args.get("format") == "json":
+        if summary is None:
+            return jsonify({"error": "还没有生成报表"}), 404
+        return jsonify(summary)
+    return render_template("analytics.html", summary=summary, path=path)
+
+
+@app.route("/live/stream")
+def live_stream():
+    """今日排行榜和赢局的 SSE 推送，事件 rank / wins，见 live.py；部署了 live_server.py 时转过去"""
+    if config.LIVE_STREAM_URL and config.LIVE_STREAM_URL != request.path:
+        return redirect(config.LIVE_STREAM_URL, code=307)
+    hub = get_hub()
+    client = hub.subscribe()
+    if client is None:
+        resp = jsonify({"error": "实时连接已满，请稍后再试"})
+        resp.status_code = 503
+        resp.headers["Retry-After"] = "10"
+        return resp
+    resp = Response(hub.stream(client), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    # nginx 等代理默认缓冲响应，事件会攒着不发
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
     
 @app.route("/user/logs")
 def user_logs():
     user_id = request.args.get("user_id")
     with get_conn() as conn, conn.cursor() as c:
-        c.execute("""
-            SELECT user_roll, bot_roll, result, timestamp
-            FROM game_logs
-            WHERE user_id = %s
-            ORDER BY timestamp DESC
-            LIMIT 100
-        """, (user_id,))
+        c.execute(queries.USER_LOGS_SQL, {"user_id": user_id})
         logs = [dict(zip([desc[0] for desc in c.description], row)) for row in c.fetchall()]
     return render_template("user_logs.html", logs=logs)
 
 @app.route("/invitees")
 def view_invitees():
-    user_id = request.args.get("user_id")
-    with get_conn() as conn, conn.cursor() as c:
-        c.execute("SELECT user_id, username, phone, points FROM users WHERE invited_by = %s", (user_id,))
-        invitees = [dict(zip([desc[0] for desc in c.description], row)) for row in c.fetchall()]
-    return render_template("invitees.html", invitees=invitees)
+    user_id = request.args.get("user_id", type=int)
+    if user_id is None:
+        return "缺少 user_id", 400
+    depth = request.args.get("depth", 1, type=int)  # 0 表示所有层级
+    invitees, next_cursor = referrals.downline(
+        user_id, max_depth=depth or None,
+        after=referrals.parse_cursor(request.args.get("after")),
+        limit=config.ADMIN_PAGE_SIZE,
+    )
+    return render_template("invitees.html", invitees=invitees, user_id=user_id, depth=depth,
+                           counts=referrals.get_counts(user_id),
+                           next_cursor=referrals.format_cursor(next_cursor))
+
+@app.route("/admin/referrals/downline")
+def referral_downline():
+    user_id = request.args.get("user_id", type=int)
+    if user_id is None:
+        return jsonify({"error": "缺少 user_id"}), 400
+    rows, next_cursor = referrals.downline(
+        user_id, max_depth=request.args.get("depth", type=int),
+        after=referrals.parse_cursor(request.args.get("after")),
+        limit=request.args.get("limit", 50, type=int),
+    )
+    return jsonify({"counts": referrals.get_counts(user_id), "results": rows,
+                    "next": referrals.format_cursor(next_cursor)})
+
+@app.route("/admin/referrals/top")
+def referral_top():
+    by = request.args.get("by", "direct")
+    if by not in ("direct", "total"):
+        return jsonify({"error": "by 只能是 direct 或 total"}), 400
+    return jsonify({"results": referrals.top_inviters(by, request.args.get("limit", 10, type=int))})
     
+@app.route("/admin/db/pool")
+def db_pool_status():
+    return jsonify(pool_stats())
+
+@app.route("/metrics")
+def metrics_endpoint():
+    gauges = {"db_pool": pool_stats(), "notifier": get_notifier().stats()}
+    return Response(metrics.render(gauges), content_type=metrics.CONTENT_TYPE)
+
+@app.route("/admin/notifier")
+def notifier_status():
+    return jsonify(get_notifier().stats())
+
 @app.route("/init")
 def init_tables():
-    with get_conn() as conn, conn.cursor() as c:
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id BIGINT PRIMARY KEY
-            );
-        """)
-        c.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS username TEXT;")
-        c.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS phone TEXT;")
-        c.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS points INTEGER DEFAULT 0;")
-        c.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS plays INTEGER DEFAULT 0;")
-        c.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS last_game_time TIMESTAMP;")
-        c.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS invited_by BIGINT;")
-        c.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS blocked BOOLEAN DEFAULT FALSE;")
-        c.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;")
-        c.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS daily_reset DATE;")
+    applied = run_migrations()
+    if not applied:
+        return "✅ 数据表已是最新版本"
+    names = "、".join(f"{version:04d}_{name}" for version, name in applied)
+    return f"✅ 数据表初始化完成（已应用迁移：{names}）"
 
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS game_logs (
-                id SERIAL PRIMARY KEY,
-                user_id BIGINT,
-                user_roll INTEGER,
-                bot_roll INTEGER,
-                result TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-        conn.commit()
-    return "✅ 数据表初始化完成（包含字段补全）"
+def preload_templates():
+    # 启动时编译全部模板；配合 gunicorn preload_app，fork 出的 worker 直接共享编译结果
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+if not config.DEBUG:
+    preload_templates()
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    app.run(debug=config.DEBUG, port=config.PORT)
@@ -0,0 +1,267 @@
+"""
+请求耗时和 SQL 统计，以 Prometheus 文本格式导出。
+
+- Flask：install_flask(app) 记录每个路由的耗时直方图、每个请求的 SQL 条数
+- 数据库：db.TimedCursor 对每条 SQL 计时，超过 SLOW_QUERY_MS 记慢查询日志；
+  get_conn 分别记录借连接、提交的耗时，能看出慢在 connect、查询还是 commit
+- bot：instrument_handler 包装 handler，按 handler 统计耗时和错误数
+
+计数保存在进程内。gunicorn 多 worker 时每个 worker 各自计数，/metrics 返回的是
+处理该次请求的 worker 的数据。
+"""
+import time
+import bisect
+import logging
+import threading
+from contextvars import ContextVar
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from config import config
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger("slow_query")
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labelvalues, value in items:
+            lines.append(f"{self.name}{_labels(self.labelnames, labelvalues)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # labelvalues -> [各桶计数（不累计）, 总和, 次数]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labelvalues)
+            if entry is None:
+                entry = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, ([*v[0]], v[1], v[2])) for k, v in self._values.items())
+        for labelvalues, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = _labels(self.labelnames, labelvalues, ("le", _number(float(bound))))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_number(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+def render(gauges=None):
+    """所有指标的 Prometheus 文本；gauges 为 {前缀: {名称: 数值}}，例如连接池状态"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    for prefix, values in (gauges or {}).items():
+        for key, value in sorted(values.items()):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            name = f"{prefix}_{key}"
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Web 请求耗时", ("route", "method", "status"))
+HTTP_REQUEST_QUERIES = Histogram(
+    "http_request_queries", "每个 Web 请求执行的 SQL 条数", ("route",), buckets=COUNT_BUCKETS)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds", "单条 SQL 耗时", ("route", "statement"))
+DB_PHASE_SECONDS = Histogram(
+    "db_phase_duration_seconds", "借连接、提交、回滚的耗时", ("route", "phase"))
+DB_SLOW_QUERIES = Counter(
+    "db_slow_queries_total", "超过 SLOW_QUERY_MS 的 SQL 条数", ("route", "statement"))
+BOT_HANDLER_SECONDS = Histogram(
+    "bot_handler_duration_seconds", "bot handler 耗时", ("handler", "status"))
+BOT_HANDLER_QUERIES = Histogram(
+    "bot_handler_queries", "每次 handler 调用执行的 SQL 条数", ("handler",), buckets=COUNT_BUCKETS)
+
+
+# --- 请求上下文 ---
+# 当前请求 / handler 的统计；bot 的 run_db 会把 context 带到线程池里
+_current = ContextVar("metrics_current", default=None)
+
+
+def begin(scope):
+    return _current.set({"scope": scope, "queries": 0, "db_time": 0.0})
+
+
+def end(token):
+    stats = _current.get()
+    _current.reset(token)
+    return stats
+
+
+def current_scope():
+    stats = _current.get()
+    return stats["scope"] if stats else "-"
+
+
+def _statement(query):
+    if isinstance(query, bytes):
+        query = query[:64].decode("utf-8", "replace")
+    else:
+        query = str(query)[:64]
+    words = query.split(None, 1)
+    return words[0].upper() if words else "-"
+
+
+def record_query(query, seconds):
+    stats = _current.get()
+    scope = stats["scope"] if stats else "-"
+    if stats is not None:
+        stats["queries"] += 1
+        stats["db_time"] += seconds
+    statement = _statement(query)
+    DB_QUERY_SECONDS.observe(seconds, scope, statement)
+    if seconds * 1000 >= config.SLOW_QUERY_MS:
+        DB_SLOW_QUERIES.inc(scope, statement)
+        text = query.decode("utf-8", "replace") if isinstance(query, bytes) else str(query)
+        slow_logger.warning("慢查询 %.1fms [%s] %s", seconds * 1000, scope, " ".join(text.split())[:500])
+
+
+def record_db_phase(phase, seconds):
+    DB_PHASE_SECONDS.observe(seconds, current_scope(), phase)
+
+
+# --- Flask ---
+def install_flask(app):
+    from flask import g, request
+
+    @app.before_request
+    def _metrics_begin():
+        rule = request.url_rule.rule if request.url_rule else "<unmatched>"
+        g.metrics_rule = rule
+        g.metrics_token = begin(rule)
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _metrics_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def _metrics_end(exc):
+        token = g.pop("metrics_token", None)
+        if token is None:
+            return
+        elapsed = time.perf_counter() - g.metrics_start
+        stats = end(token)
+        status = 500 if exc is not None else g.get("metrics_status", 500)
+        rule = g.metrics_rule
+        HTTP_REQUEST_SECONDS.observe(elapsed, rule, request.method, str(status))
+        HTTP_REQUEST_QUERIES.observe(stats["queries"], rule)
+        if elapsed * 1000 >= config.SLOW_REQUEST_MS:
+            logger.warning("慢请求 %.1fms %s %s（%d 条 SQL，共 %.1fms）", elapsed * 1000, request.method,
+                           rule, stats["queries"], stats["db_time"] * 1000)
+
+
+# --- bot ---
+def instrument_handler(handler):
+    """包装 bot handler，按函数名统计耗时、错误和 SQL 条数"""
+    import functools
+    name = handler.__name__
+
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        token = begin(f"bot:{name}")
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            return await handler(update, context)
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            stats = end(token)
+            BOT_HANDLER_SECONDS.observe(elapsed, name, status)
+            BOT_HANDLER_QUERIES.observe(stats["queries"], name)
+
+    return wrapper
+
+
+def start_http_server(port, host="0.0.0.0", gauges=None):
+    """后台线程提供 GET /metrics，给没有 Web 框架的进程（bot）使用"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            data = render(gauges() if gauges else None).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info("metrics 监听 http://%s:%s/metrics", host, port)
+    return server
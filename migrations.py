@@ -0,0 +1,388 @@
+"""
+数据库结构版本管理。
+
+    python migrations.py migrate          # 执行尚未应用的迁移
+    python migrations.py status           # 查看已应用的版本
+    python migrations.py explain [--analyze]  # 打印各路由 SQL 的执行计划
+
+新增表结构变更时在 MIGRATIONS 末尾追加一项，版本号递增，已发布的迁移不要修改。
+"""
+import sys
+import logging
+
+from db import get_conn
+import queries
+import game
+import user_search
+
+# 所有进程共用的 advisory lock id，防止多个 worker 同时跑迁移
+MIGRATION_LOCK_ID = 72019001
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = [
+    (1, "base_schema", """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY
+        );
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS username TEXT;
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS phone TEXT;
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS points INTEGER DEFAULT 0;
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS plays INTEGER DEFAULT 0;
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS last_game_time TIMESTAMP;
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS invited_by BIGINT;
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS blocked BOOLEAN DEFAULT FALSE;
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS daily_reset DATE;
+
+        CREATE TABLE IF NOT EXISTS game_logs (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT,
+            user_roll INTEGER,
+            bot_roll INTEGER,
+            result TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """),
+    (2, "hot_query_indexes", """
+        -- 旧版 bot 没有限制手机号唯一，已有的重复手机号只保留在最新注册的账号上，
+        -- 其他账号的 phone 置空（需要重新绑定），改了哪些账号记在迁移日志里
+        DO $$
+        DECLARE
+            r RECORD;
+        BEGIN
+            FOR r IN
+                WITH ranked AS (
+                    SELECT user_id, phone,
+                           row_number() OVER (PARTITION BY phone
+                                              ORDER BY created_at DESC NULLS LAST, user_id DESC) AS rn
+                    FROM users
+                    WHERE phone IS NOT NULL
+                )
+                UPDATE users u SET phone = NULL
+                FROM ranked
+                WHERE ranked.user_id = u.user_id AND ranked.rn > 1
+                RETURNING u.user_id, ranked.phone
+            LOOP
+                RAISE WARNING '手机号 % 重复，已清除用户 % 的绑定', r.phone, r.user_id;
+            END LOOP;
+        END $$;
+        -- 手机号登录；一个手机号只能绑定一个账号
+        CREATE UNIQUE INDEX IF NOT EXISTS users_phone_key ON users (phone) WHERE phone IS NOT NULL;
+        -- 邀请列表
+        CREATE INDEX IF NOT EXISTS users_invited_by_idx ON users (invited_by) WHERE invited_by IS NOT NULL;
+        -- 用户游戏记录
+        CREATE INDEX IF NOT EXISTS game_logs_user_time_idx ON game_logs (user_id, timestamp DESC);
+        -- 今日排行
+        CREATE INDEX IF NOT EXISTS game_logs_time_idx ON game_logs (timestamp);
+    """),
+    (3, "leaderboard", """
+        -- 每个用户每天的对局数和净得分，由 /dice/play 在同一条语句里增量维护
+        CREATE TABLE IF NOT EXISTS user_daily_stats (
+            day DATE NOT NULL,
+            user_id BIGINT NOT NULL,
+            plays INTEGER NOT NULL DEFAULT 0,
+            points INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, user_id)
+        );
+        CREATE INDEX IF NOT EXISTS user_daily_stats_rank_idx ON user_daily_stats (day, points DESC);
+        CREATE INDEX IF NOT EXISTS users_points_idx ON users (points DESC);
+
+        -- 补上今天已有的对局
+        INSERT INTO user_daily_stats (day, user_id, plays, points)
+        SELECT CURRENT_DATE, user_id, COUNT(*),
+               SUM(CASE WHEN user_roll > bot_roll THEN 10 WHEN user_roll < bot_roll THEN -5 ELSE 0 END)
+        FROM game_logs
+        WHERE timestamp >= CURRENT_DATE AND timestamp < CURRENT_DATE + INTERVAL '1 day'
+        GROUP BY user_id
+        ON CONFLICT (day, user_id) DO NOTHING;
+    """),
+    (4, "partition_game_logs", """
+        -- game_logs 改为按月分区（game_logs_pYYYYMM），过期数据整个分区删除，不再大批量 DELETE + VACUUM。
+        -- 没有对应分区的行落到 game_logs_default，下次建分区时会搬走。
+        ALTER TABLE game_logs RENAME TO game_logs_legacy;
+        ALTER TABLE game_logs_legacy RENAME CONSTRAINT game_logs_pkey TO game_logs_legacy_pkey;
+        ALTER INDEX IF EXISTS game_logs_user_time_idx RENAME TO game_logs_legacy_user_time_idx;
+        ALTER INDEX IF EXISTS game_logs_time_idx RENAME TO game_logs_legacy_time_idx;
+        ALTER SEQUENCE IF EXISTS game_logs_id_seq RENAME TO game_logs_legacy_id_seq;
+
+        CREATE TABLE game_logs (
+            id BIGSERIAL,
+            user_id BIGINT,
+            user_roll INTEGER,
+            bot_roll INTEGER,
+            result TEXT,
+            timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp);
+        CREATE TABLE game_logs_default PARTITION OF game_logs DEFAULT;
+        CREATE INDEX game_logs_user_time_idx ON game_logs (user_id, timestamp DESC);
+        CREATE INDEX game_logs_time_idx ON game_logs (timestamp);
+
+        -- 建立某个月的分区（已存在时返回 NULL）；housekeeping.py 每天调用，提前建好后几个月
+        CREATE OR REPLACE FUNCTION game_logs_ensure_partition(p_month DATE) RETURNS TEXT AS $$
+        DECLARE
+            start_ts TIMESTAMP := date_trunc('month', p_month);
+            end_ts TIMESTAMP := date_trunc('month', p_month) + INTERVAL '1 month';
+            part TEXT := 'game_logs_p' || to_char(p_month, 'YYYYMM');
+        BEGIN
+            IF to_regclass(part) IS NOT NULL THEN
+                RETURN NULL;
+            END IF;
+            EXECUTE format('CREATE TABLE %I (LIKE game_logs INCLUDING DEFAULTS)', part);
+            -- 默认分区里属于这个月的行先搬过来，否则 ATTACH 会因默认分区约束失败
+            EXECUTE format(
+                'WITH moved AS (DELETE FROM game_logs_default WHERE timestamp >= %L AND timestamp < %L RETURNING *) '
+                'INSERT INTO %I SELECT * FROM moved', start_ts, end_ts, part);
+            EXECUTE format('ALTER TABLE game_logs ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                           part, start_ts, end_ts);
+            RETURN part;
+        END
+        $$ LANGUAGE plpgsql;
+
+        SELECT game_logs_ensure_partition(month::date)
+        FROM generate_series(
+            date_trunc('month', LEAST((SELECT MIN(timestamp) FROM game_logs_legacy), CURRENT_TIMESTAMP)),
+            date_trunc('month', CURRENT_TIMESTAMP) + INTERVAL '3 months',
+            INTERVAL '1 month'
+        ) AS month;
+
+        -- 时间为空的旧记录放到 1970-01-01，进入默认分区
+        INSERT INTO game_logs (id, user_id, user_roll, bot_roll, result, timestamp)
+        SELECT id, user_id, user_roll, bot_roll, result, COALESCE(timestamp, 'epoch')
+        FROM game_logs_legacy;
+        SELECT setval(pg_get_serial_sequence('game_logs', 'id'), COALESCE((SELECT MAX(id) FROM game_logs), 0) + 1, false);
+        DROP TABLE game_logs_legacy;
+    """),
+    (5, "daily_stats_outcomes", """
+        -- 每日汇总增加胜负平次数；排行和报表只读 user_daily_stats，原始日志可以按保留期删除
+        ALTER TABLE user_daily_stats
+            ADD COLUMN IF NOT EXISTS wins INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS losses INTEGER NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS draws INTEGER NOT NULL DEFAULT 0;
+
+        -- 用现有日志补齐历史每一天；已有的行只补胜负平，plays / points 以在线累计的为准
+        INSERT INTO user_daily_stats (day, user_id, plays, points, wins, losses, draws)
+        SELECT timestamp::date, user_id, COUNT(*),
+               SUM(CASE WHEN user_roll > bot_roll THEN 10 WHEN user_roll < bot_roll THEN -5 ELSE 0 END),
+               COUNT(*) FILTER (WHERE user_roll > bot_roll),
+               COUNT(*) FILTER (WHERE user_roll < bot_roll),
+               COUNT(*) FILTER (WHERE user_roll = bot_roll)
+        FROM game_logs
+        WHERE user_id IS NOT NULL AND timestamp > 'epoch'
+        GROUP BY timestamp::date, user_id
+        ON CONFLICT (day, user_id) DO UPDATE
+        SET wins = EXCLUDED.wins,
+            losses = EXCLUDED.losses,
+            draws = EXCLUDED.draws;
+    """),
+    (6, "user_search", """
+        -- 后台搜索：手机号前缀、用户名前缀（输入不足 3 个字符时用）
+        CREATE INDEX IF NOT EXISTS users_phone_prefix_idx ON users (phone text_pattern_ops) WHERE phone IS NOT NULL;
+        CREATE INDEX IF NOT EXISTS users_username_prefix_idx ON users (lower(username) text_pattern_ops);
+
+        -- 用户名 / 手机号任意位置匹配（ILIKE '%kw%'）走 pg_trgm 的 GIN 索引；
+        -- 没有这个扩展或没有权限时跳过，查询结果不变，只是回到全表扫描
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+                CREATE EXTENSION IF NOT EXISTS pg_trgm;
+                CREATE INDEX IF NOT EXISTS users_username_trgm_idx ON users USING gin (username gin_trgm_ops);
+                CREATE INDEX IF NOT EXISTS users_phone_trgm_idx ON users USING gin (phone gin_trgm_ops);
+            ELSE
+                RAISE NOTICE 'pg_trgm 不可用，跳过三元组索引';
+            END IF;
+        EXCEPTION WHEN insufficient_privilege THEN
+            RAISE NOTICE '没有权限创建 pg_trgm，跳过三元组索引';
+        END $$;
+    """),
+    (7, "referral_graph", """
+        -- 邀请关系的闭包表：每个用户到他所有上级各一行，depth = 1 是直接邀请人（referrals.py 维护）
+        CREATE TABLE IF NOT EXISTS referral_paths (
+            ancestor_id BIGINT NOT NULL,
+            descendant_id BIGINT NOT NULL,
+            depth INTEGER NOT NULL,
+            PRIMARY KEY (ancestor_id, descendant_id)
+        );
+        -- 下线分页按 (depth, descendant_id) 取
+        CREATE INDEX IF NOT EXISTS referral_paths_downline_idx ON referral_paths (ancestor_id, depth, descendant_id);
+        CREATE INDEX IF NOT EXISTS referral_paths_descendant_idx ON referral_paths (descendant_id);
+
+        -- 每个邀请人的直接 / 全部下线人数
+        CREATE TABLE IF NOT EXISTS referral_counts (
+            user_id BIGINT PRIMARY KEY,
+            direct_count INTEGER NOT NULL DEFAULT 0,
+            total_count INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS referral_counts_direct_idx ON referral_counts (direct_count DESC, user_id);
+        CREATE INDEX IF NOT EXISTS referral_counts_total_idx ON referral_counts (total_count DESC, user_id);
+
+        -- 旧数据里的邀请环（A 邀请 B、B 又邀请 A）先断开：自己邀请自己的清空；
+        -- 更长的环里 invited_by > user_id 的边清空（每个环至少有一条这样的边）
+        UPDATE users SET invited_by = NULL WHERE invited_by = user_id;
+        WITH RECURSIVE up (start_id, ancestor_id, path) AS (
+            SELECT user_id, invited_by, ARRAY[user_id] FROM users WHERE invited_by IS NOT NULL
+            UNION ALL
+            SELECT up.start_id, u.invited_by, up.path || up.ancestor_id
+            FROM up JOIN users u ON u.user_id = up.ancestor_id
+            WHERE u.invited_by IS NOT NULL AND NOT up.ancestor_id = ANY(up.path)
+        )
+        UPDATE users SET invited_by = NULL
+        WHERE user_id IN (SELECT start_id FROM up WHERE ancestor_id = start_id)
+          AND invited_by > user_id;
+
+        INSERT INTO referral_paths (ancestor_id, descendant_id, depth)
+        WITH RECURSIVE up (descendant_id, ancestor_id, depth) AS (
+            SELECT user_id, invited_by, 1 FROM users WHERE invited_by IS NOT NULL
+            UNION ALL
+            SELECT up.descendant_id, u.invited_by, up.depth + 1
+            FROM up JOIN users u ON u.user_id = up.ancestor_id
+            WHERE u.invited_by IS NOT NULL
+        )
+        SELECT ancestor_id, descendant_id, depth FROM up
+        ON CONFLICT DO NOTHING;
+
+        INSERT INTO referral_counts (user_id, direct_count, total_count)
+        SELECT ancestor_id, COUNT(*) FILTER (WHERE depth = 1), COUNT(*)
+        FROM referral_paths
+        GROUP BY ancestor_id;
+    """),
+    (8, "daily_nonce", """
+        -- 可验证公平模式每天每个用户的 nonce 计数（game.py），只增不减；
+        -- 以前用 users.plays 当 nonce，后台重置次数后会重复，已有的行从当天累计局数接着往上加
+        ALTER TABLE user_daily_stats ADD COLUMN IF NOT EXISTS nonce INTEGER NOT NULL DEFAULT 0;
+        UPDATE user_daily_stats SET nonce = plays WHERE nonce < plays;
+    """),
+]
+
+
+def ensure_version_table(c):
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def applied_versions(c):
+    c.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in c.fetchall()}
+
+
+def run_migrations():
+    """按版本顺序执行未应用的迁移，每个迁移一个事务。返回本次应用的 [(version, name)]"""
+    applied = []
+    with get_conn() as conn, conn.cursor() as c:
+        ensure_version_table(c)
+
+    for version, name, sql in MIGRATIONS:
+        with get_conn() as conn, conn.cursor() as c:
+            c.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+            if version in applied_versions(c):
+                continue
+            del conn.notices[:]
+            c.execute(sql)
+            c.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+            # 迁移里修正数据时 RAISE WARNING 记录改了什么；IF NOT EXISTS 之类的 NOTICE 只记 info
+            for notice in conn.notices:
+                level = logging.WARNING if notice.startswith("WARNING") else logging.INFO
+                logger.log(level, "迁移 %04d_%s：%s", version, name, notice.strip())
+        applied.append((version, name))
+    return applied
+
+
+def migration_status():
+    with get_conn() as conn, conn.cursor() as c:
+        ensure_version_table(c)
+        c.execute("SELECT version, name, applied_at FROM schema_migrations ORDER BY version")
+        return c.fetchall()
+
+
+def sample_params(c):
+    c.execute("SELECT user_id, COALESCE(phone, '') FROM users ORDER BY user_id LIMIT 1")
+    row = c.fetchone() or (0, "")
+    return {"user_id": row[0], "phone": row[1]}
+
+
+def route_queries():
+    return [
+        ("/login", queries.LOGIN_SQL),
+        ("/dice", queries.USER_QUOTA_SQL),
+        ("/dice/play", game.PLAY_ROUND_SQL),
+        ("/dice/play/batch", game.PLAY_BATCH_SQL),
+        ("/user/logs", queries.USER_LOGS_SQL),
+        ("/invitees", queries.REFERRAL_DOWNLINE_SQL),
+        ("leaderboard load (all)", queries.LEADERBOARD_LOAD_ALL_SQL),
+        ("leaderboard load (daily)", queries.LEADERBOARD_LOAD_DAILY_SQL),
+        ("/admin/rank/today, bot /rank", queries.LEADERBOARD_USERS_SQL),
+        ("/admin/search", user_search.build_search_sql(user_id=True, phone=True, substring=True)),
+    ]
+
+
+def explain(analyze=False):
+    """
+    打印每条路由 SQL 的执行计划。--analyze 会真正执行语句，
+    写操作（/dice/play）在 ANALYZE 时会在事务结束后回滚。
+    """
+    from datetime import date
+
+    with get_conn() as conn, conn.cursor() as c:
+        params = sample_params(c)
+        params.update({
+            "today": date.today(),
+            "day": date.today(),
+            "user_ids": [params["user_id"]],
+            "limit": game.DAILY_PLAY_LIMIT,
+            "delta": 0,
+            "user_roll": 1,
+            "bot_roll": 1,
+            "result": "平局",
+            "count": 1,
+            "wins": 0,
+            "losses": 0,
+            "draws": 1,
+            "user_rolls": [1],
+            "bot_rolls": [1],
+            "results": ["平局"],
+            "max_depth": 1,
+            "after_depth": 0,
+            "after_id": 0,
+            "search_id": params["user_id"],
+            "search_phone": "1%",
+            "search_prefix": "a%",
+            "search_pattern": "%123%",
+        })
+        prefix = "EXPLAIN (ANALYZE, BUFFERS) " if analyze else "EXPLAIN "
+        for route, sql in route_queries():
+            c.execute(prefix + sql, params)
+            print(f"=== {route} ===")
+            for (line,) in c.fetchall():
+                print(line)
+            print()
+        conn.rollback()
+
+
+def main(argv):
+    command = argv[1] if len(argv) > 1 else "migrate"
+    if command == "migrate":
+        applied = run_migrations()
+        if applied:
+            for version, name in applied:
+                print(f"✅ 已应用迁移 {version:04d}_{name}")
+        else:
+            print("数据库结构已是最新")
+    elif command == "status":
+        for version, name, applied_at in migration_status():
+            print(f"{version:04d}_{name}\t{applied_at}")
+    elif command == "explain":
+        explain(analyze="--analyze" in argv)
+    else:
+        print(__doc__)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
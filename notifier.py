@@ -0,0 +1,271 @@
+"""
+Telegram 消息异步发送。
+
+请求线程只负责入队，后台线程复用 keep-alive 连接发送：
+- 全局令牌桶限速（Telegram 对单个 bot 约 30 条/秒）和单聊天最小间隔
+- 网络错误 / 5xx 指数退避重试；429 按返回的 retry_after 暂停后重试
+- 需要稍后再发的消息放进按到期时间排序的堆，由一个调度线程到期后放回队列
+- stats() 提供发送计数、重试、限流、队列长度等指标
+
+TELEGRAM_API_BASE 可指向本地的假 Bot API 服务做联调。
+"""
+import os
+import time
+import heapq
+import queue
+import random
+import atexit
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """阻塞直到拿到一个令牌"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class TelegramNotifier:
+    def __init__(self, token, api_base="https://api.telegram.org", workers=2, max_queue=10000,
+                 global_rate=25.0, per_chat_interval=1.0, max_retries=5, timeout=10.0):
+        self.url = f"{api_base.rstrip('/')}/bot{token}/sendMessage"
+        self.workers = workers
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._bucket = TokenBucket(global_rate)
+        self._chat_next = {}  # chat_id -> 下一次允许发送的时间
+        self._chat_lock = threading.Lock()
+        self._pause_until = 0.0  # 收到 429 后全局暂停
+        self.max_delayed = max_queue
+        self._delayed = []  # (到期时间, 序号, job) 小根堆
+        self._delayed_seq = 0
+        self._delayed_cond = threading.Condition()
+        self._threads = []
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._session = None
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0,
+            "sent": 0,
+            "failed": 0,
+            "retried": 0,
+            "rate_limited": 0,
+            "dropped": 0,
+            "send_time_total": 0.0,
+        }
+
+    # --- 生命周期 ---
+    def _new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers, max_retries=0)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def start(self):
+        # fork 之后线程和连接都不能沿用，按 pid 重新创建
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._session = self._new_session()
+            self._stopping.clear()
+            with self._delayed_cond:
+                self._delayed = []
+            self._threads = []
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name=f"tg-notifier-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            t = threading.Thread(target=self._run_delayed, name="tg-notifier-delay", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def close(self, timeout=5.0):
+        """等待队列发完（最多 timeout 秒）后停止"""
+        if self._pid != os.getpid():
+            return
+        deadline = time.monotonic() + timeout
+        while not self._queue.empty() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self._stopping.set()
+        with self._delayed_cond:
+            self._delayed_cond.notify_all()
+        for t in self._threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+
+    # --- 入队 ---
+    def send_message(self, chat_id, text, **params):
+        """入队一条消息，立即返回；队列满时丢弃并返回 False"""
+        self.start()
+        payload = {"chat_id": chat_id, "text": text, **params}
+        try:
+            self._queue.put_nowait({"payload": payload, "attempt": 0})
+        except queue.Full:
+            self._incr("dropped")
+            logger.warning("Telegram 发送队列已满，丢弃发给 %s 的消息", chat_id)
+            return False
+        self._incr("enqueued")
+        return True
+
+    def _schedule(self, job, delay):
+        """delay 秒后把 job 放回队列；等待中的消息太多时丢弃"""
+        with self._delayed_cond:
+            if len(self._delayed) >= self.max_delayed:
+                self._incr("dropped")
+                return
+            self._delayed_seq += 1
+            heapq.heappush(self._delayed, (time.monotonic() + delay, self._delayed_seq, job))
+            # 只有新的 job 排到最前面时才需要叫醒调度线程重新计算等待时间
+            if self._delayed[0][2] is job:
+                self._delayed_cond.notify()
+
+    def _run_delayed(self):
+        while not self._stopping.is_set():
+            with self._delayed_cond:
+                now = time.monotonic()
+                due = []
+                while self._delayed and self._delayed[0][0] <= now:
+                    due.append(heapq.heappop(self._delayed)[2])
+                if not due:
+                    timeout = self._delayed[0][0] - now if self._delayed else None
+                    self._delayed_cond.wait(timeout)
+                    continue
+            for job in due:
+                self._requeue(job)
+
+    def _requeue(self, job):
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self._incr("dropped")
+
+    # --- 发送 ---
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                job = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            chat_id = job["payload"]["chat_id"]
+            now = time.monotonic()
+            with self._chat_lock:
+                next_at = self._chat_next.get(chat_id, 0.0)
+                if next_at > now:
+                    wait = next_at - now
+                else:
+                    wait = 0.0
+                    self._chat_next[chat_id] = now + self.per_chat_interval
+                    if len(self._chat_next) > 10000:
+                        self._chat_next = {k: v for k, v in self._chat_next.items() if v > now}
+            if wait:
+                # 同一聊天发太快，稍后再发，不占住工作线程
+                self._schedule(job, wait)
+                continue
+
+            pause = self._pause_until - time.monotonic()
+            if pause > 0:
+                time.sleep(pause)
+            self._bucket.acquire()
+            self._send(job)
+
+    def _send(self, job):
+        start = time.monotonic()
+        retry_after = None
+        try:
+            resp = self._session.post(self.url, json=job["payload"], timeout=self.timeout)
+        except requests.RequestException as e:
+            error = str(e)
+        else:
+            if resp.status_code == 200:
+                self._incr("sent")
+                self._incr("send_time_total", time.monotonic() - start)
+                return
+            error = f"HTTP {resp.status_code}: {resp.text[:200]}"
+            if resp.status_code == 429:
+                self._incr("rate_limited")
+                try:
+                    retry_after = float(resp.json().get("parameters", {}).get("retry_after", 1))
+                except ValueError:
+                    retry_after = 1.0
+                self._pause_until = max(self._pause_until, time.monotonic() + retry_after)
+            elif resp.status_code < 500:
+                # 400/403 等（例如用户屏蔽了 bot）重试也没用
+                self._incr("failed")
+                logger.warning("发送 Telegram 消息失败: %s", error)
+                return
+
+        job["attempt"] += 1
+        if job["attempt"] > self.max_retries:
+            self._incr("failed")
+            logger.warning("发送 Telegram 消息失败，已放弃: %s", error)
+            return
+        self._incr("retried")
+        delay = retry_after if retry_after is not None else min(60.0, 2 ** job["attempt"]) * (0.5 + random.random() / 2)
+        self._schedule(job, delay)
+
+    # --- 指标 ---
+    def _incr(self, key, value=1):
+        with self._stats_lock:
+            self._stats[key] += value
+
+    def stats(self):
+        with self._stats_lock:
+            data = dict(self._stats)
+        data["queue_size"] = self._queue.qsize()
+        data["delayed_size"] = len(self._delayed)
+        data["send_time_avg"] = data["send_time_total"] / data["sent"] if data["sent"] else 0.0
+        return data
+
+
+_notifier = None
+_notifier_lock = threading.Lock()
+
+
+def get_notifier():
+    global _notifier
+    if _notifier is None:
+        with _notifier_lock:
+            if _notifier is None:
+                _notifier = TelegramNotifier(
+                    config.BOT_TOKEN,
+                    api_base=config.TELEGRAM_API_BASE,
+                    workers=config.NOTIFY_WORKERS,
+                    max_queue=config.NOTIFY_QUEUE_SIZE,
+                    global_rate=config.NOTIFY_GLOBAL_RATE,
+                    per_chat_interval=config.NOTIFY_PER_CHAT_INTERVAL,
+                    max_retries=config.NOTIFY_MAX_RETRIES,
+                    timeout=config.NOTIFY_TIMEOUT,
+                )
+                atexit.register(_notifier.close)
+    return _notifier
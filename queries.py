@@ -0,0 +1,289 @@
+# 各路由使用的 SQL，集中放在这里，方便 `python migrations.py explain` 逐条查看执行计划
+
+LOGIN_SQL = "SELECT user_id FROM users WHERE phone = %(phone)s"
+
+USER_QUOTA_SQL = "SELECT plays, daily_reset FROM users WHERE user_id = %(user_id)s"
+
+# 走 (user_id, timestamp DESC) 索引，直接取最近 100 条
+USER_LOGS_SQL = """
+    SELECT user_roll, bot_roll, result, timestamp
+    FROM game_logs
+    WHERE user_id = %(user_id)s
+    ORDER BY timestamp DESC
+    LIMIT 100
+"""
+
+# 邀请关系（referrals.py）：下线、人数都从闭包表 referral_paths / referral_counts 按 key 读取
+REFERRAL_COUNTS_SQL = """
+    SELECT COALESCE(direct_count, 0), COALESCE(total_count, 0)
+    FROM (SELECT 1) one
+    LEFT JOIN referral_counts ON user_id = %(user_id)s
+"""
+
+# keyset 分页：按 (depth, user_id) 取 after 之后的一页；max_depth 为 NULL 表示不限层级
+REFERRAL_DOWNLINE_SQL = """
+    SELECT p.descendant_id AS user_id, p.depth, u.username, u.phone, u.points,
+           COALESCE(rc.direct_count, 0) AS direct_count
+    FROM referral_paths p
+    LEFT JOIN users u ON u.user_id = p.descendant_id
+    LEFT JOIN referral_counts rc ON rc.user_id = p.descendant_id
+    WHERE p.ancestor_id = %(user_id)s
+      AND (%(max_depth)s::int IS NULL OR p.depth <= %(max_depth)s)
+      AND (p.depth, p.descendant_id) > (%(after_depth)s, %(after_id)s)
+    ORDER BY p.depth, p.descendant_id
+    LIMIT %(limit)s
+"""
+
+REFERRAL_TOP_SQL = """
+    SELECT rc.user_id, u.username, rc.direct_count, rc.total_count
+    FROM referral_counts rc
+    LEFT JOIN users u ON u.user_id = rc.user_id
+    WHERE rc.{column} > 0
+    ORDER BY rc.{column} DESC, rc.user_id
+    LIMIT %(limit)s
+"""
+
+# 新的邀请关系：inviter 及其所有上级 × user 及其所有下线，各加一条路径
+REFERRAL_LINK_SQL = """
+    WITH ancestors AS (
+        SELECT ancestor_id, depth FROM referral_paths WHERE descendant_id = %(inviter_id)s
+        UNION ALL SELECT %(inviter_id)s, 0
+    ), subtree AS (
+        SELECT descendant_id, depth FROM referral_paths WHERE ancestor_id = %(user_id)s
+        UNION ALL SELECT %(user_id)s, 0
+    ), inserted AS (
+        INSERT INTO referral_paths (ancestor_id, descendant_id, depth)
+        SELECT a.ancestor_id, s.descendant_id, a.depth + s.depth + 1
+        FROM ancestors a CROSS JOIN subtree s
+        RETURNING ancestor_id, depth
+    )
+    INSERT INTO referral_counts AS rc (user_id, direct_count, total_count)
+    SELECT ancestor_id, COUNT(*) FILTER (WHERE depth = 1), COUNT(*)
+    FROM inserted
+    GROUP BY ancestor_id
+    ON CONFLICT (user_id) DO UPDATE
+    SET direct_count = rc.direct_count + EXCLUDED.direct_count,
+        total_count = rc.total_count + EXCLUDED.total_count
+"""
+
+# 删除用户：从所有上级的人数里减掉，自己的人数行删除；他的下线与更上级之间的路径保留
+REFERRAL_REMOVE_SQL = """
+    WITH removed AS (
+        DELETE FROM referral_paths
+        WHERE descendant_id = ANY(%(user_ids)s::bigint[])
+        RETURNING ancestor_id, depth
+    ), own_paths AS (
+        DELETE FROM referral_paths WHERE ancestor_id = ANY(%(user_ids)s::bigint[])
+    ), own_counts AS (
+        DELETE FROM referral_counts WHERE user_id = ANY(%(user_ids)s::bigint[])
+    )
+    UPDATE referral_counts rc
+    SET direct_count = rc.direct_count - r.direct_count,
+        total_count = rc.total_count - r.total_count
+    FROM (
+        SELECT ancestor_id, COUNT(*) FILTER (WHERE depth = 1) AS direct_count, COUNT(*) AS total_count
+        FROM removed
+        WHERE NOT ancestor_id = ANY(%(user_ids)s::bigint[])
+        GROUP BY ancestor_id
+    ) r
+    WHERE rc.user_id = r.ancestor_id
+"""
+
+# 排行榜（leaderboard.py）从这里加载初始数据，之后由 play_dice 增量维护
+LEADERBOARD_LOAD_ALL_SQL = "SELECT user_id, COALESCE(points, 0) FROM users"
+
+LEADERBOARD_LOAD_DAILY_SQL = "SELECT user_id, points FROM user_daily_stats WHERE day = %(day)s"
+
+# 只按主键取榜上几名用户的资料
+LEADERBOARD_USERS_SQL = """
+    SELECT u.user_id, u.username, u.points,
+           COALESCE(d.plays, 0) AS plays_today,
+           COALESCE(d.points, 0) AS points_today,
+           COALESCE(d.wins, 0) AS wins_today,
+           COALESCE(d.losses, 0) AS losses_today,
+           COALESCE(d.draws, 0) AS draws_today
+    FROM users u
+    LEFT JOIN user_daily_stats d ON d.user_id = u.user_id AND d.day = %(day)s
+    WHERE u.user_id = ANY(%(user_ids)s)
+"""
+
+# 今日排行（/admin/rank/today 和实时推送）：今天玩过的用户按总积分排序，与原来的口径一致；
+# 只扫当天的 user_daily_stats（按 day 走索引），不再聚合 game_logs
+TODAY_RANK_SQL = """
+    SELECT u.user_id, u.username, u.points,
+           d.plays AS plays_today,
+           d.points AS points_today,
+           d.wins AS wins_today,
+           d.losses AS losses_today,
+           d.draws AS draws_today
+    FROM user_daily_stats d
+    JOIN users u ON u.user_id = d.user_id
+    WHERE d.day = %(day)s AND d.plays > 0
+    ORDER BY COALESCE(u.points, 0) DESC, u.user_id
+    LIMIT %(limit)s
+"""
+
+LIVE_USERNAMES_SQL = """
+    SELECT user_id, username FROM users WHERE user_id = ANY(%(user_ids)s)
+"""
+
+
+def like_escape(value):
+    """LIKE / ILIKE 模式里的 %、_ 和 \\ 按字面匹配"""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def user_filter_clause(keyword="", blocked_filter="", start_date=None, end_date=None):
+    """后台用户列表的筛选条件，返回 (where_sql, params)，表别名固定为 u"""
+    clauses = []
+    params = {}
+
+    if keyword:
+        # 有 pg_trgm 索引时这两个 ILIKE 都走索引；纯数字再加上按 user_id 精确匹配
+        match = ["u.username ILIKE %(kw)s", "u.phone ILIKE %(kw)s"]
+        params["kw"] = f"%{like_escape(keyword)}%"
+        if keyword.isdigit() and int(keyword) < 2 ** 63:
+            match.append("u.user_id = %(kw_id)s")
+            params["kw_id"] = int(keyword)
+        clauses.append("(" + " OR ".join(match) + ")")
+
+    if blocked_filter == "1":
+        clauses.append("u.blocked = TRUE")
+    elif blocked_filter == "0":
+        clauses.append("(u.blocked = FALSE OR u.blocked IS NULL)")
+
+    if start_date:
+        clauses.append("u.created_at >= %(start_date)s")
+        params["start_date"] = start_date
+    if end_date:
+        clauses.append("u.created_at <= %(end_date)s")
+        params["end_date"] = end_date
+
+    return " AND ".join(clauses) or "TRUE", params
+
+
+# 后台即时搜索（user_search.py）：几路各自走索引、各取 limit 条，合并去重后按匹配程度排序
+SEARCH_BRANCHES = {
+    # 纯数字：user_id 精确匹配（主键）
+    "user_id": "SELECT 0, user_id FROM users WHERE user_id = %(search_id)s",
+    # 纯数字：手机号前缀（users_phone_prefix_idx）。
+    # ORDER BY ... USING ~<~ 与 text_pattern_ops 索引顺序一致，按索引顺序取到 limit 条就停，
+    # 输入只有一两位、匹配大半张表时也不用排序
+    "phone": """(
+        SELECT 1, user_id FROM users
+        WHERE phone LIKE %(search_phone)s
+        ORDER BY phone USING ~<~ LIMIT %(limit)s
+    )""",
+    # 用户名前缀（users_username_prefix_idx）
+    "prefix": """(
+        SELECT 2, user_id FROM users
+        WHERE lower(username) LIKE %(search_prefix)s
+        ORDER BY lower(username) USING ~<~ LIMIT %(limit)s
+    )""",
+    # 任意位置（pg_trgm 索引，至少 3 个字符才有三元组可用）
+    "substring": """(
+        SELECT 3, user_id FROM users
+        WHERE username ILIKE %(search_pattern)s OR phone LIKE %(search_pattern)s
+        LIMIT %(limit)s
+    )""",
+}
+
+SEARCH_USERS_SQL = """
+    WITH hits (rank, user_id) AS (
+        {branches}
+    ), best AS (
+        SELECT user_id, MIN(rank) AS rank FROM hits GROUP BY user_id
+    )
+    SELECT u.user_id, u.username, u.phone, u.points, u.blocked
+    FROM best
+    JOIN users u ON u.user_id = best.user_id
+    ORDER BY best.rank, u.user_id
+    LIMIT %(limit)s
+"""
+
+# 每日次数是惰性重置的：daily_reset 不是今天时 plays 视为 0，不需要批量 UPDATE
+ADMIN_USER_COLUMNS = """
+    u.user_id, u.username, u.phone, u.points,
+    CASE WHEN u.daily_reset = %(today)s THEN COALESCE(u.plays, 0) ELSE 0 END AS plays,
+    u.last_game_time,
+    u.created_at, u.invited_by, u.blocked,
+    inviter.username AS inviter,
+    COALESCE(rc.direct_count, 0) AS invited_count,
+    COALESCE(rc.total_count, 0) AS downline_count
+"""
+
+# 邀请人数直接读 referral_counts，不再计数
+ADMIN_USER_JOINS = """
+    FROM users u
+    LEFT JOIN users inviter ON u.invited_by = inviter.user_id
+    LEFT JOIN referral_counts rc ON rc.user_id = u.user_id
+"""
+
+# 统计和当前页在同一条语句里返回；按 user_id 做 keyset 分页。
+# 当前页为空时 LEFT JOIN 仍会返回一行统计数据（user_id 为 NULL）。
+ADMIN_PAGE_SQL = """
+    WITH stats AS (
+        SELECT COUNT(*) AS stat_total,
+               COUNT(NULLIF(u.phone, '')) AS stat_verified,
+               COUNT(*) FILTER (WHERE u.blocked) AS stat_blocked,
+               COALESCE(SUM(u.points), 0) AS stat_points
+        FROM users u
+        WHERE {where}
+    ), page AS (
+        SELECT """ + ADMIN_USER_COLUMNS + ADMIN_USER_JOINS + """
+        WHERE {where} {keyset}
+        ORDER BY u.user_id {direction}
+        LIMIT %(limit)s
+    )
+    SELECT stats.*, page.*
+    FROM stats LEFT JOIN page ON TRUE
+    ORDER BY page.user_id
+"""
+
+ADMIN_EXPORT_SQL = "SELECT " + ADMIN_USER_COLUMNS + ADMIN_USER_JOINS + """
+    WHERE {where}
+    ORDER BY u.user_id
+"""
+
+# 后台批量操作（admin_bulk.py）：每种操作一条语句，参数是等长的数组
+BULK_SET_BLOCKED_SQL = """
+    UPDATE users u
+    SET blocked = v.blocked
+    FROM unnest(%(user_ids)s::bigint[], %(blocked)s::boolean[]) AS v(user_id, blocked)
+    WHERE u.user_id = v.user_id
+    RETURNING u.user_id
+"""
+
+BULK_SET_POINTS_SQL = """
+    UPDATE users u
+    SET points = v.points
+    FROM unnest(%(user_ids)s::bigint[], %(points)s::integer[]) AS v(user_id, points)
+    WHERE u.user_id = v.user_id
+    RETURNING u.user_id, u.points
+"""
+
+# 同一用户的多次调整先合并
+BULK_ADJUST_POINTS_SQL = """
+    UPDATE users u
+    SET points = COALESCE(u.points, 0) + v.delta
+    FROM (
+        SELECT user_id, SUM(delta)::integer AS delta
+        FROM unnest(%(user_ids)s::bigint[], %(deltas)s::integer[]) AS t(user_id, delta)
+        GROUP BY user_id
+    ) v
+    WHERE u.user_id = v.user_id
+    RETURNING u.user_id, u.points
+"""
+
+BULK_RESET_PLAYS_SQL = """
+    UPDATE users
+    SET plays = 0, daily_reset = %(today)s
+    WHERE user_id = ANY(%(user_ids)s::bigint[])
+    RETURNING user_id
+"""
+
+BULK_DELETE_SQL = """
+    DELETE FROM users
+    WHERE user_id = ANY(%(user_ids)s::bigint[])
+    RETURNING user_id, phone
+"""
@@ -0,0 +1,195 @@
+"""
+/dice/play 和 /login 的限流，在访问数据库之前执行，超限返回 429 + Retry-After。
+
+令牌桶：每个 key 以 rate 个/秒的速度补充令牌，最多攒 burst 个，每次请求消耗一个。
+key 按用户（session 里的 user_id）、会话（签名 cookie 里随机生成的会话 id）和 IP 分别计算，见 RULES。
+会话桶比 IP 桶小：共用一个出口 IP 的多个人里，某一个刷得太快时先被自己的会话桶拦住，不会把整个 IP 的额度用光；
+清掉 cookie 换新会话的客户端仍然受 IP 桶限制。
+一个请求涉及的所有桶都有令牌时才一起扣，任何一个不够就都不扣，被拒绝的请求不会消耗其他桶的额度。
+后端与 leaderboard / cache 相同：配置 REDIS_URL 时多个 worker 共用（Lua 脚本保证原子），
+否则每个进程各自计数（条数上限 RATE_LIMIT_MAX_KEYS，最久未用的先淘汰）。
+"""
+import math
+import time
+import secrets
+import logging
+import functools
+import threading
+from collections import OrderedDict
+
+from flask import request, session, jsonify
+
+from config import config
+import metrics
+
+try:
+    import redis
+except ImportError:  # 可选依赖
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMITED = metrics.Counter("rate_limited_total", "被限流拒绝的请求数", ("scope", "key"))
+
+# scope -> [(key 类型, 每秒补充的令牌数, 桶容量)]
+RULES = {
+    "play": [
+        ("user", config.RATE_LIMIT_PLAY_USER_RATE, config.RATE_LIMIT_PLAY_USER_BURST),
+        ("session", config.RATE_LIMIT_PLAY_SESSION_RATE, config.RATE_LIMIT_PLAY_SESSION_BURST),
+        ("ip", config.RATE_LIMIT_PLAY_IP_RATE, config.RATE_LIMIT_PLAY_IP_BURST),
+    ],
+    "login": [
+        ("session", config.RATE_LIMIT_LOGIN_SESSION_RATE, config.RATE_LIMIT_LOGIN_SESSION_BURST),
+        ("ip", config.RATE_LIMIT_LOGIN_IP_RATE, config.RATE_LIMIT_LOGIN_IP_BURST),
+    ],
+}
+
+
+class LocalLimiter:
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (令牌数, 上次更新时间)
+        self._lock = threading.Lock()
+
+    def hit(self, buckets):
+        """
+        buckets 为 [(key, rate, burst)]，全部有令牌时各扣一个。
+        返回每个桶需要等待的秒数（0 表示这个桶有令牌），全为 0 才算放行。
+        """
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            for key, rate, burst in buckets:
+                tokens, updated = self._buckets.pop(key, (burst, now))
+                levels.append(min(burst, tokens + (now - updated) * rate))
+            waits = [0.0 if tokens >= 1 else (1 - tokens) / rate
+                     for tokens, (_, rate, _) in zip(levels, buckets)]
+            allowed = not any(waits)
+            for tokens, (key, _, _) in zip(levels, buckets):
+                self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return waits
+
+
+class RedisLimiter:
+    # ARGV: now, rate1, burst1, rate2, burst2, ...（与 KEYS 一一对应）
+    SCRIPT = """
+        local now = tonumber(ARGV[1])
+        local levels = {}
+        local waits = {}
+        local allowed = true
+        for i = 1, #KEYS do
+            local rate = tonumber(ARGV[i * 2])
+            local burst = tonumber(ARGV[i * 2 + 1])
+            local data = redis.call('HMGET', KEYS[i], 't', 'ts')
+            local tokens = tonumber(data[1]) or burst
+            local ts = tonumber(data[2]) or now
+            tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+            levels[i] = tokens
+            if tokens >= 1 then
+                waits[i] = '0'
+            else
+                waits[i] = tostring((1 - tokens) / rate)
+                allowed = false
+            end
+        end
+        for i = 1, #KEYS do
+            local rate = tonumber(ARGV[i * 2])
+            local burst = tonumber(ARGV[i * 2 + 1])
+            local tokens = levels[i]
+            if allowed then
+                tokens = tokens - 1
+            end
+            redis.call('HSET', KEYS[i], 't', tostring(tokens), 'ts', tostring(now))
+            redis.call('EXPIRE', KEYS[i], math.ceil(burst / rate) + 1)
+        end
+        return waits
+    """
+
+    def __init__(self, url, prefix):
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._script = self.client.register_script(self.SCRIPT)
+
+    def hit(self, buckets):
+        args = [time.time()]
+        for _, rate, burst in buckets:
+            args += [rate, burst]
+        waits = self._script(keys=[self.prefix + key for key, _, _ in buckets], args=args)
+        return [float(wait) for wait in waits]
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                if config.REDIS_URL and redis is not None:
+                    _limiter = RedisLimiter(config.REDIS_URL, config.CACHE_KEY_PREFIX + "rl:")
+                else:
+                    _limiter = LocalLimiter(config.RATE_LIMIT_MAX_KEYS)
+    return _limiter
+
+
+def session_id():
+    """当前会话的限流 id；session 是签名 cookie，客户端改不了，只能整个丢掉换新的"""
+    if "rl_sid" not in session:
+        session["rl_sid"] = secrets.token_hex(16)
+    return session["rl_sid"]
+
+
+def _key_value(kind):
+    if kind == "user":
+        return session.get("user_id")
+    if kind == "session":
+        return session_id()
+    if kind == "ip":
+        return request.remote_addr
+    raise ValueError(kind)
+
+
+def check(scope):
+    """按 scope 的所有规则检查，都有令牌时各消耗一个；返回需要等待的秒数（0 表示放行）"""
+    kinds, buckets = [], []
+    for kind, rate, burst in RULES[scope]:
+        value = _key_value(kind)
+        if value is None or rate <= 0:
+            continue
+        kinds.append(kind)
+        buckets.append((f"{scope}:{kind}:{value}", rate, burst))
+    if not buckets:
+        return 0.0
+    try:
+        waits = get_limiter().hit(buckets)
+    except Exception:
+        # 限流后端不可用时放行，不影响正常请求
+        logger.exception("限流检查失败")
+        return 0.0
+    for kind, wait in zip(kinds, waits):
+        if wait > 0:
+            RATE_LIMITED.inc(scope, kind)
+    return max(waits)
+
+
+def limit(scope, json=True):
+    """路由装饰器；json=False 时返回纯文本（表单提交的页面）"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if config.RATE_LIMIT_ENABLED:
+                wait = check(scope)
+                if wait > 0:
+                    retry_after = max(1, math.ceil(wait))
+                    message = f"请求过于频繁，请 {retry_after} 秒后再试"
+                    headers = {"Retry-After": str(retry_after)}
+                    if json:
+                        return jsonify({"error": message}), 429, headers
+                    return message, 429, headers
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
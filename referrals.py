@@ -0,0 +1,111 @@
+"""
+邀请关系。users.invited_by 只记录直接邀请人，多级关系和人数另外维护（迁移 7）：
+
+- referral_paths：闭包表，每个用户到他的每一级上级各一行（depth = 1 为直接邀请人）
+- referral_counts：每个邀请人的直接 / 全部下线人数
+
+设置 invited_by 的地方（/bind/telegram、/auth、bot /start）都调用 link()，在同一个事务里
+更新 invited_by、闭包表和人数，查询时只按 key 读取，不再对 users 做聚合。
+link() 会拒绝自己邀请自己和形成环的关系（被邀请人已经是邀请人的上级）。
+"""
+from db import get_conn
+import queries
+
+# 所有修改邀请关系的事务串行执行，两个方向相反的邀请同时提交时也不会形成环
+REFERRAL_LOCK_ID = 72019002
+
+MAX_PAGE_SIZE = 100
+
+
+def parse_inviter(value):
+    """邀请链接里带来的 inviter 参数，不是合法的 user_id 时返回 None"""
+    try:
+        inviter_id = int(value)
+    except (TypeError, ValueError):
+        return None
+    return inviter_id if 0 < inviter_id < 2 ** 63 else None
+
+
+def link(c, user_id, inviter_id):
+    """
+    在调用方的事务里把 user_id 的邀请人设为 inviter_id，返回是否设置成功。
+    用户不存在、已经有邀请人、自己邀请自己或会形成环时不做修改。
+    """
+    inviter_id = parse_inviter(inviter_id)
+    if inviter_id is None or inviter_id == int(user_id):
+        return False
+
+    c.execute("SELECT pg_advisory_xact_lock(%s)", (REFERRAL_LOCK_ID,))
+    c.execute("SELECT invited_by FROM users WHERE user_id = %s FOR UPDATE", (user_id,))
+    row = c.fetchone()
+    if row is None or row[0] is not None:
+        return False
+    # 邀请人是这个用户的下线时，再连上去就成环了
+    c.execute("SELECT 1 FROM referral_paths WHERE ancestor_id = %s AND descendant_id = %s",
+              (user_id, inviter_id))
+    if c.fetchone():
+        return False
+
+    c.execute("UPDATE users SET invited_by = %s WHERE user_id = %s", (inviter_id, user_id))
+    c.execute(queries.REFERRAL_LINK_SQL, {"user_id": user_id, "inviter_id": inviter_id})
+    return True
+
+
+def remove_users(c, user_ids):
+    """删除用户时在同一事务里调用，从上级的人数里减掉"""
+    if user_ids:
+        c.execute(queries.REFERRAL_REMOVE_SQL, {"user_ids": [int(user_id) for user_id in user_ids]})
+
+
+def get_counts(user_id):
+    """返回 {"direct": 直接邀请人数, "total": 全部下线人数}"""
+    with get_conn() as conn, conn.cursor() as c:
+        c.execute(queries.REFERRAL_COUNTS_SQL, {"user_id": user_id})
+        direct, total = c.fetchone()
+    return {"direct": direct, "total": total}
+
+
+def downline(user_id, max_depth=None, after=None, limit=50):
+    """
+    分页取下线，按层级、user_id 排序。after 为上一页返回的游标 (depth, user_id)。
+    返回 (rows, next_cursor)，没有下一页时 next_cursor 为 None。
+    """
+    limit = min(max(1, limit), MAX_PAGE_SIZE)
+    after_depth, after_id = after or (0, 0)
+    with get_conn() as conn, conn.cursor() as c:
+        c.execute(queries.REFERRAL_DOWNLINE_SQL, {
+            "user_id": user_id,
+            "max_depth": max_depth,
+            "after_depth": after_depth,
+            "after_id": after_id,
+            "limit": limit + 1,
+        })
+        columns = [desc[0] for desc in c.description]
+        rows = [dict(zip(columns, row)) for row in c.fetchall()]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = (rows[-1]["depth"], rows[-1]["user_id"])
+    return rows, next_cursor
+
+
+def top_inviters(by="direct", limit=10):
+    """邀请排行，by 为 direct（直接邀请）或 total（全部下线）"""
+    column = {"direct": "direct_count", "total": "total_count"}[by]
+    with get_conn() as conn, conn.cursor() as c:
+        c.execute(queries.REFERRAL_TOP_SQL.format(column=column), {"limit": min(max(1, limit), MAX_PAGE_SIZE)})
+        columns = [desc[0] for desc in c.description]
+        return [dict(zip(columns, row)) for row in c.fetchall()]
+
+
+def format_cursor(cursor):
+    return f"{cursor[0]}-{cursor[1]}" if cursor else None
+
+
+def parse_cursor(value):
+    """"2-12345" -> (2, 12345)，格式不对返回 None"""
+    try:
+        depth, user_id = value.split("-")
+        return int(depth), int(user_id)
+    except (AttributeError, ValueError):
+        return None
@@ -0,0 +1,116 @@
+const faceRotation = {
+  1: [0, 0],
+  2: [90, 0],
+  3: [0, -90],
+  4: [0, 90],
+  5: [-90, 0],
+  6: [0, 180]
+};
+
+const currentAngles = {
+  "user-dice": [0, 0],
+  "bot-dice": [0, 0]
+};
+
+function easeOutCubic(t) {
+  return 1 - Math.pow(1 - t, 3);
+}
+
+function animateDice(diceId, targetFace) {
+  const dice = document.getElementById(diceId);
+  const [targetX, targetY] = faceRotation[targetFace];
+  const [startX, startY] = currentAngles[diceId];
+
+  const offsetX = Math.random() * 100;
+  const offsetY = Math.random() * 100;
+  const jitterX = 10 + Math.random() * 10;
+  const jitterY = 10 + Math.random() * 10;
+
+  const extraRotate = 360 * (3 + Math.floor(Math.random() * 3));
+  const duration = 1500;
+  const startTime = performance.now();
+
+  function animate(time) {
+    const elapsed = time - startTime;
+    const t = Math.min(elapsed / duration, 1);
+    const eased = easeOutCubic(t);
+
+    const posX = offsetX + Math.sin(t * Math.PI * 3) * jitterX * (1 - t);
+    const posY = offsetY - 80 * t * (1 - t) + Math.sin(t * Math.PI * 5) * jitterY * (1 - t);
+
+    const currentX = startX + (targetX + extraRotate - startX) * eased;
+    const currentY = startY + (targetY + extraRotate - startY) * eased;
+
+    dice.style.transform = `translate(${posX}px, ${posY}px) rotateX(${currentX}deg) rotateY(${currentY}deg)`;
+
+    if (t < 1) {
+      requestAnimationFrame(animate);
+    } else {
+      currentAngles[diceId] = [targetX, targetY];
+    }
+  }
+
+  requestAnimationFrame(animate);
+}
+
+function setButtonsDisabled(disabled) {
+  document.querySelectorAll("button.btn").forEach(btn => { btn.disabled = disabled; });
+}
+
+function showRound(round) {
+  animateDice("user-dice", round.user);
+  animateDice("bot-dice", round.bot);
+  document.getElementById("user-score").textContent = round.user;
+  document.getElementById("bot-score").textContent = round.bot;
+  document.getElementById("result").textContent = round.message;
+}
+
+async function post(url, body) {
+  const res = await fetch(url, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify(body || {})
+  });
+
+  if (res.status === 403) {
+    document.getElementById("result").textContent = "❌ 今日次数已用完";
+    setButtonsDisabled(true);
+    return null;
+  }
+
+  const data = await res.json();
+  if (!res.ok) {
+    document.getElementById("result").textContent = "❌ " + (data.error || "请求失败");
+    return null;
+  }
+  return data;
+}
+
+function finish(data) {
+  document.getElementById("remaining").textContent = data.remaining;
+  setButtonsDisabled(data.remaining <= 0);
+}
+
+async function roll() {
+  const data = await post("/dice/play");
+  if (!data) return;
+  showRound(data);
+  finish(data);
+}
+
+// 一次请求投完剩余次数，结果依次播放
+async function rollAll() {
+  setButtonsDisabled(true);
+  const data = await post("/dice/play/batch");
+  if (!data) {
+    setButtonsDisabled(false);
+    return;
+  }
+  for (let i = 0; i < data.rounds.length; i++) {
+    showRound(data.rounds[i]);
+    document.getElementById("remaining").textContent = data.remaining + data.rounds.length - i - 1;
+    await new Promise(resolve => setTimeout(resolve, 1700));
+  }
+  document.getElementById("result").textContent += `（本轮合计 ${data.delta >= 0 ? "+" : ""}${data.delta} 分）`;
+  finish(data);
+}
@@ -0,0 +1,163 @@
+"""
+Telegram 登录数据校验：Login Widget（/bind/telegram）和 Mini App 的 initData（/auth/webapp）。
+
+- 两种签名用的密钥只依赖 BOT_TOKEN，启动时算一次
+- 签名用 hmac.compare_digest 比较
+- auth_date 超过 AUTH_MAX_AGE 秒的数据拒绝
+- 重放检查：verify_* 校验通过时用 add（NX）把 hash 原子地占住（AUTH_MAX_AGE 内有效），
+  两个会话同时提交同一份数据只有一个能通过。占用时带上 owner（调用方传入的浏览器会话标识），
+  同一会话再次提交同一份数据（Mini App 里刷新页面，initData 不变）照常通过，其他会话提交视为重放。
+  手机号缺失、已被占用这类可以改正的失败，调用方调用返回值的 release() 释放占用，改正后可以重试；
+  配置 REDIS_URL 时多个进程共用，否则每个进程各自一份、条数上限 AUTH_REPLAY_CACHE_SIZE
+"""
+import hmac
+import json
+import time
+import hashlib
+import logging
+import threading
+from urllib.parse import parse_qsl
+
+from config import config
+from cache import LocalCache, RedisCache, MISSING, redis
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 允许客户端时钟比服务器快一点
+CLOCK_SKEW = 60
+
+AUTH_FAILURES = metrics.Counter("telegram_auth_failures_total", "Telegram 登录校验失败次数", ("kind", "reason"))
+
+
+class AuthError(Exception):
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+
+class Verified(dict):
+    """校验通过的字段；登录 / 绑定因为可以改正的原因失败时调用 release()"""
+
+    def __init__(self, fields, auth, replay_key):
+        super().__init__(fields)
+        self._auth = auth
+        self._replay_key = replay_key
+
+    def release(self):
+        """释放这次校验占住的 hash；同一会话之前已经占住的（例如已经登录成功）不释放"""
+        if self._replay_key is not None:
+            self._auth._release(self._replay_key)
+            self._replay_key = None
+
+
+class TelegramAuth:
+    def __init__(self, bot_token, max_age=86400, replay_cache=None):
+        token = (bot_token or "").encode()
+        # Login Widget：secret = SHA256(token)
+        self.login_secret = hashlib.sha256(token).digest()
+        # Mini App：secret = HMAC_SHA256(key="WebAppData", msg=token)
+        self.webapp_secret = hmac.new(b"WebAppData", token, hashlib.sha256).digest()
+        self.max_age = max_age
+        self.replay_cache = replay_cache
+
+    @staticmethod
+    def _check_string(fields):
+        return "\n".join(f"{k}={fields[k]}" for k in sorted(fields)).encode()
+
+    def _verify(self, kind, secret, fields, received_hash, now, owner):
+        """返回这次新占住的重放缓存 key，没有新占住时返回 None"""
+        expected = hmac.new(secret, self._check_string(fields), hashlib.sha256).hexdigest()
+        if not isinstance(received_hash, str) or not hmac.compare_digest(expected, received_hash.lower()):
+            raise AuthError("bad_hash", "签名不正确")
+
+        try:
+            auth_date = int(fields.get("auth_date", ""))
+        except ValueError:
+            raise AuthError("no_auth_date", "缺少 auth_date")
+        now = time.time() if now is None else now
+        if auth_date > now + CLOCK_SKEW:
+            raise AuthError("future", "auth_date 不正确")
+        if self.max_age and now - auth_date > self.max_age:
+            raise AuthError("expired", "登录数据已过期，请重新授权")
+
+        # 签名和时间都正确之后才占用缓存，伪造的请求不会占用
+        if self.replay_cache is None:
+            return None
+        replay_key = f"{config.CACHE_KEY_PREFIX}auth:{kind}:{expected}"
+        # 先检查再写入会让两个同时提交的会话都通过，必须用 add 一步占住；
+        # add 失败后读到空值说明占用刚好过期或被释放，再试一次
+        for _ in range(2):
+            try:
+                if self.replay_cache.add(replay_key, owner or 1, self.max_age or None):
+                    return replay_key
+                used_by = self.replay_cache.get(replay_key)
+            except Exception:
+                logger.exception("重放缓存不可用，跳过重放检查")
+                return None
+            if used_by is not MISSING:
+                break
+        if owner is None or used_by != owner:
+            raise AuthError("replay", "登录数据已使用过，请重新授权")
+        return None
+
+    def _release(self, replay_key):
+        try:
+            self.replay_cache.delete(replay_key)
+        except Exception:
+            logger.exception("重放缓存不可用，未能释放登录数据")
+
+    def verify_login(self, data, now=None, owner=None):
+        """
+        校验 Login Widget 回传的字段，返回去掉 hash 的字段（Verified）；失败抛 AuthError。
+        owner 为当前浏览器会话的标识，同一会话可以重复提交同一份数据。
+        """
+        if not isinstance(data, dict):
+            AUTH_FAILURES.inc("login", "malformed")
+            raise AuthError("malformed", "数据格式错误")
+        fields = {k: str(v) for k, v in data.items() if k != "hash"}
+        try:
+            replay_key = self._verify("login", self.login_secret, fields, data.get("hash"), now, owner)
+        except AuthError as e:
+            AUTH_FAILURES.inc("login", e.reason)
+            raise
+        return Verified({k: v for k, v in data.items() if k != "hash"}, self, replay_key)
+
+    def verify_webapp(self, init_data, now=None, owner=None):
+        """校验 Mini App 的 Telegram.WebApp.initData（原始查询串），返回字段（Verified），user 已解析为 dict"""
+        try:
+            pairs = parse_qsl(init_data or "", keep_blank_values=True, strict_parsing=True)
+        except ValueError:
+            AUTH_FAILURES.inc("webapp", "malformed")
+            raise AuthError("malformed", "数据格式错误")
+        fields = dict(pairs)
+        received_hash = fields.pop("hash", None)
+        try:
+            replay_key = self._verify("webapp", self.webapp_secret, fields, received_hash, now, owner)
+        except AuthError as e:
+            AUTH_FAILURES.inc("webapp", e.reason)
+            raise
+        if "user" in fields:
+            try:
+                fields["user"] = json.loads(fields["user"])
+            except ValueError:
+                AUTH_FAILURES.inc("webapp", "malformed")
+                raise AuthError("malformed", "user 字段格式错误")
+        return Verified(fields, self, replay_key)
+
+
+_auth = None
+_auth_lock = threading.Lock()
+
+
+def get_auth():
+    global _auth
+    if _auth is None:
+        with _auth_lock:
+            if _auth is None:
+                if config.REDIS_URL and redis is not None:
+                    replay_cache = RedisCache(config.REDIS_URL, config.AUTH_MAX_AGE)
+                else:
+                    replay_cache = LocalCache(config.AUTH_REPLAY_CACHE_SIZE, config.AUTH_MAX_AGE)
+                _auth = TelegramAuth(config.BOT_TOKEN, max_age=config.AUTH_MAX_AGE, replay_cache=replay_cache)
+    return _auth
@@ -0,0 +1,61 @@
+"""
+测试公共设置：
+
+    python -m pytest -q
+
+纯单元测试不需要数据库和 Redis。需要 PostgreSQL 的测试（邀请关系等）读取 TEST_DATABASE_URL，
+每次在该实例上新建一个临时库、执行全部迁移，结束后删除；没有配置时跳过。
+"""
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2  # noqa: E402
+from psycopg2.extensions import make_dsn, parse_dsn  # noqa: E402
+
+import db  # noqa: E402
+import migrations  # noqa: E402
+
+
+def _admin_execute(url, sql):
+    # CREATE / DROP DATABASE 不能在事务里执行
+    conn = psycopg2.connect(url)
+    try:
+        conn.autocommit = True
+        with conn.cursor() as c:
+            c.execute(sql)
+    finally:
+        conn.close()
+
+
+@pytest.fixture(scope="session")
+def database_url():
+    """临时数据库的连接串"""
+    url = os.getenv("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("未配置 TEST_DATABASE_URL")
+    name = f"dice_test_{uuid.uuid4().hex[:12]}"
+    _admin_execute(url, f'CREATE DATABASE "{name}"')
+    test_url = make_dsn(**{**parse_dsn(url), "dbname": name})
+    try:
+        yield test_url
+    finally:
+        _admin_execute(url, f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+
+
+@pytest.fixture(scope="session")
+def pool(database_url):
+    """执行全部迁移，并让 db.get_conn() 连到临时数据库"""
+    test_pool = db.ConnectionPool(database_url, minconn=0, maxconn=4)
+    saved = db._pool, db._pool_pid
+    db._pool, db._pool_pid = test_pool, os.getpid()
+    try:
+        migrations.run_migrations()
+        yield test_pool
+    finally:
+        db._pool, db._pool_pid = saved
+        test_pool.closeall()
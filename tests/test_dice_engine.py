@@ -0,0 +1,64 @@
+from datetime import date
+
+import dice_engine
+from dice_engine import FairEngine, bytes_to_faces, commitment_of, fair_roll, verify
+
+
+def test_bytes_to_faces_rejects_high_bytes():
+    assert bytes_to_faces(bytes([0, 5, 6, 251])) == bytes([1, 6, 1, 6])
+    assert bytes_to_faces(bytes(range(252, 256))) == b""
+
+
+def test_bytes_to_faces_is_uniform():
+    faces = bytes_to_faces(bytes(range(256)))
+    assert len(faces) == 252
+    assert all(faces.count(face) == 42 for face in range(1, 7))
+
+
+def test_fair_roll_is_deterministic():
+    rolls = [fair_roll("seed", nonce) for nonce in range(1, 200)]
+    assert rolls == [fair_roll("seed", nonce) for nonce in range(1, 200)]
+    assert all(1 <= user <= 6 and 1 <= bot <= 6 for user, bot in rolls)
+    # 不同 nonce / 种子给出不同序列
+    assert len(set(rolls)) > 1
+    assert rolls != [fair_roll("other", nonce) for nonce in range(1, 200)]
+
+
+def test_fair_roll_rehashes_when_digest_has_too_few_faces(monkeypatch):
+    calls = []
+    original = dice_engine.bytes_to_faces
+
+    def short_first(data):
+        calls.append(data)
+        return b"" if len(calls) == 1 else original(data)
+
+    monkeypatch.setattr(dice_engine, "bytes_to_faces", short_first)
+    user, bot = fair_roll("seed", 1)
+    assert len(calls) == 2
+    assert 1 <= user <= 6 and 1 <= bot <= 6
+
+
+def test_engine_roll_matches_published_seed():
+    engine = FairEngine("secret")
+    day = date(2024, 1, 2)
+    seed = engine.server_seed(42, day)
+    assert engine.commitment(42, day) == commitment_of(seed)
+    assert engine.server_seed(43, day) != seed
+    assert engine.server_seed(42, date(2024, 1, 3)) != seed
+    for nonce in range(1, 11):
+        assert engine.roll(42, day, nonce) == fair_roll(seed, nonce)
+
+
+def test_verify():
+    engine = FairEngine("secret")
+    day = date(2024, 1, 2)
+    seed = engine.server_seed(7, day)
+    commitment = engine.commitment(7, day)
+    user, bot = engine.roll(7, day, 3)
+
+    assert verify(seed, commitment, 3, user, bot)
+    # 点数不符、nonce 不符、种子与 commitment 不符
+    assert not verify(seed, commitment, 3, user % 6 + 1, bot)
+    other_nonce = next(n for n in range(4, 100) if fair_roll(seed, n) != (user, bot))
+    assert not verify(seed, commitment, other_nonce, user, bot)
+    assert not verify(engine.server_seed(8, day), commitment, 3, user, bot)
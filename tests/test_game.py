@@ -0,0 +1,185 @@
+"""一局 / 多局游戏的原子语句和每日上限，需要 TEST_DATABASE_URL（见 conftest.py）"""
+import threading
+from datetime import date, timedelta
+
+import pytest
+
+from db import get_conn
+from dice_engine import FairEngine
+import game
+import queries
+from game import DAILY_PLAY_LIMIT, DailyLimitReached, UserNotFound
+
+USER_ID = 1001
+TODAY = date(2024, 5, 6)
+
+
+@pytest.fixture
+def user(pool):
+    with get_conn() as conn, conn.cursor() as c:
+        c.execute("TRUNCATE users, game_logs, user_daily_stats")
+        c.execute("INSERT INTO users (user_id, username, points, plays) VALUES (%s, 'player', 100, 0)", (USER_ID,))
+    return USER_ID
+
+
+@pytest.fixture
+def fair(monkeypatch):
+    engine = FairEngine("test")
+    monkeypatch.setattr(game, "get_engine", lambda: engine)
+    return engine
+
+
+def state(user_id=USER_ID):
+    """返回 (users.points, users.plays, game_logs 条数, 当天 user_daily_stats 行)"""
+    with get_conn() as conn, conn.cursor() as c:
+        c.execute("SELECT points, plays FROM users WHERE user_id = %s", (user_id,))
+        points, plays = c.fetchone()
+        c.execute("SELECT count(*) FROM game_logs WHERE user_id = %s", (user_id,))
+        logs = c.fetchone()[0]
+        c.execute("SELECT plays, points, wins, losses, draws, nonce FROM user_daily_stats "
+                  "WHERE user_id = %s AND day = %s", (user_id, TODAY))
+        return points, plays, logs, c.fetchone()
+
+
+def play(user_id=USER_ID, day=TODAY, log_inline=True):
+    with get_conn() as conn:
+        return game.play_round(conn, user_id, day, log_inline=log_inline)
+
+
+def play_many(count, user_id=USER_ID, day=TODAY, log_inline=True):
+    with get_conn() as conn:
+        return game.play_rounds(conn, user_id, day, count, log_inline=log_inline)
+
+
+def test_play_round_updates_everything(user):
+    outcome = play()
+    assert outcome["delta"] == game.judge(outcome["user"], outcome["bot"])[0]
+    assert outcome["remaining"] == DAILY_PLAY_LIMIT - 1
+    points, plays, logs, daily = state()
+    assert (points, plays, logs) == (100 + outcome["delta"], 1, 1)
+    delta = outcome["delta"]
+    assert daily == (1, delta, int(delta > 0), int(delta < 0), int(delta == 0), 1)
+
+
+def test_play_round_without_inline_log(user):
+    play(log_inline=False)
+    play_many(2, log_inline=False)
+    points, plays, logs, daily = state()
+    assert (plays, logs, daily[0]) == (3, 0, 3)
+
+
+def test_unknown_user(user, fair):
+    with pytest.raises(UserNotFound):
+        play(user_id=99)
+    with pytest.raises(UserNotFound):
+        play_many(3, user_id=99)
+
+
+def test_unknown_user_without_nonce(user):
+    with pytest.raises(UserNotFound):
+        play(user_id=99)
+
+
+def test_daily_limit(user):
+    outcomes = [play() for _ in range(DAILY_PLAY_LIMIT)]
+    assert outcomes[-1]["remaining"] == 0
+    with pytest.raises(DailyLimitReached):
+        play()
+    with pytest.raises(DailyLimitReached):
+        play_many(1)
+    points, plays, logs, daily = state()
+    assert (plays, logs, daily[0]) == (DAILY_PLAY_LIMIT, DAILY_PLAY_LIMIT, DAILY_PLAY_LIMIT)
+    assert points == 100 + sum(o["delta"] for o in outcomes)
+
+
+def test_daily_limit_resets_next_day(user):
+    for _ in range(DAILY_PLAY_LIMIT):
+        play(day=TODAY - timedelta(days=1))
+    assert play()["remaining"] == DAILY_PLAY_LIMIT - 1
+    assert state()[1] == 1
+
+
+def test_play_rounds_truncates_to_remaining(user):
+    play_many(3)
+    outcome = play_many(DAILY_PLAY_LIMIT)
+    assert len(outcome["rounds"]) == DAILY_PLAY_LIMIT - 3
+    assert outcome["remaining"] == 0
+    assert outcome["delta"] == sum(r["delta"] for r in outcome["rounds"])
+    points, plays, logs, daily = state()
+    assert (plays, logs, daily[0]) == (DAILY_PLAY_LIMIT, DAILY_PLAY_LIMIT, DAILY_PLAY_LIMIT)
+    with get_conn() as conn, conn.cursor() as c:
+        c.execute("SELECT SUM(CASE WHEN user_roll > bot_roll THEN 10 WHEN user_roll < bot_roll THEN -5 ELSE 0 END) "
+                  "FROM game_logs WHERE user_id = %s", (USER_ID,))
+        assert points == 100 + c.fetchone()[0]
+
+
+def test_fair_rounds_follow_published_seed(user, fair):
+    rounds = [play()] + play_many(4)["rounds"]
+    assert [r["nonce"] for r in rounds] == [1, 2, 3, 4, 5]
+    for r in rounds:
+        assert fair.roll(USER_ID, TODAY, r["nonce"]) == (r["user"], r["bot"])
+        assert game.judge(r["user"], r["bot"])[0] == r["delta"]
+
+
+def run_concurrently(target, threads):
+    barrier = threading.Barrier(threads)
+    results, errors = [], []
+
+    def work():
+        barrier.wait()
+        while True:
+            try:
+                results.append(target())
+            except DailyLimitReached:
+                return
+            except Exception as e:  # noqa: BLE001 -- 交给主线程断言
+                errors.append(e)
+                return
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join(30)
+    assert errors == []
+    return results
+
+
+def test_concurrent_rounds_respect_daily_limit(user):
+    # 连接池最多 4 条连接，4 个线程一直玩到次数用完
+    outcomes = run_concurrently(play, 4)
+    assert len(outcomes) == DAILY_PLAY_LIMIT
+    assert sorted(o["remaining"] for o in outcomes) == list(range(DAILY_PLAY_LIMIT))
+    points, plays, logs, daily = state()
+    assert (plays, logs, daily[0]) == (DAILY_PLAY_LIMIT, DAILY_PLAY_LIMIT, DAILY_PLAY_LIMIT)
+    assert points == 100 + sum(o["delta"] for o in outcomes)
+
+
+def test_concurrent_single_and_batch_rounds_share_nonces_and_limit(user, fair):
+    counter = iter(range(1000))
+    lock = threading.Lock()
+
+    def mixed():
+        with lock:
+            n = next(counter)
+        if n % 2:
+            return [play()]
+        outcome = play_many(3)
+        if not outcome["rounds"]:
+            raise DailyLimitReached(USER_ID)
+        return outcome["rounds"]
+
+    rounds = [r for batch in run_concurrently(mixed, 4) for r in batch]
+    assert sorted(r["nonce"] for r in rounds) == list(range(1, DAILY_PLAY_LIMIT + 1))
+    points, plays, logs, daily = state()
+    assert (plays, logs) == (DAILY_PLAY_LIMIT, DAILY_PLAY_LIMIT)
+    assert daily[0] == daily[5] == DAILY_PLAY_LIMIT
+    assert points == 100 + sum(r["delta"] for r in rounds)
+
+
+def test_admin_reset_does_not_rewind_nonce(user, fair):
+    play_many(DAILY_PLAY_LIMIT)
+    with get_conn() as conn, conn.cursor() as c:
+        c.execute(queries.BULK_RESET_PLAYS_SQL, {"user_ids": [USER_ID], "today": TODAY})
+    rounds = [play()] + play_many(2)["rounds"]
+    assert [r["nonce"] for r in rounds] == [DAILY_PLAY_LIMIT + 1, DAILY_PLAY_LIMIT + 2, DAILY_PLAY_LIMIT + 3]
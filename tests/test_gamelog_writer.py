@@ -0,0 +1,135 @@
+import os
+import multiprocessing
+from datetime import datetime
+
+import pytest
+
+from gamelog_writer import GameLogWriter, file_lock
+
+
+class FakeWriter(GameLogWriter):
+    """_insert 写进内存列表；down=True 时模拟数据库不可用"""
+
+    def __init__(self, spool_path, **kwargs):
+        super().__init__(spool_path=str(spool_path), **kwargs)
+        self.inserted = []
+        self.down = False
+        self.fail_after = None
+
+    def _insert(self, records):
+        if self.down or (self.fail_after is not None and len(self.inserted) >= self.fail_after):
+            raise ConnectionError("database is down")
+        self.inserted.extend(records)
+
+
+def record(i):
+    return (i, 1, 2, "你输了！-5", datetime(2024, 1, 2, 3, 4, 5, i))
+
+
+def test_failed_batch_is_spooled_and_replayed(tmp_path):
+    writer = FakeWriter(tmp_path / "logs.spool")
+    writer.down = True
+    writer._write([record(1), record(2)])
+    assert writer.inserted == []
+    assert writer.stats["spooled"] == 2 and writer.stats["errors"] == 1
+
+    # 数据库恢复后，下一批写成功时顺带重放 spool
+    writer.down = False
+    writer._write([record(3)])
+    assert writer.inserted == [record(3), record(1), record(2)]
+    assert writer.stats["replayed"] == 2
+    assert not os.path.exists(writer.spool_path)
+    assert not os.path.exists(writer.spool_path + ".replay")
+
+
+def test_replay_skips_corrupt_lines(tmp_path):
+    writer = FakeWriter(tmp_path / "logs.spool")
+    writer._spool([record(1)])
+    with open(writer.spool_path, "a", encoding="utf-8") as f:
+        f.write("{not json\n\n")
+    writer._spool([record(2)])
+
+    writer._replay_spool()
+    assert writer.inserted == [record(1), record(2)]
+
+
+def test_partial_replay_keeps_the_rest(tmp_path):
+    writer = FakeWriter(tmp_path / "logs.spool", batch_size=2)
+    writer._spool([record(i) for i in range(5)])
+    writer.fail_after = 2
+
+    writer._replay_spool()
+    assert writer.inserted == [record(0), record(1)]
+    # 新的失败记录写进新的 spool，不会混进正在重放的文件
+    writer._spool([record(9)])
+
+    writer.fail_after = None
+    writer._replay_spool()
+    assert writer.inserted == [record(i) for i in range(5)]
+    writer._replay_spool()
+    assert writer.inserted == [record(i) for i in range(5)] + [record(9)]
+    assert not os.path.exists(writer.spool_path)
+
+
+def test_replay_skipped_while_another_process_replays(tmp_path):
+    writer = FakeWriter(tmp_path / "logs.spool")
+    writer._spool([record(1)])
+    with file_lock(writer.spool_path + ".replay.lock") as locked:
+        assert locked
+        writer._replay_spool()
+        assert writer.inserted == []
+    writer._replay_spool()
+    assert writer.inserted == [record(1)]
+
+
+def test_close_spools_queued_records(tmp_path):
+    writer = FakeWriter(tmp_path / "logs.spool", flush_interval=60)
+    writer.down = True
+    writer.submit(*record(1))
+    writer.close(timeout=5)
+    writer.down = False
+    writer._replay_spool()
+    assert writer.inserted == [record(1)]
+
+
+class FileWriter(GameLogWriter):
+    """把写入的 user_id 追加到文件里，多个进程的结果可以合起来检查"""
+
+    def __init__(self, spool_path, out_path):
+        super().__init__(spool_path=spool_path, batch_size=7)
+        self.out_path = out_path
+
+    def _insert(self, records):
+        with open(self.out_path, "a", encoding="utf-8") as f:
+            f.writelines(f"{r[0]}\n" for r in records)
+
+
+def _replay_worker(spool_path, out_path, start, index):
+    writer = FileWriter(spool_path, out_path)
+    start.wait()
+    for i in range(50):
+        # 一边追加一边重放，模拟各个 worker 的数据库写入时好时坏
+        writer._spool([record(index * 1000 + i)])
+        writer._replay_spool()
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(), reason="需要 fork")
+def test_concurrent_replay_writes_each_record_once(tmp_path):
+    spool_path = str(tmp_path / "logs.spool")
+    out_path = str(tmp_path / "inserted")
+    GameLogWriter(spool_path=spool_path)._spool([record(i) for i in range(500)])
+
+    ctx = multiprocessing.get_context("fork")
+    start = ctx.Event()
+    workers = [ctx.Process(target=_replay_worker, args=(spool_path, out_path, start, i)) for i in range(1, 5)]
+    for p in workers:
+        p.start()
+    start.set()
+    for p in workers:
+        p.join(30)
+        assert p.exitcode == 0
+    FileWriter(spool_path, out_path)._replay_spool()
+
+    with open(out_path, encoding="utf-8") as f:
+        ids = sorted(int(line) for line in f)
+    assert ids == list(range(500)) + [i * 1000 + n for i in range(1, 5) for n in range(50)]
@@ -0,0 +1,112 @@
+import time
+import threading
+from datetime import date, timedelta
+
+import pytest
+
+from db import get_conn
+import game
+from leaderboard import Leaderboard, LocalBackend, SharedLock, SortedSet, top_today
+
+TODAY = date(2024, 5, 6)
+
+
+def test_sorted_set_order_and_rank():
+    zset = SortedSet([(1, 10), (2, 30), (3, 10)])
+    assert zset.top(3) == [(2, 30), (1, 10), (3, 10)]
+    assert zset.rank(2) == 0 and zset.rank(3) == 2 and zset.rank(9) is None
+    zset.incr(3, 25)
+    zset.set(1, -5)
+    zset.incr(4, 1)
+    zset.remove(2)
+    assert zset.top(10) == [(3, 35), (4, 1), (1, -5)]
+    assert len(zset) == 3 and zset.score(3) == 35
+
+
+def test_shared_lock_exclusive_waits_for_shared():
+    gate = SharedLock()
+    entered = threading.Event()
+    with gate.shared():
+        t = threading.Thread(target=lambda: gate.exclusive().__enter__() or entered.set())
+        t.start()
+        assert not entered.wait(0.1)
+    assert entered.wait(1)
+    t.join()
+
+
+@pytest.fixture
+def users(pool):
+    with get_conn() as conn, conn.cursor() as c:
+        c.execute("TRUNCATE users, game_logs, user_daily_stats")
+        c.execute("INSERT INTO users (user_id, username, points, plays) "
+                  "SELECT id, 'u' || id, 0, 0 FROM generate_series(1, 6) AS id")
+    return list(range(1, 7))
+
+
+def db_points():
+    with get_conn() as conn, conn.cursor() as c:
+        c.execute("SELECT user_id, points FROM users ORDER BY points DESC, user_id")
+        return c.fetchall()
+
+
+def test_reload_during_plays_neither_loses_nor_double_counts(users):
+    board = Leaderboard(LocalBackend(refresh_interval=0))
+    assert board.top(10) == [(user_id, 0) for user_id in users]
+    stop = threading.Event()
+    errors = []
+
+    def player(user_id):
+        try:
+            for i in range(3 * game.DAILY_PLAY_LIMIT):
+                day = TODAY + timedelta(days=i // game.DAILY_PLAY_LIMIT)
+                with get_conn() as conn, board.recording():
+                    outcome = game.play_round(conn, user_id, day)
+                    conn.commit()
+                    # 拉大提交和 record_play 之间的窗口，没有 recording() 保护时这里会被算两次
+                    time.sleep(0.002)
+                    board.record_play(user_id, outcome["delta"], day)
+        except Exception as e:  # noqa: BLE001 -- 交给主线程断言
+            errors.append(e)
+
+    def reloader():
+        backend, key = board.backend, board._key()
+        while not stop.is_set():
+            with backend._load_lock(key):
+                backend._load(key, board._loader())
+
+    # 连接池 4 条：2 个玩家线程 + 1 个不停重新加载的线程
+    players = [threading.Thread(target=player, args=(user_id,)) for user_id in users[:2]]
+    loading = threading.Thread(target=reloader)
+    loading.start()
+    for t in players:
+        t.start()
+    for t in players:
+        t.join(60)
+    stop.set()
+    loading.join(10)
+    assert errors == []
+    assert sorted(board.top(10), key=lambda x: (-x[1], x[0])) == db_points()
+
+
+def test_unloaded_key_is_not_loaded_by_writes(users):
+    board = Leaderboard(LocalBackend(refresh_interval=0))
+    with get_conn() as conn, board.recording():
+        outcome = game.play_round(conn, 1, TODAY)
+        conn.commit()
+        board.record_play(1, outcome["delta"], TODAY)
+    assert board.backend._sets == {}
+    # 第一次读取时加载，已提交的这一局只算一次
+    assert board.rank(1) == (1 if outcome["delta"] >= 0 else 6, outcome["delta"])
+    assert board.top(1, day=TODAY) == [(1, outcome["delta"])]
+
+
+def test_top_today_orders_todays_players_by_total_points(users):
+    with get_conn() as conn, conn.cursor() as c:
+        c.execute("UPDATE users SET points = user_id * 100")
+    for user_id in (2, 5, 3):
+        with get_conn() as conn:
+            game.play_round(conn, user_id, TODAY)
+    rows = top_today(10, day=TODAY)
+    assert [row["user_id"] for row in rows] == [5, 3, 2]
+    assert all(row["plays_today"] == 1 for row in rows)
+    assert top_today(10, day=TODAY + timedelta(days=1)) == []
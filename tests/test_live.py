@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+import live
+from live import LiveHub
+
+RANK_ROW = {"username": "ann", "points_today": 10, "points": 110, "plays_today": 1,
+            "wins_today": 1, "losses_today": 0, "draws_today": 0}
+
+
+def events(client):
+    out = []
+    while not client.queue.empty():
+        message = client.queue.get_nowait().decode()
+        event, data = message.split("\n")[:2]
+        out.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return out
+
+
+@pytest.fixture
+def hub():
+    hub = LiveHub(tick=3600, refresh=3600)
+    yield hub
+    hub.stop()
+
+
+def test_failed_tick_keeps_pending_wins_and_rank(hub, monkeypatch):
+    down = True
+
+    def top_today(n, day=None):
+        if down:
+            raise ConnectionError("database is down")
+        return [RANK_ROW]
+
+    monkeypatch.setattr(live, "top_today", top_today)
+    monkeypatch.setattr(hub, "_load_names", lambda user_ids: {1: "ann"})
+    client = hub.subscribe()
+    hub.record_play(1, 10, 6, 1)
+
+    # 赢局已经推送出去，榜单查询失败：赢局不重复推送，榜单下一个 tick 重试
+    with pytest.raises(ConnectionError):
+        hub.tick_once()
+    assert [e for e, _ in events(client)] == ["wins"]
+    down = False
+    hub.tick_once()
+    assert events(client) == [("rank", [RANK_ROW])]
+
+
+def test_failed_name_lookup_keeps_wins(hub, monkeypatch):
+    monkeypatch.setattr(live, "top_today", lambda n, day=None: [RANK_ROW])
+
+    def names(user_ids):
+        raise ConnectionError("database is down")
+
+    monkeypatch.setattr(hub, "_load_names", names)
+    client = hub.subscribe()
+    hub.record_play(1, 10, 6, 1)
+    with pytest.raises(ConnectionError):
+        hub.tick_once()
+    assert events(client) == []
+
+    monkeypatch.setattr(hub, "_load_names", lambda user_ids: {1: "ann"})
+    hub.tick_once()
+    assert events(client) == [
+        ("wins", [{"username": "ann", "delta": 10, "user_roll": 6, "bot_roll": 1}]),
+        ("rank", [RANK_ROW]),
+    ]
@@ -0,0 +1,79 @@
+import asyncio
+import threading
+
+import live
+from live_server import AsyncLiveHub, LiveServer
+
+RANK_ROW = {"username": "ann", "points_today": 10, "points": 110, "plays_today": 1,
+            "wins_today": 1, "losses_today": 0, "draws_today": 0}
+
+
+async def read_until(reader, marker):
+    data = b""
+    while marker not in data:
+        chunk = await asyncio.wait_for(reader.read(4096), 5)
+        assert chunk, data
+        data += chunk
+    return data
+
+
+async def open_stream(port, path="/live/stream"):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    return reader, writer
+
+
+def run(coro_factory, monkeypatch, max_connections=1000):
+    monkeypatch.setattr(live, "top_today", lambda n, day=None: [RANK_ROW])
+
+    async def main():
+        hub = AsyncLiveHub(asyncio.get_running_loop(), tick=3600, refresh=3600, max_connections=max_connections)
+        server = LiveServer(hub)
+        listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        try:
+            await coro_factory(hub, port)
+        finally:
+            listener.close()
+            hub.stop()
+
+    asyncio.run(main())
+
+
+def test_many_viewers_without_a_thread_each(monkeypatch):
+    async def scenario(hub, port):
+        threads = threading.active_count()
+        streams = [await open_stream(port) for _ in range(300)]
+        for reader, _ in streams:
+            assert (await read_until(reader, b"retry: ")).startswith(b"HTTP/1.1 200 OK")
+        assert hub.stats()["connections"] == 300
+        assert threading.active_count() <= threads + 1  # 只多出 hub 的 ticker 线程
+
+        # ticker 线程里的 tick 广播到所有连接
+        await asyncio.get_running_loop().run_in_executor(None, hub.tick_once)
+        for reader, _ in streams:
+            assert b'"username": "ann"' in await read_until(reader, b"event: rank")
+
+        for _, writer in streams:
+            writer.close()
+        for _ in range(50):
+            if hub.stats()["connections"] == 0:
+                break
+            # 断开的连接在下一次写入（心跳）时被发现；这里直接再广播一次
+            hub._broadcast("ping", b": ping\n\n")
+            await asyncio.sleep(0.05)
+        assert hub.stats()["connections"] == 0
+
+    run(scenario, monkeypatch)
+
+
+def test_full_and_unknown_path(monkeypatch):
+    async def scenario(hub, port):
+        reader, _ = await open_stream(port)
+        await read_until(reader, b"retry: ")
+        reader, _ = await open_stream(port)
+        assert (await read_until(reader, b"\r\n\r\n")).startswith(b"HTTP/1.1 503")
+        reader, _ = await open_stream(port, "/admin")
+        assert (await read_until(reader, b"\r\n\r\n")).startswith(b"HTTP/1.1 404")
+
+    run(scenario, monkeypatch, max_connections=1)
@@ -0,0 +1,55 @@
+import time
+import threading
+
+from notifier import TelegramNotifier
+
+
+class RecordingNotifier(TelegramNotifier):
+    """不发网络请求，只记录发送顺序"""
+
+    def __init__(self, **kwargs):
+        super().__init__("TOKEN", api_base="http://localhost", workers=1, global_rate=1000.0, **kwargs)
+        self.sent = []
+        self.done = threading.Event()
+        self.expected = None
+
+    def _send(self, job):
+        self.sent.append(job["payload"]["text"])
+        if self.expected is not None and len(self.sent) >= self.expected:
+            self.done.set()
+
+
+def test_deferred_messages_share_one_scheduler_thread():
+    notifier = RecordingNotifier(per_chat_interval=0.2)
+    notifier.start()
+    threads = threading.active_count()
+    notifier.expected = 400
+    # 200 个聊天各发两条，第二条都要延后；不应为每条延后的消息开线程
+    for chat_id in range(200):
+        notifier.send_message(chat_id, f"{chat_id}-a")
+        notifier.send_message(chat_id, f"{chat_id}-b")
+    time.sleep(0.05)
+    assert threading.active_count() == threads
+    assert notifier.done.wait(5)
+    for chat_id in range(200):
+        assert notifier.sent.index(f"{chat_id}-a") < notifier.sent.index(f"{chat_id}-b")
+    notifier.close()
+
+
+def test_delayed_jobs_are_released_in_due_order():
+    notifier = RecordingNotifier()
+    notifier.start()
+    notifier.expected = 3
+    for text, delay in [("c", 0.3), ("a", 0.1), ("b", 0.2)]:
+        notifier._schedule({"payload": {"chat_id": text, "text": text}, "attempt": 0}, delay)
+    assert notifier.stats()["delayed_size"] == 3
+    assert notifier.done.wait(5)
+    assert notifier.sent == ["a", "b", "c"]
+    notifier.close()
+
+
+def test_delayed_jobs_are_bounded():
+    notifier = RecordingNotifier(max_queue=2)
+    for i in range(3):
+        notifier._schedule({"payload": {"chat_id": i, "text": str(i)}, "attempt": 0}, 60)
+    assert notifier.stats()["dropped"] == 1
@@ -0,0 +1,149 @@
+import pytest
+from flask import Flask, session
+
+import ratelimit
+from ratelimit import LocalLimiter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, "monotonic", clock)
+    return clock
+
+
+def test_burst_then_refill(clock):
+    limiter = LocalLimiter()
+    bucket = [("k", 2.0, 3)]
+    assert [limiter.hit(bucket) for _ in range(3)] == [[0.0]] * 3
+    assert limiter.hit(bucket) == [pytest.approx(0.5)]
+    clock.now += 0.5
+    assert limiter.hit(bucket) == [0.0]
+    assert limiter.hit(bucket)[0] > 0
+    # 补充的令牌不超过桶容量
+    clock.now += 60
+    assert [limiter.hit(bucket) for _ in range(3)] == [[0.0]] * 3
+    assert limiter.hit(bucket)[0] > 0
+
+
+def test_keys_are_independent(clock):
+    limiter = LocalLimiter()
+    assert limiter.hit([("a", 1.0, 1)]) == [0.0]
+    assert limiter.hit([("a", 1.0, 1)])[0] > 0
+    assert limiter.hit([("b", 1.0, 1)]) == [0.0]
+
+
+def test_rejected_request_consumes_nothing(clock):
+    limiter = LocalLimiter()
+    user, ip = ("user", 1.0, 1), ("ip", 1.0, 5)
+    assert limiter.hit([user, ip]) == [0.0, 0.0]
+    # user 桶空了：整个请求被拒，ip 桶一个也不扣
+    for _ in range(10):
+        waits = limiter.hit([user, ip])
+        assert waits[0] > 0 and waits[1] == 0
+    assert [limiter.hit([ip]) for _ in range(4)] == [[0.0]] * 4
+    assert limiter.hit([ip])[0] > 0
+
+
+def test_max_keys_evicts_least_recent(clock):
+    limiter = LocalLimiter(max_keys=2)
+    limiter.hit([("a", 1.0, 1)])
+    limiter.hit([("b", 1.0, 1)])
+    limiter.hit([("a", 1.0, 1)])
+    limiter.hit([("c", 1.0, 1)])
+    assert list(limiter._buckets) == ["a", "c"]
+
+
+@pytest.fixture
+def app(monkeypatch, clock):
+    limiter = LocalLimiter()
+    monkeypatch.setattr(ratelimit, "get_limiter", lambda: limiter)
+    monkeypatch.setattr(ratelimit, "RULES", {
+        "play": [("user", 1.0, 2), ("ip", 1.0, 3)],
+        "login": [("ip", 1.0, 1), ("user", 0, 1)],
+    })
+    monkeypatch.setattr(ratelimit.config, "RATE_LIMIT_ENABLED", True)
+    app = Flask(__name__)
+    app.secret_key = "test"
+    return app
+
+
+def test_check_skips_missing_keys_and_disabled_rules(app):
+    with app.test_request_context(environ_base={"REMOTE_ADDR": "1.2.3.4"}):
+        # rate 为 0 的 user 规则不限，只剩 ip 规则
+        session["user_id"] = 1
+        assert ratelimit.check("login") == 0
+        assert ratelimit.check("login") > 0
+    with app.test_request_context(environ_base={"REMOTE_ADDR": "5.6.7.8"}):
+        # 未登录时没有 user 规则
+        assert ratelimit.check("play") == 0
+        assert ratelimit.check("play") == 0
+        assert ratelimit.check("play") == 0
+        assert ratelimit.check("play") > 0
+
+
+def test_check_user_and_ip(app):
+    with app.test_request_context(environ_base={"REMOTE_ADDR": "1.2.3.4"}):
+        session["user_id"] = 1
+        assert ratelimit.check("play") == 0
+        assert ratelimit.check("play") == 0
+        assert ratelimit.check("play") > 0
+    # 同一 IP 上的另一个用户：ip 桶还剩 1 个（被拒的那次没有扣）
+    with app.test_request_context(environ_base={"REMOTE_ADDR": "1.2.3.4"}):
+        session["user_id"] = 2
+        assert ratelimit.check("play") == 0
+        assert ratelimit.check("play") > 0
+
+
+def test_session_bucket_protects_shared_ip(app, monkeypatch):
+    monkeypatch.setitem(ratelimit.RULES, "login", [("session", 1.0, 2), ("ip", 1.0, 5)])
+    client = app.test_client()
+
+    @app.route("/login", methods=["POST"])
+    @ratelimit.limit("login", json=False)
+    def login():
+        return "ok"
+
+    # 同一 IP 后面的一个客户端刷登录：先被自己的会话桶拦住，被拒的请求不扣 IP 桶
+    codes = [client.post("/login").status_code for _ in range(10)]
+    assert codes == [200, 200] + [429] * 8
+    # 同一 IP 上的其他人（另一个 cookie）还能登录
+    other = app.test_client()
+    assert [other.post("/login").status_code for _ in range(2)] == [200, 200]
+
+
+def test_session_id_is_stable_within_session(app):
+    with app.test_request_context():
+        sid = ratelimit.session_id()
+        assert len(sid) == 32 and ratelimit.session_id() == sid
+
+
+def test_check_fails_open(app, monkeypatch):
+    class Broken:
+        def hit(self, buckets):
+            raise ConnectionError
+
+    monkeypatch.setattr(ratelimit, "get_limiter", lambda: Broken())
+    with app.test_request_context():
+        assert ratelimit.check("login") == 0
+
+
+def test_limit_decorator(app):
+    @app.route("/login", methods=["POST"])
+    @ratelimit.limit("login", json=False)
+    def login():
+        return "ok"
+
+    client = app.test_client()
+    assert client.post("/login").status_code == 200
+    response = client.post("/login")
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
@@ -0,0 +1,113 @@
+"""邀请关系的闭包表和人数，需要 TEST_DATABASE_URL（见 conftest.py）"""
+import pytest
+
+from db import get_conn
+import referrals
+
+USERS = range(1, 9)
+
+
+@pytest.fixture
+def c(pool):
+    with get_conn() as conn, conn.cursor() as c:
+        c.execute("TRUNCATE users, referral_paths, referral_counts")
+        c.execute("INSERT INTO users (user_id, username) SELECT id, 'u' || id FROM unnest(%s::bigint[]) AS id",
+                  (list(USERS),))
+        yield c
+
+
+def counts(c):
+    c.execute("SELECT user_id, direct_count, total_count FROM referral_counts "
+              "WHERE total_count > 0 ORDER BY user_id")
+    return {user_id: (direct, total) for user_id, direct, total in c.fetchall()}
+
+
+def assert_consistent(c):
+    """人数表与闭包表一致，闭包表与 invited_by 一致"""
+    c.execute("""
+        SELECT ancestor_id, COUNT(*) FILTER (WHERE depth = 1), COUNT(*)
+        FROM referral_paths GROUP BY ancestor_id ORDER BY ancestor_id
+    """)
+    expected = {user_id: (direct, total) for user_id, direct, total in c.fetchall()}
+    assert counts(c) == expected
+    c.execute("""
+        SELECT descendant_id, ancestor_id FROM referral_paths WHERE depth = 1
+        EXCEPT
+        SELECT user_id, invited_by FROM users WHERE invited_by IS NOT NULL
+    """)
+    assert c.fetchall() == []
+
+
+def test_link_builds_paths_and_counts(c):
+    # 1 <- 2 <- 3 <- 4，1 <- 5
+    for user_id, inviter_id in [(2, 1), (3, 2), (4, 3), (5, 1)]:
+        assert referrals.link(c, user_id, inviter_id)
+    assert counts(c) == {1: (2, 4), 2: (1, 2), 3: (1, 1)}
+    c.execute("SELECT depth FROM referral_paths WHERE ancestor_id = 1 AND descendant_id = 4")
+    assert c.fetchone() == (3,)
+    assert_consistent(c)
+
+
+def test_link_attaches_existing_subtree(c):
+    # 先有 6 <- 7 <- 8，再把 6 挂到 1 下面：1 的全部下线一次加 3
+    assert referrals.link(c, 7, 6)
+    assert referrals.link(c, 8, 7)
+    assert referrals.link(c, 6, 1)
+    assert counts(c) == {1: (1, 3), 6: (1, 2), 7: (1, 1)}
+    assert_consistent(c)
+
+
+@pytest.mark.parametrize("user_id, inviter_id", [
+    (2, 2),        # 自己邀请自己
+    (1, 3),        # 会成环
+    (2, 5),        # 已经有邀请人
+    (99, 1),       # 用户不存在
+    (6, "abc"),    # 不是合法的 user_id
+    (6, 2 ** 63),
+])
+def test_link_rejected(c, user_id, inviter_id):
+    referrals.link(c, 2, 1)
+    referrals.link(c, 3, 2)
+    before = counts(c)
+    assert not referrals.link(c, user_id, inviter_id)
+    assert counts(c) == before
+    assert_consistent(c)
+
+
+def test_remove_users(c):
+    # 1 <- 2 <- 3 <- 4，1 <- 5，删除 2：1 少一个直接下线，3、4 仍算 1 的下线
+    for user_id, inviter_id in [(2, 1), (3, 2), (4, 3), (5, 1)]:
+        referrals.link(c, user_id, inviter_id)
+    referrals.remove_users(c, [2])
+    c.execute("DELETE FROM users WHERE user_id = 2")
+    assert counts(c) == {1: (1, 3), 3: (1, 1)}
+    c.execute("SELECT count(*) FROM referral_paths WHERE 2 IN (ancestor_id, descendant_id)")
+    assert c.fetchone() == (0,)
+
+
+def test_remove_several_users_in_one_chain(c):
+    for user_id, inviter_id in [(2, 1), (3, 2), (4, 3), (5, 4)]:
+        referrals.link(c, user_id, inviter_id)
+    referrals.remove_users(c, [2, 4])
+    c.execute("DELETE FROM users WHERE user_id IN (2, 4)")
+    assert counts(c) == {1: (0, 2), 3: (0, 1)}
+    referrals.remove_users(c, [])
+    assert counts(c) == {1: (0, 2), 3: (0, 1)}
+
+
+def test_downline_pagination(c):
+    for user_id, inviter_id in [(2, 1), (3, 1), (4, 2), (5, 2), (6, 4)]:
+        referrals.link(c, user_id, inviter_id)
+    c.connection.commit()
+
+    seen, cursor = [], None
+    while True:
+        rows, cursor = referrals.downline(1, after=cursor, limit=2)
+        seen += [(row["depth"], row["user_id"]) for row in rows]
+        if cursor is None:
+            break
+    assert seen == [(1, 2), (1, 3), (2, 4), (2, 5), (3, 6)]
+    rows, _ = referrals.downline(1, max_depth=1)
+    assert [row["user_id"] for row in rows] == [2, 3]
+    assert referrals.get_counts(1) == {"direct": 2, "total": 5}
+    assert referrals.get_counts(6) == {"direct": 0, "total": 0}
@@ -0,0 +1,185 @@
+import hmac
+import json
+import hashlib
+import threading
+from urllib.parse import urlencode
+
+import pytest
+
+from cache import LocalCache
+from telegram_auth import AuthError, TelegramAuth
+
+TOKEN = "123456:TEST"
+NOW = 1700000000
+
+
+def signed_login(**fields):
+    data = {"id": "42", "first_name": "Ann", "auth_date": str(NOW), **fields}
+    check = "\n".join(f"{k}={data[k]}" for k in sorted(data)).encode()
+    data["hash"] = hmac.new(hashlib.sha256(TOKEN.encode()).digest(), check, hashlib.sha256).hexdigest()
+    return data
+
+
+def signed_webapp(**fields):
+    data = {"user": json.dumps({"id": 42, "first_name": "Ann"}), "auth_date": str(NOW),
+            "query_id": "AAA", **fields}
+    check = "\n".join(f"{k}={data[k]}" for k in sorted(data)).encode()
+    secret = hmac.new(b"WebAppData", TOKEN.encode(), hashlib.sha256).digest()
+    data["hash"] = hmac.new(secret, check, hashlib.sha256).hexdigest()
+    return urlencode(data)
+
+
+@pytest.fixture
+def auth():
+    return TelegramAuth(TOKEN, max_age=3600, replay_cache=LocalCache(100, 3600))
+
+
+def test_login_ok(auth):
+    fields = auth.verify_login(signed_login(), now=NOW)
+    assert fields == {"id": "42", "first_name": "Ann", "auth_date": str(NOW)}
+
+
+def test_login_hash_is_case_insensitive(auth):
+    data = signed_login()
+    data["hash"] = data["hash"].upper()
+    auth.verify_login(data, now=NOW)
+
+
+@pytest.mark.parametrize("change, reason", [
+    ({"first_name": "Bob"}, "bad_hash"),
+    ({"hash": "0" * 64}, "bad_hash"),
+    ({"hash": None}, "bad_hash"),
+])
+def test_login_tampered(auth, change, reason):
+    data = {**signed_login(), **change}
+    with pytest.raises(AuthError) as e:
+        auth.verify_login(data, now=NOW)
+    assert e.value.reason == reason
+
+
+def test_login_wrong_token():
+    data = signed_login()
+    with pytest.raises(AuthError) as e:
+        TelegramAuth("654321:OTHER").verify_login(data, now=NOW)
+    assert e.value.reason == "bad_hash"
+
+
+def test_login_malformed(auth):
+    with pytest.raises(AuthError) as e:
+        auth.verify_login(["id", "42"], now=NOW)
+    assert e.value.reason == "malformed"
+
+
+def test_login_auth_date(auth):
+    with pytest.raises(AuthError) as e:
+        auth.verify_login(signed_login(), now=NOW + 3601)
+    assert e.value.reason == "expired"
+    with pytest.raises(AuthError) as e:
+        auth.verify_login(signed_login(), now=NOW - 120)
+    assert e.value.reason == "future"
+    with pytest.raises(AuthError) as e:
+        auth.verify_login(signed_login(auth_date="soon"), now=NOW)
+    assert e.value.reason == "no_auth_date"
+
+
+def test_replay_from_other_session(auth):
+    data = signed_login()
+    auth.verify_login(data, now=NOW, owner="a")
+    with pytest.raises(AuthError) as e:
+        auth.verify_login(data, now=NOW, owner="b")
+    assert e.value.reason == "replay"
+    with pytest.raises(AuthError):
+        auth.verify_login(data, now=NOW)
+
+
+def test_same_owner_may_resubmit(auth):
+    data = signed_login()
+    auth.verify_login(data, now=NOW, owner="a")
+    auth.verify_login(data, now=NOW, owner="a")
+
+
+def test_release_allows_retry(auth):
+    data = signed_login()
+    # 校验通过但登录没有完成（例如手机号缺失）时释放，改正后其他会话也可以用
+    auth.verify_login(data, now=NOW, owner="a").release()
+    auth.verify_login(data, now=NOW, owner="b")
+    with pytest.raises(AuthError):
+        auth.verify_login(data, now=NOW, owner="a")
+
+
+def test_release_keeps_earlier_reservation(auth):
+    data = signed_login()
+    auth.verify_login(data, now=NOW, owner="a")
+    # 同一会话再次提交后失败，不能把第一次成功登录的占用也释放掉
+    auth.verify_login(data, now=NOW, owner="a").release()
+    with pytest.raises(AuthError):
+        auth.verify_login(data, now=NOW, owner="b")
+
+
+def test_concurrent_sessions_only_one_passes(auth):
+    data = signed_login()
+    barrier = threading.Barrier(8)
+    passed, replayed = [], []
+
+    def submit(owner):
+        barrier.wait()
+        try:
+            auth.verify_login(data, now=NOW, owner=owner)
+        except AuthError:
+            replayed.append(owner)
+        else:
+            passed.append(owner)
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    assert len(passed) == 1 and len(replayed) == 7
+
+
+def test_replay_cache_failure_does_not_block_login():
+    class Broken:
+        def get(self, key):
+            raise ConnectionError
+
+        def add(self, key, value, ttl=None):
+            raise ConnectionError
+
+        def delete(self, *keys):
+            raise ConnectionError
+
+    auth = TelegramAuth(TOKEN, replay_cache=Broken())
+    auth.verify_login(signed_login(), now=NOW).release()
+
+
+def test_webapp_ok(auth):
+    fields = auth.verify_webapp(signed_webapp(), now=NOW)
+    assert fields["user"] == {"id": 42, "first_name": "Ann"}
+    assert fields["query_id"] == "AAA"
+    assert "hash" not in fields
+
+
+def test_webapp_rejects_login_signature(auth):
+    # 两种数据的密钥不同，Login Widget 的签名不能拿来当 initData 用
+    with pytest.raises(AuthError) as e:
+        auth.verify_webapp(urlencode(signed_login()), now=NOW)
+    assert e.value.reason == "bad_hash"
+
+
+def test_webapp_malformed(auth):
+    with pytest.raises(AuthError) as e:
+        auth.verify_webapp("a=1&&=", now=NOW)
+    assert e.value.reason == "malformed"
+    with pytest.raises(AuthError) as e:
+        auth.verify_webapp(signed_webapp(user="{not json"), now=NOW)
+    assert e.value.reason == "malformed"
+
+
+def test_webapp_reload_in_same_session(auth):
+    init_data = signed_webapp()
+    auth.verify_webapp(init_data, now=NOW, owner="a")
+    auth.verify_webapp(init_data, now=NOW, owner="a")
+    with pytest.raises(AuthError) as e:
+        auth.verify_webapp(init_data, now=NOW, owner="b")
+    assert e.value.reason == "replay"
@@ -0,0 +1,403 @@
+"""
+离线统计报表：把 game_logs 和 users 用 COPY 分块导出，NumPy 向量化计算，写入列式快照和 summary.json。
+
+    pip install numpy [pyarrow]   # 只在运行报表时需要，线上不需要；装了 pyarrow 才能 --format parquet
+    ANALYTICS_DATABASE_URL=postgresql://...只读副本... \\
+        python tools/analytics.py [--since 2024-01-01] [--until 2024-07-01] [--chunk-days 7] \\
+        [--format npz|parquet] [--output-dir analytics] [--pause 0.5]
+
+统计内容（--until 默认为今天，只统计已经结束的日子）：
+- 每天的对局数、胜 / 负 / 平、日活（当天玩过的人数）、发放的净积分（积分通胀）
+- 按注册周分组的留存：注册后第 1 / 7 / 30 天还在玩的比例（还没到那一天的用户不计入分母）
+- 按邀请人分组的留存，取邀请人数最多的 --top-inviters 个，另附自然注册（没有邀请人）一行
+
+不给主库加负担：
+- 优先连 ANALYTICS_DATABASE_URL（只读副本），没配置时才用 DATABASE_URL；会话设为只读
+- game_logs 按 --chunk-days 天一段导出，每段一条 COPY、单独的短事务，走按月分区和时间索引，
+  不会长时间持有快照拖住 VACUUM；段与段之间暂停 --pause 秒
+- COPY 的输出每攒够 --chunk-mb 就解析、累加后丢掉，内存占用与表的大小无关
+
+结果写到 --output-dir（默认 ANALYTICS_DIR）：daily.npz / users.npz / cohorts.npz（或对应的 .parquet）
+和 summary.json。/admin/analytics 展示 summary.json。
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import psycopg2
+from psycopg2 import sql
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config  # noqa: E402
+from game import judge  # noqa: E402
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # 可选依赖
+    pyarrow = None
+
+EPOCH = date(1970, 1, 1)
+RETENTION_DAYS = (1, 7, 30)
+# np.sign(user_roll - bot_roll) + 1 -> 负 / 平 / 胜 对应的积分变化，与 game.judge 一致
+DELTAS = np.array([judge(1, 2)[0], judge(1, 1)[0], judge(2, 1)[0]], dtype=np.int64)
+
+# 迁移时把没有时间的旧记录放到了 1970-01-01（'epoch'），不排除的话默认范围会从 1970 年开始，
+# 每日数组被几十年的空白日子填满
+RANGE_SQL = "SELECT MIN(timestamp)::date, MAX(timestamp)::date FROM game_logs WHERE timestamp > 'epoch'"
+
+USERS_COPY_SQL = """
+    COPY (
+        SELECT user_id,
+               COALESCE(created_at::date - DATE '1970-01-01', -1),
+               COALESCE(invited_by, 0)
+        FROM users
+        ORDER BY user_id
+    ) TO STDOUT WITH (FORMAT csv)
+"""
+
+LOGS_COPY_SQL = """
+    COPY (
+        SELECT user_id, user_roll, bot_roll, timestamp::date - DATE '1970-01-01'
+        FROM game_logs
+        WHERE timestamp >= {start} AND timestamp < {end}
+          AND user_id IS NOT NULL AND user_roll IS NOT NULL AND bot_roll IS NOT NULL
+    ) TO STDOUT WITH (FORMAT csv)
+"""
+
+
+def day_number(d):
+    return (d - EPOCH).days
+
+
+def parse_csv(data, columns):
+    """全是整数列的 CSV -> (行数, columns) 的 int64 数组"""
+    if not data:
+        return np.empty((0, columns), dtype=np.int64)
+    return np.loadtxt(io.BytesIO(data), delimiter=",", dtype=np.int64, ndmin=2)
+
+
+class CopyChunks:
+    """
+    copy_expert 的输出：攒够 chunk_bytes 就解析、交给 handle，内存里只留一块。
+    COPY TO 每一行调用一次 write（每行都是完整的一行 bytes），所以 write 里只做最少的事。
+    """
+
+    def __init__(self, columns, handle, chunk_bytes):
+        self.columns = columns
+        self.handle = handle
+        self.chunk_bytes = chunk_bytes
+        self.rows = 0
+        self._buffer = bytearray()
+
+    def write(self, data):
+        self._buffer += data
+        if len(self._buffer) >= self.chunk_bytes:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            array = parse_csv(bytes(self._buffer), self.columns)
+            self._buffer.clear()
+            self.rows += len(array)
+            self.handle(array)
+
+
+def copy_chunks(conn, query, columns, handle, chunk_bytes):
+    out = CopyChunks(columns, handle, chunk_bytes)
+    with conn.cursor() as c:
+        c.copy_expert(query, out)
+    out.flush()
+    conn.commit()
+    return out.rows
+
+
+class Report:
+    def __init__(self, first_day, last_day, users):
+        self.first_day = first_day  # 天数（距 1970-01-01）
+        self.last_day = last_day  # 含
+        n = last_day - first_day + 1
+        self.plays = np.zeros(n, dtype=np.int64)
+        self.outcomes = np.zeros((n, 3), dtype=np.int64)  # 负 / 平 / 胜
+        self.points = np.zeros(n, dtype=np.int64)
+        self.dau = np.zeros(n, dtype=np.int64)
+        self._active = []  # 当前这一段里出现过的 (天, user_id)，压成一个整数
+        self._segment = (first_day, 1)
+
+        self.user_ids = users[:, 0]
+        self.created = users[:, 1]
+        self.inviter = users[:, 2]
+        m = len(self.user_ids)
+        self.user_plays = np.zeros(m, dtype=np.int64)
+        self.first_active = np.full(m, np.iinfo(np.int64).max, dtype=np.int64)
+        self.last_active = np.full(m, -1, dtype=np.int64)
+        self.retained = {k: np.zeros(m, dtype=bool) for k in RETENTION_DAYS}
+        self.unknown_rows = 0  # 日志里的用户已被删除
+
+    def add_logs(self, logs):
+        user_id, user_roll, bot_roll, day = logs.T
+        offset = day - self.first_day
+        n = len(self.plays)
+        outcome = np.sign(user_roll - bot_roll) + 1
+
+        self.plays += np.bincount(offset, minlength=n)
+        self.outcomes += np.bincount(offset * 3 + outcome, minlength=n * 3).reshape(n, 3)
+        self.points += np.bincount(offset, weights=DELTAS[outcome], minlength=n).astype(np.int64)
+        # Telegram 的 user_id 远小于 2^63 / chunk_days，乘上去不会溢出
+        segment_start, segment_days = self._segment
+        self._active.append(np.unique(user_id * segment_days + (day - segment_start)))
+
+        # 按 user_id 找到 users 里的下标，找不到的（已删除）只计入每日数据
+        index = np.searchsorted(self.user_ids, user_id)
+        index[index == len(self.user_ids)] = 0
+        known = self.user_ids[index] == user_id if len(self.user_ids) else np.zeros(len(user_id), dtype=bool)
+        self.unknown_rows += int((~known).sum())
+        index, day = index[known], day[known]
+        self.user_plays += np.bincount(index, minlength=len(self.user_ids))
+        np.minimum.at(self.first_active, index, day)
+        np.maximum.at(self.last_active, index, day)
+        age = day - self.created[index]
+        for k, retained in self.retained.items():
+            retained[index[age == k]] = True
+
+    def start_segment(self, start_day, days):
+        self._segment = (start_day, days)
+
+    def end_segment(self):
+        """一段导出完之后调用。各段的日期不重叠，段内去重后就是准确的日活"""
+        if self._active:
+            segment_start, segment_days = self._segment
+            days = np.unique(np.concatenate(self._active)) % segment_days
+            offset = segment_start - self.first_day
+            self.dau[offset:offset + segment_days] += np.bincount(days, minlength=segment_days)
+        self._active = []
+
+    # --- 结果 ---
+    def daily(self):
+        return {
+            "day": np.arange(self.first_day, self.last_day + 1).astype("datetime64[D]"),
+            "plays": self.plays,
+            "dau": self.dau,
+            "wins": self.outcomes[:, 2],
+            "losses": self.outcomes[:, 0],
+            "draws": self.outcomes[:, 1],
+            "points": self.points,
+        }
+
+    def users(self):
+        active = self.last_active >= 0
+        data = {
+            "user_id": self.user_ids,
+            "created": np.where(self.created >= 0, self.created, np.iinfo(np.int64).min).astype("datetime64[D]"),
+            "invited_by": self.inviter,
+            "plays": self.user_plays,
+            "first_active": np.where(active, self.first_active, np.iinfo(np.int64).min).astype("datetime64[D]"),
+            "last_active": np.where(active, self.last_active, np.iinfo(np.int64).min).astype("datetime64[D]"),
+        }
+        for k, retained in self.retained.items():
+            data[f"d{k}"] = retained
+        return data
+
+    def _eligible(self, k):
+        """注册后第 k 天已经在统计区间内的用户才计入留存的分母"""
+        return (self.created >= self.first_day) & (self.created + k <= self.last_day)
+
+    def _retention(self, groups, size):
+        """groups 为每个用户的分组下标，返回 {d1: (分母, 分子)...}，每组一个数"""
+        result = {}
+        for k, retained in self.retained.items():
+            eligible = self._eligible(k)
+            result[k] = (np.bincount(groups, weights=eligible, minlength=size).astype(np.int64),
+                         np.bincount(groups, weights=eligible & retained, minlength=size).astype(np.int64))
+        return result
+
+    def cohorts(self):
+        """按注册周（周一开始）分组；1970-01-05 是周一"""
+        has_created = self.created >= 0
+        week = (self.created - 4) // 7
+        weeks, groups = np.unique(np.where(has_created, week, -1), return_inverse=True)
+        sizes = np.bincount(groups, minlength=len(weeks))
+        data = {"week": (weeks * 7 + 4).astype("datetime64[D]"), "users": sizes}
+        for k, (eligible, retained) in self._retention(groups, len(weeks)).items():
+            data[f"d{k}_eligible"] = eligible
+            data[f"d{k}_retained"] = retained
+        keep = weeks >= 0
+        return {name: values[keep] for name, values in data.items()}
+
+    def inviters(self, top):
+        """邀请人数最多的 top 个邀请人的留存，invited_by = 0 为自然注册"""
+        inviters, groups = np.unique(self.inviter, return_inverse=True)
+        sizes = np.bincount(groups, minlength=len(inviters))
+        active = np.bincount(groups, weights=self.user_plays > 0, minlength=len(inviters)).astype(np.int64)
+        retention = self._retention(groups, len(inviters))
+
+        order = np.argsort(-np.where(inviters == 0, 0, sizes), kind="stable")
+        picked = [i for i in order if inviters[i] != 0][:top] + list(np.flatnonzero(inviters == 0))
+        rows = []
+        for i in picked:
+            row = {"inviter_id": int(inviters[i]), "users": int(sizes[i]), "active": int(active[i])}
+            for k, (eligible, retained) in retention.items():
+                row[f"d{k}"] = rate(retained[i], eligible[i])
+            rows.append(row)
+        return rows
+
+
+def rate(part, whole):
+    return round(float(part) / float(whole), 4) if whole else None
+
+
+def summarize(report, since, until, summary_days, summary_weeks, top_inviters, elapsed, rows):
+    daily = report.daily()
+    points_total = np.cumsum(report.points)
+    plays = int(report.plays.sum())
+    losses, draws, wins = (int(v) for v in report.outcomes.sum(axis=0))
+    recent = slice(max(0, len(report.plays) - summary_days), None)
+
+    cohorts = report.cohorts()
+    cohort_rows = []
+    for i in range(len(cohorts["week"])):
+        row = {"week": str(cohorts["week"][i]), "users": int(cohorts["users"][i])}
+        for k in RETENTION_DAYS:
+            row[f"d{k}"] = rate(cohorts[f"d{k}_retained"][i], cohorts[f"d{k}_eligible"][i])
+        cohort_rows.append(row)
+
+    return {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "since": since.isoformat(),
+        "until": until.isoformat(),
+        "rows": rows,
+        "seconds": round(elapsed, 1),
+        "totals": {
+            "plays": plays,
+            "wins": wins,
+            "losses": losses,
+            "draws": draws,
+            "win_rate": rate(wins, plays),
+            "loss_rate": rate(losses, plays),
+            "draw_rate": rate(draws, plays),
+            "points_issued": int(report.points.sum()),
+            "users": len(report.user_ids),
+            "active_users": int((report.user_plays > 0).sum()),
+            "avg_dau": round(float(report.dau.mean()), 1) if len(report.dau) else 0,
+        },
+        "daily": [
+            {"day": str(daily["day"][i]), "plays": int(daily["plays"][i]), "dau": int(daily["dau"][i]),
+             "wins": int(daily["wins"][i]), "losses": int(daily["losses"][i]), "draws": int(daily["draws"][i]),
+             "points": int(daily["points"][i]), "points_total": int(points_total[i])}
+            for i in range(len(daily["day"]))[recent]
+        ],
+        "cohorts": cohort_rows[-summary_weeks:],
+        "inviters": report.inviters(top_inviters),
+    }
+
+
+def write_snapshot(path, data, fmt):
+    if fmt == "parquet":
+        table = pyarrow.table({name: values for name, values in data.items()})
+        pyarrow.parquet.write_table(table, path + ".parquet", compression="zstd")
+    else:
+        np.savez_compressed(path + ".npz", **data)
+
+
+def write_json(path, data):
+    """先写临时文件再改名，/admin/analytics 不会读到写了一半的文件"""
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def connect(dsn):
+    conn = psycopg2.connect(dsn, application_name="dice-analytics")
+    with conn.cursor() as c:
+        c.execute("SET default_transaction_read_only = on")
+        # 报表是批处理，不受线上的 statement_timeout 限制
+        c.execute("SET statement_timeout = 0")
+    conn.commit()
+    return conn
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="game_logs 离线统计报表")
+    parser.add_argument("--since", type=date.fromisoformat, help="默认从最早的记录开始（不含没有时间的旧记录）")
+    parser.add_argument("--until", type=date.fromisoformat, help="不含这一天，默认今天")
+    parser.add_argument("--chunk-days", type=int, default=7, help="每条 COPY 导出的天数")
+    parser.add_argument("--chunk-mb", type=float, default=16, help="每攒够这么多 MB 的 COPY 输出解析一次")
+    parser.add_argument("--pause", type=float, default=0.0, help="每段之间暂停的秒数")
+    parser.add_argument("--format", choices=("npz", "parquet"), default="npz")
+    parser.add_argument("--output-dir", default=config.ANALYTICS_DIR)
+    parser.add_argument("--summary-days", type=int, default=30, help="summary.json 里保留最近多少天的每日数据")
+    parser.add_argument("--summary-weeks", type=int, default=12, help="summary.json 里保留最近多少个注册周")
+    parser.add_argument("--top-inviters", type=int, default=20)
+    args = parser.parse_args(argv[1:])
+
+    if args.format == "parquet" and pyarrow is None:
+        print("--format parquet 需要先 pip install pyarrow")
+        return 1
+    dsn = config.ANALYTICS_DATABASE_URL or config.DATABASE_URL
+    if not dsn:
+        print("请配置 ANALYTICS_DATABASE_URL 或 DATABASE_URL")
+        return 1
+    if not config.ANALYTICS_DATABASE_URL:
+        print("⚠️ 未配置 ANALYTICS_DATABASE_URL，直接读主库")
+
+    started = time.perf_counter()
+    chunk_bytes = int(args.chunk_mb * 1024 * 1024)
+    conn = connect(dsn)
+    try:
+        with conn.cursor() as c:
+            c.execute(RANGE_SQL)
+            first, last = c.fetchone()
+        conn.commit()
+        until = args.until or date.today()
+        since = args.since or first or until
+        if since >= until:
+            print(f"没有可统计的日期（{since} – {until}）")
+            return 1
+
+        users = []
+        copy_chunks(conn, USERS_COPY_SQL, 3, users.append, chunk_bytes)
+        users = np.concatenate(users) if users else np.empty((0, 3), dtype=np.int64)
+        report = Report(day_number(since), day_number(until) - 1, users)
+
+        rows = 0
+        start = since
+        while start < until:
+            end = min(start + timedelta(days=args.chunk_days), until)
+            query = sql.SQL(LOGS_COPY_SQL).format(start=sql.Literal(start), end=sql.Literal(end)).as_string(conn)
+            report.start_segment(day_number(start), (end - start).days)
+            rows += copy_chunks(conn, query, 4, report.add_logs, chunk_bytes)
+            report.end_segment()
+            print(f"{start} – {end - timedelta(days=1)}：累计 {rows} 条")
+            start = end
+            if args.pause and start < until:
+                time.sleep(args.pause)
+    finally:
+        conn.close()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    write_snapshot(os.path.join(args.output_dir, "daily"), report.daily(), args.format)
+    write_snapshot(os.path.join(args.output_dir, "users"), report.users(), args.format)
+    write_snapshot(os.path.join(args.output_dir, "cohorts"), report.cohorts(), args.format)
+    elapsed = time.perf_counter() - started
+    summary = summarize(report, since, until, args.summary_days, args.summary_weeks, args.top_inviters,
+                        elapsed, rows)
+    if report.unknown_rows:
+        summary["totals"]["deleted_user_rows"] = report.unknown_rows
+    write_json(os.path.join(args.output_dir, "summary.json"), summary)
+
+    totals = summary["totals"]
+    print(f"✅ {rows} 条记录，{totals['users']} 个用户，用时 {elapsed:.1f}s，结果在 {args.output_dir}")
+    print(f"胜 / 负 / 平：{totals['win_rate']} / {totals['loss_rate']} / {totals['draw_rate']}，"
+          f"净发放积分 {totals['points_issued']}，平均日活 {totals['avg_dau']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
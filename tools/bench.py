@@ -0,0 +1,448 @@
+"""
+Web 路由和 bot handler 的基准测试，结果输出为 JSON，便于前后两次提交对比。
+
+    BENCH_DATABASE_URL=postgresql://postgres@127.0.0.1:5432/postgres \
+        python tools/bench.py --users 20000 --logs 500000 --requests 2000 --concurrency 8 \
+        --output bench.json --compare baseline.json
+
+每次运行在 BENCH_DATABASE_URL 所在的服务器上新建一个临时库 dice_bench_<pid>，
+执行迁移并用 generate_series 灌入 --users 个用户和 --logs 条游戏记录，结束后删除
+（--keep 保留）。不会碰 DATABASE_URL 指向的库。
+
+默认在进程内通过 Flask test_client 调用路由；指定 --base-url 时改为请求已启动的
+服务（例如 gunicorn），此时服务端需要自己指向同一个临时库，配合 --keep 和 --reuse 使用。
+bot handler 使用假的 Telegram 请求层直接调用，不会访问网络。
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import threading
+import subprocess
+from types import SimpleNamespace
+from urllib.parse import urlsplit, urlunsplit
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+import fake_bot_api
+from webhook_stub import make_command_update, make_callback_update, percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WEB_SCENARIOS = ["login", "dice", "dice_play", "admin", "admin_rank_today", "user_logs"]
+BOT_SCENARIOS = ["start", "help", "share", "rank", "invitees", "contact", "menu_rank"]
+
+SEED_SQL = """
+    INSERT INTO users (user_id, username, phone, points, plays, last_game_time, created_at, invited_by)
+    SELECT i, 'user' || i, '1' || lpad(i::text, 10, '0'),
+           (random() * 1000)::int, 0, NULL,
+           now() - random() * interval '90 days',
+           CASE WHEN i > 1 AND random() < 0.3 THEN 1 + (random() * (i - 2))::bigint END
+    FROM generate_series(1, %(users)s) AS i;
+
+    INSERT INTO game_logs (user_id, user_roll, bot_roll, result, timestamp)
+    SELECT 1 + (random() * (%(users)s - 1))::bigint,
+           1 + (random() * 5)::int, 1 + (random() * 5)::int,
+           (ARRAY['你赢了！+10', '你输了！-5', '平局'])[1 + (random() * 2)::int],
+           now() - random() * interval '30 days'
+    FROM generate_series(1, %(logs)s);
+
+    INSERT INTO user_daily_stats (day, user_id, plays, points, wins, losses, draws)
+    SELECT timestamp::date, user_id, COUNT(*),
+           SUM(CASE result WHEN '你赢了！+10' THEN 10 WHEN '你输了！-5' THEN -5 ELSE 0 END),
+           COUNT(*) FILTER (WHERE result = '你赢了！+10'),
+           COUNT(*) FILTER (WHERE result = '你输了！-5'),
+           COUNT(*) FILTER (WHERE result = '平局')
+    FROM game_logs
+    GROUP BY timestamp::date, user_id
+    ON CONFLICT (day, user_id) DO NOTHING;
+
+    -- 邀请关系只指向更小的 user_id，不会有环
+    INSERT INTO referral_paths (ancestor_id, descendant_id, depth)
+    WITH RECURSIVE up (descendant_id, ancestor_id, depth) AS (
+        SELECT user_id, invited_by, 1 FROM users WHERE invited_by IS NOT NULL
+        UNION ALL
+        SELECT up.descendant_id, u.invited_by, up.depth + 1
+        FROM up JOIN users u ON u.user_id = up.ancestor_id
+        WHERE u.invited_by IS NOT NULL
+    )
+    SELECT ancestor_id, descendant_id, depth FROM up;
+
+    INSERT INTO referral_counts (user_id, direct_count, total_count)
+    SELECT ancestor_id, COUNT(*) FILTER (WHERE depth = 1), COUNT(*)
+    FROM referral_paths
+    GROUP BY ancestor_id;
+
+    ANALYZE;
+"""
+
+
+# --- 临时数据库 ---
+def with_database(dsn, dbname):
+    parts = urlsplit(dsn)
+    return urlunsplit((parts.scheme, parts.netloc, f"/{dbname}", parts.query, parts.fragment))
+
+
+def admin_execute(dsn, sql):
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as c:
+            c.execute(sql)
+    finally:
+        conn.close()
+
+
+def create_database(server_dsn, dbname, reuse):
+    if not reuse:
+        admin_execute(server_dsn, f'DROP DATABASE IF EXISTS "{dbname}"')
+        admin_execute(server_dsn, f'CREATE DATABASE "{dbname}"')
+    return with_database(server_dsn, dbname)
+
+
+def drop_database(server_dsn, dbname):
+    admin_execute(server_dsn, f'DROP DATABASE IF EXISTS "{dbname}" WITH (FORCE)')
+
+
+def seed(users, logs):
+    from db import get_conn
+    from housekeeping import maintain_game_log_partitions
+    start = time.perf_counter()
+    with get_conn() as conn, conn.cursor() as c:
+        c.execute(SEED_SQL, {"users": users, "logs": logs})
+    # 灌入的历史记录先落在默认分区，和线上一样由分区任务搬到各月分区
+    maintain_game_log_partitions()
+    with get_conn() as conn, conn.cursor() as c:
+        c.execute("ANALYZE game_logs")
+    return time.perf_counter() - start
+
+
+# --- 统计 ---
+def summarize(latencies, errors, elapsed, statuses):
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        "requests": count,
+        "errors": errors,
+        "statuses": statuses,
+        "seconds": round(elapsed, 3),
+        "throughput": round(count / elapsed, 1) if elapsed else 0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p90_ms": round(percentile(latencies, 90) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+    }
+
+
+# --- Web ---
+class InProcessClient:
+    """Flask test_client，每个线程一个，各自保存 session cookie"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        resp = self.client.open(path, method=method, data=data)
+        resp.get_data()
+        return resp.status_code
+
+
+class HttpClient:
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+
+    def request(self, method, path, data=None):
+        resp = self.session.request(method, self.base_url + path, data=data, allow_redirects=False)
+        return resp.status_code
+
+
+def web_request(client, scenario, users, rng):
+    """返回要计时的 (method, path, data)；需要登录的场景先在这里登录，不计入耗时"""
+    uid = rng.randint(1, users)
+    if scenario == "login":
+        return "POST", "/login", {"phone": "1" + str(uid).zfill(10)}
+    if scenario == "dice":
+        return "GET", f"/dice?uid={uid}", None
+    if scenario == "dice_play":
+        client.request("GET", f"/dice?uid={uid}")
+        return "POST", "/dice/play", None
+    if scenario == "admin":
+        return "GET", "/admin", None
+    if scenario == "admin_rank_today":
+        return "GET", "/admin/rank/today", None
+    if scenario == "user_logs":
+        return "GET", f"/user/logs?user_id={uid}", None
+    raise ValueError(scenario)
+
+
+def run_web_scenario(make_client, scenario, users, total, concurrency, seed_value):
+    latencies = []
+    statuses = {}
+    errors = 0
+    lock = threading.Lock()
+    per_worker = [total // concurrency + (1 if i < total % concurrency else 0) for i in range(concurrency)]
+
+    def worker(index, count):
+        nonlocal errors
+        client = make_client()
+        rng = random.Random(seed_value * 1000 + index)
+        for _ in range(count):
+            method, path, data = web_request(client, scenario, users, rng)
+            start = time.perf_counter()
+            try:
+                status = client.request(method, path, data)
+            except Exception:
+                with lock:
+                    errors += 1
+                continue
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+                if status >= 500:
+                    errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for f in [pool.submit(worker, i, n) for i, n in enumerate(per_worker) if n]:
+            f.result()
+    return summarize(latencies, errors, time.perf_counter() - start, statuses)
+
+
+# --- Bot ---
+def make_fake_request():
+    from telegram.request import BaseRequest
+
+    class FakeRequest(BaseRequest):
+        """代替 HTTP 请求层，按 fake_bot_api 的规则直接返回结果"""
+
+        async def initialize(self):
+            pass
+
+        async def shutdown(self):
+            pass
+
+        async def do_request(self, url, method, request_data=None, read_timeout=None,
+                             write_timeout=None, connect_timeout=None, pool_timeout=None):
+            payload = request_data.parameters if request_data else {}
+            api_method = url.rsplit("/", 1)[-1]
+            body = {"ok": True, "result": fake_bot_api.method_result(api_method, payload)}
+            return 200, json.dumps(body).encode()
+
+    return FakeRequest()
+
+
+def make_contact_update(update_id, chat_id):
+    update = make_command_update(update_id, chat_id, "/start")
+    message = update["message"]
+    del message["text"], message["entities"]
+    message["contact"] = {"phone_number": "2" + str(chat_id).zfill(10), "first_name": f"user{chat_id}",
+                          "user_id": chat_id}
+    return update
+
+
+def bot_update(scenario, update_id, chat_id, users, rng):
+    """返回 (handler 名, update 字典, context.args)"""
+    if scenario == "start":
+        inviter = rng.randint(1, users)
+        return "start", make_command_update(update_id, chat_id, f"/start inviter_{inviter}"), [f"inviter_{inviter}"]
+    if scenario == "help":
+        return "help_command", make_command_update(update_id, chat_id, "/help"), []
+    if scenario == "share":
+        return "share", make_command_update(update_id, chat_id, "/share"), []
+    if scenario == "rank":
+        return "show_rank", make_command_update(update_id, chat_id, "/rank"), []
+    if scenario == "invitees":
+        return "invitees", make_command_update(update_id, chat_id, "/invitees"), []
+    if scenario == "contact":
+        return "contact_handler", make_contact_update(update_id, chat_id), []
+    if scenario == "menu_rank":
+        return "handle_menu_button", make_callback_update(update_id, chat_id, "rank"), []
+    raise ValueError(scenario)
+
+
+async def run_bot_scenario(bot_module, tg_bot, scenario, users, total, concurrency, seed_value):
+    from telegram import Update
+
+    rng = random.Random(seed_value)
+    jobs = []
+    for i in range(total):
+        # 聊天 id 用已有用户（邀请、排行榜查询都能命中）；contact 用新用户，避免手机号冲突
+        chat_id = users + 1 + i if scenario == "contact" else rng.randint(1, users)
+        handler, data, args = bot_update(scenario, i + 1, chat_id, users, rng)
+        # 与 build_application 注册时一样套上统计包装
+        jobs.append((bot_module.metrics.instrument_handler(getattr(bot_module, handler)),
+                     Update.de_json(data, tg_bot), args))
+
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(handler, update, args):
+        nonlocal errors
+        context = SimpleNamespace(bot=tg_bot, args=args)
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await handler(update, context)
+            except Exception:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run(*job) for job in jobs))
+    return summarize(latencies, errors, time.perf_counter() - start, {})
+
+
+async def run_bot(scenarios, users, total, concurrency, seed_value):
+    import bot as bot_module
+    from telegram import Bot
+
+    tg_bot = Bot("123456:bench", request=make_fake_request(), get_updates_request=make_fake_request())
+    results = {}
+    async with tg_bot:
+        for scenario in scenarios:
+            results[scenario] = await run_bot_scenario(bot_module, tg_bot, scenario, users, total,
+                                                       concurrency, seed_value)
+            print(f"  bot {scenario}: {results[scenario]['p50_ms']} / {results[scenario]['p99_ms']} ms",
+                  file=sys.stderr)
+    bot_module.DB_EXECUTOR.shutdown(wait=True)
+    return results
+
+
+# --- 对比 ---
+def compare(current, baseline):
+    """p50/p99/吞吐相对 baseline 的变化（百分比，正数表示变慢/变少）"""
+    diff = {}
+    for group in ("web", "bot"):
+        for name, cur in current.get(group, {}).items():
+            old = baseline.get(group, {}).get(name)
+            if not old:
+                continue
+            row = {}
+            for key in ("p50_ms", "p99_ms", "throughput"):
+                if old.get(key):
+                    row[key] = round((cur[key] - old[key]) / old[key] * 100, 1)
+            diff[f"{group}.{name}"] = row
+    return diff
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def pick(value, choices):
+    names = [n.strip() for n in value.split(",") if n.strip()] if value else choices
+    unknown = set(names) - set(choices)
+    if unknown:
+        raise SystemExit(f"未知场景: {', '.join(sorted(unknown))}（可选 {', '.join(choices)}）")
+    return names
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Web 路由和 bot handler 基准测试")
+    parser.add_argument("--dsn", default=os.getenv("BENCH_DATABASE_URL"),
+                        help="Postgres 服务器连接串，临时库建在这台服务器上（默认 BENCH_DATABASE_URL）")
+    parser.add_argument("--dbname", default=f"dice_bench_{os.getpid()}")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--logs", type=int, default=200000)
+    parser.add_argument("--requests", type=int, default=1000, help="每个场景的请求数")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--web", default=None, help=f"逗号分隔，默认全部：{','.join(WEB_SCENARIOS)}")
+    parser.add_argument("--bot", default=None, help=f"逗号分隔，默认全部：{','.join(BOT_SCENARIOS)}")
+    parser.add_argument("--skip-bot", action="store_true")
+    parser.add_argument("--base-url", default=None, help="压测已启动的服务，而不是进程内调用")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--keep", action="store_true", help="结束后保留临时库")
+    parser.add_argument("--reuse", action="store_true", help="复用已存在的临时库，不重新建库灌数据")
+    parser.add_argument("--output", default=None, help="结果写入文件（默认打印到 stdout）")
+    parser.add_argument("--compare", default=None, help="与之前保存的结果对比")
+    args = parser.parse_args(argv[1:])
+
+    if not args.dsn:
+        raise SystemExit("请通过 --dsn 或 BENCH_DATABASE_URL 指定 Postgres 服务器")
+    web_scenarios = pick(args.web, WEB_SCENARIOS)
+    bot_scenarios = [] if args.skip_bot else pick(args.bot, BOT_SCENARIOS)
+
+    # 必须在导入项目模块之前设置，config 在导入时读取环境变量
+    database_url = create_database(args.dsn, args.dbname, args.reuse)
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("BOT_TOKEN", "123456:bench")
+    # 所有请求来自同一个 IP，不关闭限流的话大部分会被 429
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+    os.environ.setdefault("DB_POOL_MAX", str(max(10, args.concurrency + 2)))
+    sys.path.insert(0, ROOT)
+    random.seed(args.seed)
+
+    try:
+        from migrations import run_migrations
+        run_migrations()
+        seed_seconds = 0.0
+        if not args.reuse:
+            print(f"灌入 {args.users} 个用户、{args.logs} 条记录 ...", file=sys.stderr)
+            seed_seconds = seed(args.users, args.logs)
+
+        results = {
+            "meta": {
+                "revision": git_revision(),
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "target": args.base_url or "in-process",
+                "users": args.users,
+                "logs": args.logs,
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+                "seed_seconds": round(seed_seconds, 2),
+            },
+            "web": {},
+            "bot": {},
+        }
+
+        if args.base_url:
+            make_client = lambda: HttpClient(args.base_url)
+        else:
+            from main import app
+            make_client = lambda: InProcessClient(app)
+
+        for scenario in web_scenarios:
+            results["web"][scenario] = run_web_scenario(make_client, scenario, args.users, args.requests,
+                                                        args.concurrency, args.seed)
+            print(f"  web {scenario}: {results['web'][scenario]['p50_ms']} / "
+                  f"{results['web'][scenario]['p99_ms']} ms", file=sys.stderr)
+
+        if bot_scenarios:
+            results["bot"] = asyncio.run(run_bot(bot_scenarios, args.users, args.requests,
+                                                 args.concurrency, args.seed))
+
+        if args.compare:
+            with open(args.compare, encoding="utf-8") as f:
+                results["compare"] = compare(results, json.load(f))
+    finally:
+        if not args.keep:
+            from db import get_pool
+            get_pool().closeall()
+            drop_database(args.dsn, args.dbname)
+
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
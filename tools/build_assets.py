@@ -0,0 +1,149 @@
+"""
+静态资源构建：把 static/ 下的源文件处理后写入 static/dist/，并生成 manifest.json。
+
+    pip install Pillow brotli   # 只在构建时需要，线上不需要
+    python tools/build_assets.py [--image-size 300] [--check]
+
+- PNG 缩放到 --image-size（页面上显示 100px，3 倍屏足够），输出 WebP 和 256 色 PNG（不支持 WebP 的浏览器用）
+- CSS / JS 原样输出，另外生成 .gz 和 .br（装了 brotli 时）预压缩版本
+- 文件名带内容哈希（dice-1.3f9a0c2b1e.webp），内容变了名字就变，线上可以长期缓存
+- 旧的构建产物会被删除
+
+构建结果提交到仓库（Heroku 上没有构建步骤）。修改了 static/ 下的文件后重新运行；
+--check 只检查 dist 是否与源文件一致，不一致时返回 1，可放在 CI 里。
+"""
+import os
+import io
+import sys
+import json
+import gzip
+import hashlib
+import argparse
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATIC_DIR = os.path.join(ROOT, "static")
+DIST_DIR = os.path.join(STATIC_DIR, "dist")
+MANIFEST = "manifest.json"
+
+TEXT_TYPES = (".css", ".js", ".svg", ".json")
+# 太小的文件压缩后省不了多少，还多一次 stat
+MIN_COMPRESS_SIZE = 256
+
+
+def hashed_name(name, data, ext):
+    """"dice 1.png" -> "dice-1.<hash>.webp"（文件名里的空格换成 -）"""
+    stem = os.path.splitext(name)[0].replace(" ", "-")
+    digest = hashlib.sha256(data).hexdigest()[:10]
+    return f"{stem}.{digest}{ext}"
+
+
+def build_image(path, size):
+    """返回 [(扩展名, 内容)]：WebP 和调色板 PNG"""
+    with Image.open(path) as im:
+        im = im.convert("RGBA")
+        if max(im.size) > size:
+            im.thumbnail((size, size), Image.LANCZOS)
+
+        webp = io.BytesIO()
+        im.save(webp, "WEBP", quality=85, method=6)
+
+        png = io.BytesIO()
+        im.quantize(256, method=Image.Quantize.FASTOCTREE).save(png, "PNG", optimize=True)
+    return [(".webp", webp.getvalue()), (".png", png.getvalue())]
+
+
+def compressed_variants(data):
+    if len(data) < MIN_COMPRESS_SIZE:
+        return []
+    variants = [(".gz", gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append((".br", brotli.compress(data, quality=11)))
+    return variants
+
+
+def build(size):
+    """返回 (manifest, {输出文件名: 内容})，不写文件"""
+    manifest = {}
+    outputs = {}
+    for name in sorted(os.listdir(STATIC_DIR)):
+        path = os.path.join(STATIC_DIR, name)
+        if not os.path.isfile(path):
+            continue
+        ext = os.path.splitext(name)[1].lower()
+
+        if ext == ".png":
+            if Image is None:
+                raise SystemExit("需要 Pillow：pip install Pillow")
+            stem = os.path.splitext(name)[0]
+            for out_ext, data in build_image(path, size):
+                out = hashed_name(name, data, out_ext)
+                outputs[out] = data
+                manifest[stem + out_ext] = out
+        elif ext in TEXT_TYPES:
+            with open(path, "rb") as f:
+                data = f.read()
+            out = hashed_name(name, data, ext)
+            outputs[out] = data
+            manifest[name] = out
+            for suffix, compressed in compressed_variants(data):
+                # 压缩后反而更大的不要
+                if len(compressed) < len(data):
+                    outputs[out + suffix] = compressed
+
+    outputs[MANIFEST] = (json.dumps(manifest, indent=2, sort_keys=True, ensure_ascii=False) + "\n").encode()
+    return manifest, outputs
+
+
+def existing_outputs():
+    if not os.path.isdir(DIST_DIR):
+        return {}
+    result = {}
+    for name in os.listdir(DIST_DIR):
+        with open(os.path.join(DIST_DIR, name), "rb") as f:
+            result[name] = f.read()
+    return result
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="构建 static/dist")
+    parser.add_argument("--image-size", type=int, default=300, help="图片最长边（像素）")
+    parser.add_argument("--check", action="store_true", help="只检查 dist 是否需要重新构建")
+    args = parser.parse_args(argv[1:])
+
+    manifest, outputs = build(args.image_size)
+    current = existing_outputs()
+
+    if args.check:
+        if current != outputs:
+            print("static/dist 已过期，请运行 python tools/build_assets.py", file=sys.stderr)
+            return 1
+        return 0
+
+    os.makedirs(DIST_DIR, exist_ok=True)
+    for name, data in outputs.items():
+        if current.get(name) != data:
+            with open(os.path.join(DIST_DIR, name), "wb") as f:
+                f.write(data)
+    for name in set(current) - set(outputs):
+        os.remove(os.path.join(DIST_DIR, name))
+
+    source = sum(os.path.getsize(os.path.join(STATIC_DIR, n)) for n in os.listdir(STATIC_DIR)
+                 if os.path.isfile(os.path.join(STATIC_DIR, n)))
+    for logical, name in sorted(manifest.items()):
+        print(f"{logical:<16} -> {name:<28} {len(outputs[name]):>8} B")
+    print(f"源文件共 {source} B，删除旧文件 {len(set(current) - set(outputs))} 个")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,135 @@
+"""
+骰子引擎的分布检验和吞吐量测试：
+
+    python tools/dice_stats.py [--rolls 1000000] [--engines secrets,seeded,fair,random] [--threads 4] [--output stats.json]
+
+对每个引擎生成 --rolls 局（每局两个点数），输出：
+- 吞吐量（局/秒），--threads > 1 时多个线程同时取，看锁竞争
+- 单个点数的卡方检验（自由度 5）和两个点数组合的卡方检验（自由度 35），检验是否均匀、两颗骰子是否独立
+- 相邻点数的自相关系数（应接近 0）
+卡方统计量超过 p = 0.001 的临界值判为不通过。random 是原来用的全局 random.randint，只作对照。
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dice_engine  # noqa: E402
+
+# p = 0.001 的卡方临界值
+CHI2_CRITICAL = {5: 20.515, 35: 66.619}
+FAIR_DAY = date(2024, 1, 1)
+
+
+class RandomEngine:
+    needs_nonce = False
+
+    def roll(self, user_id=None, day=None, nonce=None):
+        return random.randint(1, 6), random.randint(1, 6)
+
+
+def make_engine(name, buffer_size):
+    if name == "random":
+        return RandomEngine()
+    return dice_engine.create_engine(name, seed=0, secret="dice-stats", buffer_size=buffer_size)
+
+
+def generate(engine, rolls, threads):
+    """返回 ([(玩家, 机器人)], 耗时秒)"""
+    results = [None] * threads
+    per_thread = rolls // threads
+
+    def work(index):
+        base = index * per_thread
+        out = []
+        if engine.needs_nonce:
+            # 与线上相同：每个用户每天 10 局
+            for i in range(base, base + per_thread):
+                out.append(engine.roll(i // 10, FAIR_DAY, i % 10 + 1))
+        else:
+            for _ in range(per_thread):
+                out.append(engine.roll())
+        results[index] = out
+
+    workers = [threading.Thread(target=work, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - started
+    return [pair for part in results for pair in part], elapsed
+
+
+def chi_square(counts, expected):
+    return sum((observed - expected) ** 2 / expected for observed in counts)
+
+
+def serial_correlation(values):
+    n = len(values)
+    mean = sum(values) / n
+    var = sum((v - mean) ** 2 for v in values)
+    cov = sum((values[i] - mean) * (values[i + 1] - mean) for i in range(n - 1))
+    return cov / var if var else 0.0
+
+
+def analyze(pairs):
+    faces = [0] * 6
+    combos = [0] * 36
+    sequence = []
+    for user_roll, bot_roll in pairs:
+        faces[user_roll - 1] += 1
+        faces[bot_roll - 1] += 1
+        combos[(user_roll - 1) * 6 + bot_roll - 1] += 1
+        sequence.append(user_roll)
+        sequence.append(bot_roll)
+
+    chi2_faces = chi_square(faces, len(pairs) * 2 / 6)
+    chi2_pairs = chi_square(combos, len(pairs) / 36)
+    return {
+        "faces": faces,
+        "chi2_faces": round(chi2_faces, 3),
+        "chi2_pairs": round(chi2_pairs, 3),
+        "serial_correlation": round(serial_correlation(sequence), 5),
+        "passed": chi2_faces < CHI2_CRITICAL[5] and chi2_pairs < CHI2_CRITICAL[35],
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="骰子引擎分布检验 / 吞吐量")
+    parser.add_argument("--rolls", type=int, default=1000000)
+    parser.add_argument("--engines", default="secrets,seeded,fair,random")
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--buffer-size", type=int, default=4096)
+    parser.add_argument("--output", help="结果写入 JSON 文件")
+    args = parser.parse_args(argv[1:])
+
+    report = {"rolls": args.rolls, "threads": args.threads, "engines": {}}
+    failed = False
+    for name in args.engines.split(","):
+        engine = make_engine(name, args.buffer_size)
+        pairs, elapsed = generate(engine, args.rolls, args.threads)
+        result = analyze(pairs)
+        result["seconds"] = round(elapsed, 3)
+        result["rolls_per_second"] = round(len(pairs) / elapsed)
+        result["us_per_roll"] = round(elapsed / len(pairs) * 1e6, 3)
+        report["engines"][name] = result
+        failed = failed or not result["passed"]
+        print(f"{name:<8} {result['rolls_per_second']:>10} 局/秒  {result['us_per_roll']:>7} µs/局  "
+              f"χ²(5)={result['chi2_faces']:<8} χ²(35)={result['chi2_pairs']:<8} "
+              f"r1={result['serial_correlation']:<8} {'通过' if result['passed'] else '不通过'}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
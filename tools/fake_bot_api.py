@@ -0,0 +1,121 @@
+"""
+本地假 Telegram Bot API，用于联调 notifier / bot 和压测，不会真的发消息。
+
+    python tools/fake_bot_api.py --port 8081 --rate-limit 0.1 --latency 0.05
+    TELEGRAM_API_BASE=http://127.0.0.1:8081 python main.py
+    TELEGRAM_API_BASE=http://127.0.0.1:8081 BOT_MODE=webhook python bot.py
+
+--rate-limit 为返回 429 的概率，--latency 模拟 Telegram 的响应耗时。
+GET /stats 返回收到的请求数。
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from urllib.parse import parse_qsl
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+stats = {"requests": 0, "ok": 0, "rate_limited": 0}
+stats_lock = threading.Lock()
+
+BOT_USER = {"id": 100000001, "is_bot": True, "first_name": "FakeBot", "username": "fake_dice_bot"}
+
+# 返回 Message 的方法，其余方法一律返回 True
+MESSAGE_METHODS = {"sendMessage", "editMessageText", "editMessageReplyMarkup", "sendPhoto"}
+
+
+def parse_payload(content_type, body):
+    if not body:
+        return {}
+    if content_type.startswith("application/json"):
+        return json.loads(body)
+    if content_type.startswith("application/x-www-form-urlencoded"):
+        return dict(parse_qsl(body.decode()))
+    return {}  # multipart 等，假服务不关心内容
+
+
+def method_result(method, payload):
+    if method == "getMe":
+        return BOT_USER
+    if method in MESSAGE_METHODS:
+        try:
+            chat_id = int(payload.get("chat_id", 0))
+        except ValueError:
+            chat_id = 0
+        return {
+            "message_id": stats["ok"],
+            "chat": {"id": chat_id, "type": "private"},
+            "date": int(time.time()),
+            "text": payload.get("text", ""),
+        }
+    return True
+
+
+def make_handler(rate_limit, latency, retry_after):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # 支持 keep-alive
+
+        def _reply(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                with stats_lock:
+                    self._reply(200, dict(stats))
+            else:
+                self._reply(404, {"ok": False})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            payload = parse_payload(self.headers.get("Content-Type", ""), self.rfile.read(length))
+            method = self.path.rsplit("/", 1)[-1]
+            time.sleep(latency)
+            with stats_lock:
+                stats["requests"] += 1
+            if method == "sendMessage" and random.random() < rate_limit:
+                with stats_lock:
+                    stats["rate_limited"] += 1
+                self._reply(429, {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {retry_after}",
+                    "parameters": {"retry_after": retry_after},
+                })
+                return
+            with stats_lock:
+                stats["ok"] += 1
+            self._reply(200, {"ok": True, "result": method_result(method, payload)})
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="本地假 Telegram Bot API")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="返回 429 的概率")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的模拟耗时（秒）")
+    args = parser.parse_args(argv[1:])
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port),
+                                 make_handler(args.rate_limit, args.latency, args.retry_after))
+    print(f"fake Bot API listening on http://127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
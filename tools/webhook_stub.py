@@ -0,0 +1,129 @@
+"""
+向本地 webhook 模式的 bot 发送模拟的 Telegram 更新，用于验证并发处理和压测。
+
+    python tools/fake_bot_api.py --port 8081 &
+    TELEGRAM_API_BASE=http://127.0.0.1:8081 BOT_MODE=webhook BOT_WEBHOOK_PORT=8443 \
+        BOT_WEBHOOK_SECRET=s3cret python bot.py &
+    python tools/webhook_stub.py --url http://127.0.0.1:8443/telegram --secret s3cret \
+        --chats 50 --updates 1000 --concurrency 32
+
+每个聊天轮流发送 /start、/help、/share 和菜单按钮回调，最后打印吞吐和延迟（JSON）。
+"""
+import sys
+import json
+import time
+import argparse
+import itertools
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+COMMANDS = ["/start", "/help", "/share", "/rank"]
+CALLBACKS = ["help", "share", "rank"]
+
+
+def make_user(chat_id):
+    return {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}", "username": f"user{chat_id}"}
+
+
+def make_command_update(update_id, chat_id, text):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": make_user(chat_id),
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}],
+        },
+    }
+
+
+def make_callback_update(update_id, chat_id, data):
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": make_user(chat_id),
+            "chat_instance": str(chat_id),
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": "menu",
+            },
+        },
+    }
+
+
+def generate_updates(count, chats):
+    update_ids = itertools.count(1)
+    for i in range(count):
+        chat_id = 1000 + i % chats
+        update_id = next(update_ids)
+        if i % 2 == 0:
+            yield make_command_update(update_id, chat_id, COMMANDS[(i // 2) % len(COMMANDS)])
+        else:
+            yield make_callback_update(update_id, chat_id, CALLBACKS[(i // 2) % len(CALLBACKS)])
+
+
+def post(url, secret, update):
+    data = json.dumps(update).encode()
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    if secret:
+        req.add_header("X-Telegram-Bot-Api-Secret-Token", secret)
+    start = time.perf_counter()
+    with urllib.request.urlopen(req, timeout=30) as resp:
+        resp.read()
+        status = resp.status
+    return status, time.perf_counter() - start
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="模拟 Telegram 向 webhook 推送更新")
+    parser.add_argument("--url", default="http://127.0.0.1:8443/telegram")
+    parser.add_argument("--secret", default=None)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--updates", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args(argv[1:])
+
+    updates = list(generate_updates(args.updates, args.chats))
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [pool.submit(post, args.url, args.secret, u) for u in updates]
+        for f in futures:
+            try:
+                status, latency = f.result()
+            except Exception:
+                errors += 1
+                continue
+            if status != 200:
+                errors += 1
+            latencies.append(latency)
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(json.dumps({
+        "updates": len(updates),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(updates) / elapsed, 1) if elapsed else 0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }, indent=2))
+    return 0 if errors == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
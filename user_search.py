@@ -0,0 +1,61 @@
+"""
+后台的即时搜索（/admin/search），输入框每次输入都会调用，所以每一路都必须走索引：
+
+- 纯数字（可带 + 空格 -）：user_id 精确匹配 + 手机号前缀
+- 用户名前缀：lower(username) 的 text_pattern_ops 索引
+- 3 个字符及以上再加任意位置匹配：pg_trgm GIN 索引（迁移 6，扩展不可用时退化为扫描）
+
+结果按 user_id 精确 → 手机号前缀 → 用户名前缀 → 任意位置 排序，最多 MAX_LIMIT 条。
+"""
+import re
+
+from db import get_conn
+import queries
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+# 三元组索引至少需要 3 个字符
+MIN_SUBSTRING_LENGTH = 3
+
+PHONE_CHARS = re.compile(r"[\s\-()+]")
+
+
+def build_search_sql(user_id=False, phone=False, substring=False):
+    branches = []
+    if user_id:
+        branches.append(queries.SEARCH_BRANCHES["user_id"])
+    if phone:
+        branches.append(queries.SEARCH_BRANCHES["phone"])
+    branches.append(queries.SEARCH_BRANCHES["prefix"])
+    if substring:
+        branches.append(queries.SEARCH_BRANCHES["substring"])
+    return queries.SEARCH_USERS_SQL.format(branches="\n        UNION ALL\n        ".join(branches))
+
+
+def search_users(keyword, limit=DEFAULT_LIMIT):
+    """返回 [{"user_id", "username", "phone", "points", "blocked"}]"""
+    keyword = (keyword or "").strip()
+    if not keyword:
+        return []
+    limit = min(max(1, limit), MAX_LIMIT)
+
+    digits = PHONE_CHARS.sub("", keyword)
+    numeric = digits.isdigit()
+    by_id = numeric and int(digits) < 2 ** 63
+    substring = len(keyword) >= MIN_SUBSTRING_LENGTH
+
+    params = {
+        "limit": limit,
+        "search_prefix": queries.like_escape(keyword.lower()) + "%",
+        "search_pattern": "%" + queries.like_escape(keyword) + "%",
+    }
+    if by_id:
+        params["search_id"] = int(digits)
+    if numeric:
+        params["search_phone"] = digits + "%"
+
+    sql = build_search_sql(user_id=by_id, phone=numeric, substring=substring)
+    with get_conn() as conn, conn.cursor() as c:
+        c.execute(sql, params)
+        columns = [desc[0] for desc in c.description]
+        return [dict(zip(columns, row)) for row in c.fetchall()]